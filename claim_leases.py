@@ -0,0 +1,245 @@
+import logging
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+
+from claim_pool import release_claim_candidates
+from sheet_lock import get_sheet_row_lock
+from sheet_normalize import normalize_columns, rename_legacy_columns
+from sheet_range_update import (
+    ROW_VERSION_COLUMN,
+    find_sheet_conflicts,
+    get_gsheets_option,
+    get_row_versions,
+    has_service_account,
+    load_worksheet_snapshot,
+    normalize_cell_for_compare,
+    write_sheet_values,
+)
+from sheet_row_index import ROW_ID_COLUMN
+from sheet_write_journal import get_journal_cells, is_write_behind_enabled
+
+
+CLAIM_LEASE_COLUMN = "claimed_at"
+CLAIM_LEASE_MINUTES = 120
+CLAIM_SWEEP_INTERVAL_SECONDS = 60
+CLAIM_SWEEP_BATCH_ROWS = 200
+CLAIM_SWEEPER_NAME = "sistem (lease habis)"
+# Kolom yang dibaca sweeper: baris dianggap "belum dimulai" bila sudah punya validator
+# tetapi status, instruction_ats, dan output_ats masih kosong.
+CLAIM_LEASE_COLUMNS = ["input", "instruction_ats", "output_ats", "validator", "status", CLAIM_LEASE_COLUMN]
+# Proyeksi snapshot halaman labeling. Sweeper membaca snapshot yang sama, jadi kolom input yang lebar
+# tidak diunduh dua kali.
+LABELING_LOAD_COLUMNS = [
+    "instruction_ats",
+    "input",
+    "output_ats",
+    "validator",
+    "status",
+    "instruksi_ats",
+    "nama_validator",
+    CLAIM_LEASE_COLUMN,
+    ROW_VERSION_COLUMN,
+    ROW_ID_COLUMN,
+]
+
+logger = logging.getLogger(__name__)
+
+
+def get_claim_lease_seconds():
+    # 0 atau negatif mematikan pelepasan otomatis.
+    try:
+        return float(get_gsheets_option("claim_lease_minutes", CLAIM_LEASE_MINUTES)) * 60
+    except (TypeError, ValueError):
+        return CLAIM_LEASE_MINUTES * 60
+
+
+def get_claim_sweep_interval_seconds():
+    try:
+        return max(5.0, float(get_gsheets_option("claim_sweep_interval_seconds", CLAIM_SWEEP_INTERVAL_SECONDS)))
+    except (TypeError, ValueError):
+        return CLAIM_SWEEP_INTERVAL_SECONDS
+
+
+def is_claim_lease_enabled():
+    return get_claim_lease_seconds() > 0 and has_service_account()
+
+
+def format_claim_timestamp(timestamp=None):
+    # Disimpan sebagai epoch detik: USER_ENTERED tidak mengubahnya jadi tanggal berformat locale,
+    # sehingga nilai yang dibaca balik tetap sama persis untuk verifikasi klaim.
+    return str(int(time.time() if timestamp is None else timestamp))
+
+
+def parse_claim_timestamp(value):
+    try:
+        timestamp = float(normalize_cell_for_compare(value))
+    except ValueError:
+        return None
+    return timestamp if timestamp > 0 else None
+
+
+def get_claim_lease_ages(df, now=None):
+    # Umur lease (detik) untuk baris yang sudah diambil tapi belum dimulai; NaN bila belum ada claimed_at.
+    now = time.time() if now is None else now
+    data = normalize_columns(df.reindex(columns=CLAIM_LEASE_COLUMNS, fill_value=""), CLAIM_LEASE_COLUMNS)
+    not_started_mask = (
+        (data["validator"] != "")
+        & (data["status"] == "")
+        & (data["instruction_ats"] == "")
+        & (data["output_ats"] == "")
+    )
+    raw_claimed_at = data.loc[not_started_mask, CLAIM_LEASE_COLUMN]
+    claimed_at = raw_claimed_at.map(parse_claim_timestamp).astype(float)
+    return pd.DataFrame({
+        "validator": data.loc[not_started_mask, "validator"],
+        "has_input": data.loc[not_started_mask, "input"] != "",
+        "raw_claimed_at": raw_claimed_at,
+        "claimed_at": claimed_at,
+        "age_seconds": now - claimed_at,
+    })
+
+
+@st.cache_resource
+def get_claim_lease_store():
+    return {
+        "lock": threading.Lock(),
+        "last_run_at": None,
+        "last_released": 0,
+        "last_stamped": 0,
+        "released": 0,
+        "stamped": 0,
+        "conflicts": 0,
+        "last_error": None,
+    }
+
+
+def build_lease_updates(leases, lease_seconds, now, skipped_rows):
+    # Klaim lama tanpa claimed_at mulai dihitung sekarang; klaim yang lewat batas dilepas.
+    release_values = {}
+    stamp_values = {}
+    expected_by_column = {column: {} for column in CLAIM_LEASE_COLUMNS if column != "input"}
+    for row_index, lease in leases.iterrows():
+        row_index = int(row_index)
+        if row_index in skipped_rows:
+            continue
+
+        if pd.isna(lease["claimed_at"]):
+            stamp_values[(row_index, CLAIM_LEASE_COLUMN)] = format_claim_timestamp(now)
+        elif lease["age_seconds"] >= lease_seconds:
+            release_values[(row_index, "validator")] = ""
+            release_values[(row_index, CLAIM_LEASE_COLUMN)] = ""
+        else:
+            continue
+
+        expected_by_column["validator"][row_index] = lease["validator"]
+        expected_by_column["status"][row_index] = ""
+        expected_by_column["instruction_ats"][row_index] = ""
+        expected_by_column["output_ats"][row_index] = ""
+        expected_by_column[CLAIM_LEASE_COLUMN][row_index] = lease["raw_claimed_at"]
+    return release_values, stamp_values, expected_by_column
+
+
+def write_lease_updates(worksheet, cell_values, expected_values):
+    # Tulis bertahap per CLAIM_SWEEP_BATCH_ROWS baris: satu batchGet cek + satu batchUpdate per batch,
+    # dengan stripe lock baris terkait supaya tidak balapan dengan save validator.
+    row_indices = sorted({row_index for row_index, _ in cell_values})
+    written_rows = []
+    conflict_count = 0
+    for start in range(0, len(row_indices), CLAIM_SWEEP_BATCH_ROWS):
+        batch_rows = row_indices[start:start + CLAIM_SWEEP_BATCH_ROWS]
+        with get_sheet_row_lock(batch_rows, "lepas klaim"):
+            conflicts, latest_values = find_sheet_conflicts(worksheet, batch_rows, expected_values)
+            free_rows = [row_index for row_index in batch_rows if row_index not in conflicts]
+            write_sheet_values(
+                worksheet,
+                {
+                    (row_index, column): value
+                    for (row_index, column), value in cell_values.items()
+                    if row_index in free_rows
+                },
+                updated_by=CLAIM_SWEEPER_NAME,
+                row_versions=get_row_versions(latest_values),
+            )
+        written_rows.extend(free_rows)
+        conflict_count += len(conflicts)
+    return written_rows, conflict_count
+
+
+def sweep_expired_claims(worksheet="Sheet1", pool_name="labeling"):
+    lease_seconds = get_claim_lease_seconds()
+    if lease_seconds <= 0:
+        return {"released": [], "stamped": [], "conflicts": 0}
+
+    df = load_worksheet_snapshot(worksheet, columns=LABELING_LOAD_COLUMNS)
+    if df is None or df.empty:
+        return {"released": [], "stamped": [], "conflicts": 0}
+    df = rename_legacy_columns(df)
+
+    now = time.time()
+    leases = get_claim_lease_ages(df, now)
+
+    # Baris yang masih punya edit di journal lokal jangan dilepas; flush-nya akan mengubah baris itu.
+    skipped_rows = set()
+    if is_write_behind_enabled():
+        skipped_rows = {row_index for row_index, _ in get_journal_cells(worksheet)}
+
+    release_values, stamp_values, expected_values = build_lease_updates(leases, lease_seconds, now, skipped_rows)
+    released_rows, release_conflicts = write_lease_updates(worksheet, release_values, expected_values)
+    stamped_rows, stamp_conflicts = write_lease_updates(worksheet, stamp_values, expected_values)
+
+    # Baris yang dilepas langsung kembali ke antrian klaim tanpa menunggu snapshot di-download ulang.
+    release_claim_candidates(
+        worksheet,
+        pool_name,
+        [row_index for row_index in released_rows if leases.at[row_index, "has_input"]],
+    )
+    return {
+        "released": released_rows,
+        "stamped": stamped_rows,
+        "conflicts": release_conflicts + stamp_conflicts,
+    }
+
+
+def record_sweep_result(result, error=None):
+    store = get_claim_lease_store()
+    with store["lock"]:
+        store["last_run_at"] = time.time()
+        store["last_error"] = error
+        if result is None:
+            return
+        store["last_released"] = len(result["released"])
+        store["last_stamped"] = len(result["stamped"])
+        store["released"] += len(result["released"])
+        store["stamped"] += len(result["stamped"])
+        store["conflicts"] += result["conflicts"]
+
+
+def get_claim_lease_status():
+    store = get_claim_lease_store()
+    with store["lock"]:
+        status = {key: value for key, value in store.items() if key != "lock"}
+    status["lease_seconds"] = get_claim_lease_seconds()
+    status["interval_seconds"] = get_claim_sweep_interval_seconds()
+    return status
+
+
+def run_claim_lease_sweeper():
+    while True:
+        time.sleep(get_claim_sweep_interval_seconds())
+        if not is_claim_lease_enabled():
+            continue
+        try:
+            record_sweep_result(sweep_expired_claims())
+        except Exception as exc:
+            record_sweep_result(None, str(exc))
+            logger.exception("Gagal melepas klaim tugas yang kedaluwarsa.")
+
+
+@st.cache_resource
+def start_claim_lease_sweeper():
+    thread = threading.Thread(target=run_claim_lease_sweeper, name="claim-lease-sweeper", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,266 @@
+import heapq
+import threading
+import time
+
+import streamlit as st
+
+from sheet_lock import get_sheet_pool_lock, get_sheet_row_lock
+from sheet_range_update import (
+    find_sheet_conflicts,
+    get_allowed_values,
+    get_row_versions,
+    normalize_cell_for_compare,
+    read_sheet_cells,
+    write_sheet_values,
+)
+from sheet_snapshot import invalidate_sheet_snapshot
+
+
+CLAIM_MAX_ATTEMPTS = 3
+CLAIM_GROUP_WINDOW_SECONDS = 0.2
+
+
+@st.cache_resource
+def get_claim_pool_store():
+    # Antrian baris kosong per worksheet dan jenis tugas, dipakai bersama semua session di proses ini.
+    return {"lock": threading.Lock(), "pools": {}, "claim_groups": {}}
+
+
+def sync_claim_pool(worksheet, pool_name, loaded_at, build_available_indices):
+    # Antrian dibangun ulang hanya saat snapshot sheet selesai di-download ulang; di antaranya
+    # baris yang kita klaim langsung keluar dari antrian sehingga tidak perlu scan ulang.
+    store = get_claim_pool_store()
+    key = (worksheet, pool_name)
+    with store["lock"]:
+        pool = store["pools"].get(key)
+        if pool is not None and pool["loaded_at"] == loaded_at:
+            return pool
+
+    available_indices = sorted(int(row_index) for row_index in build_available_indices())
+    with store["lock"]:
+        previous_pool = store["pools"].get(key) or {}
+        pool = {
+            "worksheet": worksheet,
+            "name": pool_name,
+            "loaded_at": loaded_at,
+            "built_at": time.time(),
+            "heap": available_indices,
+            "members": set(available_indices),
+            "claimed": previous_pool.get("claimed", 0),
+            "conflicts": previous_pool.get("conflicts", 0),
+            "groups": previous_pool.get("groups", 0),
+            "grouped_requests": previous_pool.get("grouped_requests", 0),
+            "rebuilds": previous_pool.get("rebuilds", 0) + 1,
+        }
+        store["pools"][key] = pool
+        return pool
+
+
+def pop_claim_candidates(pool, count):
+    store = get_claim_pool_store()
+    candidates = []
+    with store["lock"]:
+        while pool["heap"] and len(candidates) < count:
+            row_index = heapq.heappop(pool["heap"])
+            if row_index in pool["members"]:
+                pool["members"].discard(row_index)
+                candidates.append(row_index)
+    return candidates
+
+
+def return_claim_candidates(pool, row_indices):
+    store = get_claim_pool_store()
+    with store["lock"]:
+        for row_index in row_indices:
+            if row_index not in pool["members"]:
+                pool["members"].add(row_index)
+                heapq.heappush(pool["heap"], row_index)
+
+
+def release_claim_candidates(worksheet, pool_name, row_indices):
+    # Baris yang klaimnya dilepas (lease habis) dikembalikan ke antrian yang sedang aktif, jika ada.
+    store = get_claim_pool_store()
+    with store["lock"]:
+        pool = store["pools"].get((worksheet, pool_name))
+    if pool is not None and row_indices:
+        return_claim_candidates(pool, row_indices)
+
+
+def record_claim_result(pool, claimed_count, conflict_count):
+    store = get_claim_pool_store()
+    with store["lock"]:
+        pool["claimed"] += claimed_count
+        pool["conflicts"] += conflict_count
+
+
+def record_claim_group(pool, request_count):
+    store = get_claim_pool_store()
+    with store["lock"]:
+        pool["groups"] += 1
+        pool["grouped_requests"] += request_count
+
+
+def get_claim_pool_status(worksheet, pool_name):
+    store = get_claim_pool_store()
+    with store["lock"]:
+        pool = store["pools"].get((worksheet, pool_name))
+        if pool is None:
+            return None
+        return {
+            "available": len(pool["members"]),
+            "built_at": pool["built_at"],
+            "rebuilds": pool["rebuilds"],
+            "claimed": pool["claimed"],
+            "conflicts": pool["conflicts"],
+            "groups": pool["groups"],
+            "grouped_requests": pool["grouped_requests"],
+        }
+
+
+def find_unverified_claims(worksheet, claim_values_by_row, expected_values):
+    # Verifikasi hanya cell baris yang baru diklaim, bukan download ulang seluruh sheet.
+    if not claim_values_by_row:
+        return []
+
+    row_indices = list(claim_values_by_row)
+    check_columns = list(dict.fromkeys(
+        [column for claim_values in claim_values_by_row.values() for column in claim_values]
+        + list(expected_values)
+    ))
+    latest_values = read_sheet_cells(worksheet, row_indices, check_columns)
+    unverified = []
+    for row_index, claim_values in claim_values_by_row.items():
+        for column in check_columns:
+            latest_value = normalize_cell_for_compare(latest_values.get((row_index, column), ""))
+            if column in claim_values:
+                allowed_values = {normalize_cell_for_compare(claim_values[column])}
+            else:
+                allowed_values = get_allowed_values(expected_values[column], row_index)
+            if latest_value not in allowed_values:
+                unverified.append(row_index)
+                break
+    return unverified
+
+
+def commit_claim_group(worksheet, pool, requests, expected_values, operation="ambil tugas"):
+    # Dipanggil dengan pool lock dipegang. Semua permintaan dalam grup dilayani dengan satu cek,
+    # satu batchUpdate, dan satu verifikasi; kandidat yang ternyata sudah berubah di Google Sheet
+    # (klaim replika lain, edit manual) dibuang dari antrian lalu diganti kandidat berikutnya.
+    conflicts = []
+    for request in requests:
+        request["claimed"] = []
+
+    for _ in range(CLAIM_MAX_ATTEMPTS):
+        shortfalls = [
+            (request, request["batch_size"] - len(request["claimed"]))
+            for request in requests
+            if len(request["claimed"]) < request["batch_size"]
+        ]
+        candidates = pop_claim_candidates(pool, sum(shortfall for _, shortfall in shortfalls))
+        if not candidates:
+            break
+
+        try:
+            with get_sheet_row_lock(candidates, operation):
+                candidate_conflicts, latest_values = find_sheet_conflicts(worksheet, candidates, expected_values)
+                free_rows = [row_index for row_index in candidates if row_index not in candidate_conflicts]
+                cell_values = {}
+                updated_by = {}
+                for request, shortfall in shortfalls:
+                    assigned_rows, free_rows = free_rows[:shortfall], free_rows[shortfall:]
+                    request["assigned"] = assigned_rows
+                    for row_index in assigned_rows:
+                        updated_by[row_index] = request["updated_by"]
+                        for column, value in request["claim_values"].items():
+                            cell_values[(row_index, column)] = value
+                write_sheet_values(
+                    worksheet,
+                    cell_values,
+                    updated_by=updated_by,
+                    row_versions=get_row_versions(latest_values),
+                )
+        except Exception:
+            return_claim_candidates(pool, candidates)
+            raise
+
+        for request, _ in shortfalls:
+            request["claimed"].extend(request.pop("assigned"))
+        conflicts.extend(candidate_conflicts)
+        if not candidate_conflicts:
+            break
+
+    claim_values_by_row = {
+        row_index: request["claim_values"]
+        for request in requests
+        for row_index in request["claimed"]
+    }
+    unverified = set(find_unverified_claims(worksheet, claim_values_by_row, expected_values))
+    if unverified:
+        invalidate_sheet_snapshot(worksheet)
+
+    for request in requests:
+        request["result"] = (
+            [row_index for row_index in request["claimed"] if row_index not in unverified],
+            list(conflicts),
+            [row_index for row_index in request["claimed"] if row_index in unverified],
+        )
+    record_claim_result(pool, len(claim_values_by_row) - len(unverified), len(conflicts) + len(unverified))
+
+
+def claim_rows_grouped(
+    worksheet,
+    pool_name,
+    loaded_at,
+    build_available_indices,
+    batch_size,
+    claim_values,
+    expected_values,
+    operation="ambil tugas",
+    updated_by="",
+):
+    # Group commit: permintaan yang datang dalam CLAIM_GROUP_WINDOW_SECONDS dikumpulkan, lalu
+    # permintaan pertama (leader) melayani semuanya sekaligus di bawah satu pool lock.
+    request = {
+        "batch_size": batch_size,
+        "claim_values": dict(claim_values),
+        "updated_by": updated_by,
+        "done": threading.Event(),
+        "result": None,
+        "error": None,
+    }
+    store = get_claim_pool_store()
+    key = (worksheet, pool_name)
+    with store["lock"]:
+        group = store["claim_groups"].get(key)
+        is_leader = group is None
+        if is_leader:
+            group = {"requests": [], "opened_at": time.time()}
+            store["claim_groups"][key] = group
+        group["requests"].append(request)
+
+    if not is_leader:
+        request["done"].wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["result"]
+
+    time.sleep(CLAIM_GROUP_WINDOW_SECONDS)
+    with store["lock"]:
+        store["claim_groups"].pop(key, None)
+
+    requests = group["requests"]
+    try:
+        with get_sheet_pool_lock(operation):
+            pool = sync_claim_pool(worksheet, pool_name, loaded_at, build_available_indices)
+            commit_claim_group(worksheet, pool, requests, expected_values, operation)
+        record_claim_group(pool, len(requests))
+    except Exception as exc:
+        for pending_request in requests:
+            pending_request["error"] = exc
+    finally:
+        for pending_request in requests:
+            pending_request["done"].set()
+
+    if request["error"] is not None:
+        raise request["error"]
+    return request["result"]
@@ -0,0 +1,108 @@
+import logging
+import threading
+import time
+
+import streamlit as st
+
+from sheet_range_update import get_gsheets_option
+
+
+CLAIM_PREFETCH_THRESHOLD = 3
+CLAIM_PREFETCH_RETRY_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+
+def get_claim_prefetch_threshold():
+    # Batch berikutnya diambil saat tugas aktif validator tinggal kurang dari angka ini.
+    try:
+        return max(1, int(get_gsheets_option("continuous_claim_threshold", CLAIM_PREFETCH_THRESHOLD)))
+    except (TypeError, ValueError):
+        return CLAIM_PREFETCH_THRESHOLD
+
+
+@st.cache_resource
+def get_claim_prefetch_store():
+    # Satu job klaim per validator per worksheet, dipakai bersama semua session di proses ini.
+    return {"lock": threading.Lock(), "jobs": {}}
+
+
+def run_claim_prefetch(job, claim):
+    claimed, conflicts, unverified, error = [], [], [], None
+    try:
+        claimed, conflicts, unverified = claim()
+    except Exception as exc:
+        error = str(exc)
+        logger.exception("Gagal mengambil batch tugas berikutnya di background.")
+
+    store = get_claim_prefetch_store()
+    with store["lock"]:
+        job["claimed"] = list(claimed)
+        job["conflicts"] = len(conflicts)
+        job["unverified"] = len(unverified)
+        job["error"] = error
+        job["finished_at"] = time.time()
+        job["done"].set()
+
+
+def start_claim_prefetch(worksheet, username, claim):
+    # claim() menjalankan klaim tanpa UI dan mengembalikan (claimed, conflicts, unverified).
+    # Job yang masih berjalan dipakai ulang; setelah job yang tidak mendapat baris, tunggu
+    # CLAIM_PREFETCH_RETRY_SECONDS supaya pool yang kosong tidak diklaim ulang tiap rerun.
+    store = get_claim_prefetch_store()
+    key = (worksheet, username)
+    with store["lock"]:
+        job = store["jobs"].get(key)
+        if job is not None:
+            if not job["done"].is_set():
+                return job
+            if not job["claimed"] and time.time() - job["finished_at"] < CLAIM_PREFETCH_RETRY_SECONDS:
+                return job
+
+        job = {
+            "started_at": time.time(),
+            "finished_at": None,
+            "done": threading.Event(),
+            "claimed": [],
+            "conflicts": 0,
+            "unverified": 0,
+            "error": None,
+            "reported": False,
+        }
+        store["jobs"][key] = job
+
+    thread = threading.Thread(
+        target=run_claim_prefetch,
+        args=(job, claim),
+        name=f"claim-prefetch-{username}",
+        daemon=True,
+    )
+    thread.start()
+    return job
+
+
+def is_claim_prefetch_running(worksheet, username):
+    store = get_claim_prefetch_store()
+    with store["lock"]:
+        job = store["jobs"].get((worksheet, username))
+        return job is not None and not job["done"].is_set()
+
+
+def wait_claim_prefetch(worksheet, username, timeout):
+    store = get_claim_prefetch_store()
+    with store["lock"]:
+        job = store["jobs"].get((worksheet, username))
+    if job is None:
+        return True
+    return job["done"].wait(timeout)
+
+
+def pop_claim_prefetch_result(worksheet, username):
+    # Hasil job yang sudah selesai dan belum ditampilkan ke validator (sekali per job).
+    store = get_claim_prefetch_store()
+    with store["lock"]:
+        job = store["jobs"].get((worksheet, username))
+        if job is None or not job["done"].is_set() or job["reported"]:
+            return None
+        job["reported"] = True
+        return {key: value for key, value in job.items() if key != "done"}
@@ -1,10 +1,52 @@
 import streamlit as st
 import pandas as pd
-from streamlit_gsheets import GSheetsConnection
 import time
+from streamlit.errors import StreamlitInvalidLayoutContextError
 from auth_config import AUTHORIZED_USERS, USER_CREDENTIALS
-from sheet_lock import get_sheet_write_lock
-from sheet_range_update import update_sheet_cells_with_full_update_fallback
+from claim_leases import (
+    CLAIM_LEASE_COLUMN,
+    LABELING_LOAD_COLUMNS,
+    format_claim_timestamp,
+    get_claim_lease_seconds,
+    is_claim_lease_enabled,
+    start_claim_lease_sweeper,
+)
+from claim_pool import claim_rows_grouped
+from claim_prefetch import (
+    get_claim_prefetch_threshold,
+    is_claim_prefetch_running,
+    pop_claim_prefetch_result,
+    start_claim_prefetch,
+    wait_claim_prefetch,
+)
+from sheet_local_store import claim_local_rows, commit_local_cells, get_local_store_status
+from sheet_lock import SheetLockTimeoutError, get_sheet_pool_lock, get_sheet_row_lock
+from sheet_range_update import (
+    ROW_META_COLUMNS,
+    get_gsheets_connection,
+    has_service_account,
+    is_local_primary_enabled,
+    is_missing_service_account_error,
+    load_worksheet_snapshot,
+    update_sheet_cells_if_unchanged,
+    update_sheet_cells_with_full_update_fallback,
+)
+from sheet_merge import SheetMergeConflictError, format_merge_conflict_message, merge_row_cells
+from sheet_normalize import get_prepared_snapshot, prepare_sheet_frame
+from sheet_query_index import build_query_index, find_index_rows, get_sheet_query_index, select_index_rows
+from sheet_snapshot import describe_sheet_snapshot_freshness, get_last_sheet_snapshot, invalidate_sheet_snapshot
+from sheet_write_journal import (
+    apply_journal_overlay,
+    discard_journal_rows,
+    enqueue_cell_updates,
+    flush_sheet_journal,
+    get_journal_cells,
+    get_journal_conflicts,
+    get_journal_summary,
+    is_write_behind_enabled,
+    keep_journal_changes,
+    start_journal_flusher,
+)
 
 # --- KONFIGURASI HALAMAN ---
 st.set_page_config(layout="wide", page_title="Online ATS Validator")
@@ -109,13 +151,23 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- KONEKSI KE GOOGLE SHEETS ---
-conn = st.connection("gsheets", type=GSheetsConnection)
+conn = get_gsheets_connection()
 
 SHEET_COLUMNS = ['instruction_ats', 'input', 'output_ats', 'validator', 'status']
+# Halaman labeling cukup membaca kolom inti (plus nama lama); kolom replacement yang lebar tidak ikut diunduh.
+# Proyeksinya dipakai bersama sweeper lease klaim.
+LOAD_COLUMNS = LABELING_LOAD_COLUMNS
 MIN_NONEMPTY_INPUT_ROWS = 1
 MAX_SHEET_CELL_CHARS = 50000
 LENGTH_LIMIT_COLUMNS = ['instruction_ats', 'output_ats']
-LOAD_DATA_TTL_SECONDS = 20
+TASK_SAVE_COLUMNS = ['instruction_ats', 'output_ats', 'validator', 'status']
+TASK_PAGE_SIZES = [5, 10, 20, 50]
+TASK_DEFAULT_PAGE_SIZE = 10
+# Input yang lebih panjang dari ini ditampilkan terpotong; teks lengkap baru dikirim ke browser saat dibuka.
+TASK_INPUT_PREVIEW_CHARS = 1500
+CONTINUOUS_DEFAULT_BATCH_SIZE = 10
+CONTINUOUS_WAIT_SECONDS = 15
+MERGE_PREVIEW_CHARS = 120
 
 def normalize_cell(value):
     if pd.isna(value):
@@ -164,6 +216,30 @@ def show_length_violation_error(violations, action_label="Penyimpanan"):
         f"Batas maksimal Google Sheets adalah {MAX_SHEET_CELL_CHARS:,} karakter per cell."
     )
 
+def preview_merge_value(value):
+    text = normalize_cell(value)
+    if not text:
+        return "(kosong)"
+    return text if len(text) <= MERGE_PREVIEW_CHARS else text[:MERGE_PREVIEW_CHARS] + "…"
+
+def show_merge_conflicts(cell_conflicts):
+    # Diff ringkas: hanya cell yang diubah Anda dan orang lain dengan nilai berbeda.
+    for row_index, conflicts in sorted(cell_conflicts.items()):
+        st.markdown(f"**Baris {row_index + 1}**")
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    'Kolom': conflict['column'],
+                    'Awal': " / ".join(preview_merge_value(value) for value in conflict['base']),
+                    'Anda': "-" if conflict['mine'] is None else preview_merge_value(conflict['mine']),
+                    'Di Sheet': preview_merge_value(conflict['theirs']),
+                }
+                for conflict in conflicts
+            ]),
+            use_container_width=True,
+            hide_index=True,
+        )
+
 def fill_ats_shortcut(index, value):
     st.session_state[f"instr_{index}"] = value
     st.session_state[f"output_{index}"] = value
@@ -182,10 +258,6 @@ def sync_task_widget_state(index, row):
         st.session_state[f"output_{index}"] = source_signature[2]
         st.session_state[source_key] = source_signature
 
-@st.cache_resource
-def get_claim_lock():
-    return get_sheet_write_lock()
-
 def get_available_data_mask(data):
     return (
         (data['input'] != '')
@@ -195,35 +267,39 @@ def get_available_data_mask(data):
         & (data['status'] == '')
     )
 
-@st.cache_data(ttl=LOAD_DATA_TTL_SECONDS)
 def load_data():
-    last_error = None
-    for _ in range(3):
-        try:
-            df = conn.read(worksheet="Sheet1", ttl=0)
-            if df is not None and not df.empty:
-                return df
-        except Exception as e:
-            last_error = e
-        time.sleep(0.5)
-
-    if last_error:
-        st.error(f"Error membaca Google Sheet: {last_error}")
-    return df if 'df' in locals() else None
+    # Retry ada di transport Sheets API dan download dibagi lewat refresh single-flight snapshot.
+    try:
+        return load_worksheet_snapshot("Sheet1", lambda: conn.read(worksheet="Sheet1", ttl=0), LOAD_COLUMNS)
+    except Exception as e:
+        st.error(f"Error membaca Google Sheet: {e}")
+        return None
 
 def prepare_sheet_data(df):
-    sheet_df = df.copy()
-
-    for col in SHEET_COLUMNS:
-        if col not in sheet_df.columns:
-            sheet_df[col] = ''
-        sheet_df[col] = sheet_df[col].map(normalize_cell)
+    return prepare_sheet_frame(df, SHEET_COLUMNS, rename_legacy=False)
 
-    legacy_cols = ['instruksi_ats', 'nama_validator']
-    sheet_df = sheet_df.drop(columns=[col for col in legacy_cols if col in sheet_df.columns])
-
-    ordered_cols = SHEET_COLUMNS + [col for col in sheet_df.columns if col not in SHEET_COLUMNS]
-    return sheet_df[ordered_cols]
+def copy_row_meta(source, target, row_indices):
+    # row_version/updated_at/updated_by hasil write terakhir ikut disalin, supaya precondition
+    # simpan berikutnya dari df yang sama tidak bentrok dengan write sendiri.
+    for col in ROW_META_COLUMNS:
+        if col not in source.columns:
+            continue
+        if col not in target.columns:
+            target[col] = ''
+        for index in row_indices:
+            if index in source.index and index in target.index:
+                target.at[index, col] = source.at[index, col]
+
+def with_pending_rows(df, pending_data, row_indices, columns):
+    # Jalur full-sheet butuh frame lengkap, bukan subset baris yang diubah, supaya guard jumlah baris
+    # di merge_with_latest_sheet/update_full_sheet_unlocked membandingkan seluruh sheet.
+    full_data = df.copy()
+    for col in columns:
+        if col not in full_data.columns:
+            full_data[col] = ''
+        for index in row_indices:
+            full_data.at[index, col] = pending_data.at[index, col]
+    return full_data
 
 def merge_with_latest_sheet(df, changed_indices, changed_columns, expected_values=None):
     latest_df = conn.read(worksheet="Sheet1", ttl=0)
@@ -243,119 +319,316 @@ def merge_with_latest_sheet(df, changed_indices, changed_columns, expected_value
             if col not in latest_data.columns:
                 latest_data[col] = ''
 
+    cell_conflicts = {}
     for index in changed_indices:
         if index not in pending_data.index or index not in latest_data.index:
             raise ValueError(f"Baris {index + 1} tidak ditemukan saat sinkronisasi.")
 
-        if expected_values:
-            for col, allowed_values in expected_values.items():
-                if col not in latest_data.columns:
-                    latest_data[col] = ''
-                if not isinstance(allowed_values, (list, tuple, set)):
-                    allowed_values = [allowed_values]
-                latest_value = normalize_cell(latest_data.at[index, col])
-                allowed_values = {normalize_cell(value) for value in allowed_values}
-                if latest_value not in allowed_values:
-                    raise ValueError(
-                        f"Baris {index + 1} sudah berubah di Google Sheet. Muat ulang halaman sebelum menyimpan."
-                    )
-
         for col in changed_columns:
             if col not in pending_data.columns:
                 raise ValueError(f"Kolom {col} tidak ditemukan saat sinkronisasi.")
+        for col in list(changed_columns) + list(expected_values or {}):
             if col not in latest_data.columns:
                 latest_data[col] = ''
-            latest_data.at[index, col] = pending_data.at[index, col]
 
+        # Three-way merge: expected_values adalah nilai dasar saat user mulai mengedit.
+        merged, row_conflicts = merge_row_cells(
+            index,
+            {col: pending_data.at[index, col] for col in changed_columns},
+            expected_values,
+            latest_data.loc[index].to_dict(),
+        )
+        if row_conflicts:
+            cell_conflicts[index] = row_conflicts
+            continue
+        for col, value in merged.items():
+            latest_data.at[index, col] = value
+
+    if cell_conflicts:
+        raise SheetMergeConflictError(
+            format_merge_conflict_message(cell_conflicts),
+            list(cell_conflicts),
+            cell_conflicts=cell_conflicts,
+        )
     return latest_data
 
-def update_data(df, changed_indices=None, changed_columns=None, expected_values=None, show_errors=True):
-    with get_claim_lock():
-        return update_data_unlocked(df, changed_indices, changed_columns, expected_values, show_errors)
+def update_data(
+    df,
+    changed_indices=None,
+    changed_columns=None,
+    expected_values=None,
+    show_errors=True,
+    journaled=False,
+    defer_flush=False,
+    full_df=None
+):
+    # full_df: frame lengkap untuk jalur full-sheet bila df hanya berisi baris yang diubah.
+    if journaled and is_write_behind_enabled():
+        # Journal punya transaksi sendiri; flush mengambil lock tulis sheet di dalamnya.
+        return update_data_journaled(df, changed_indices, changed_columns, expected_values, show_errors, defer_flush)
+    try:
+        with get_sheet_row_lock(changed_indices, "simpan"):
+            return update_data_unlocked(df, changed_indices, changed_columns, expected_values, show_errors, full_df)
+    except SheetLockTimeoutError as e:
+        if show_errors:
+            st.error(f"Gagal menyimpan ke Google Sheets: {e}")
+        return False
+
+def validate_pending_data(df, changed_indices, changed_columns, show_errors):
+    if df is None or df.empty:
+        if show_errors:
+            st.error("Penyimpanan dibatalkan: data yang akan ditulis kosong.")
+        return None
+
+    if changed_indices is None or changed_columns is None:
+        if show_errors:
+            st.error("Penyimpanan dibatalkan: perubahan baris/kolom tidak diketahui.")
+        return None
 
-def update_data_unlocked(df, changed_indices=None, changed_columns=None, expected_values=None, show_errors=True):
+    missing_rows = [index + 1 for index in changed_indices if index not in df.index]
+    if missing_rows:
+        raise ValueError(f"Baris {missing_rows[0]} tidak ditemukan saat sinkronisasi.")
+
+    pending_data = prepare_sheet_data(df.loc[list(changed_indices)])
+
+    done_without_required_fields = [
+        index + 1
+        for index in changed_indices
+        if normalize_cell(pending_data.at[index, 'status']) == "Done"
+        and not has_required_ats_fields(pending_data.loc[index])
+    ]
+    if done_without_required_fields:
+        if show_errors:
+            rows = ", ".join(map(str, done_without_required_fields))
+            st.error(
+                f"Penyimpanan dibatalkan: baris {rows} belum mengisi instruction_ats dan output_ats."
+            )
+        return None
+
+    length_violations = get_ats_length_violations(pending_data, changed_indices)
+    if length_violations:
+        if show_errors:
+            show_length_violation_error(length_violations)
+        return None
+
+    return pending_data
+
+def update_data_journaled(df, changed_indices, changed_columns, expected_values, show_errors, defer_flush):
     try:
-        expected_rows = st.session_state.get('loaded_sheet_rows')
-        if df is None or df.empty:
-            if show_errors:
-                st.error("Penyimpanan dibatalkan: data yang akan ditulis kosong.")
+        pending_data = validate_pending_data(df, changed_indices, changed_columns, show_errors)
+        if pending_data is None:
             return False
 
-        if changed_indices is None or changed_columns is None:
-            if show_errors:
-                st.error("Penyimpanan dibatalkan: perubahan baris/kolom tidak diketahui.")
-            return False
+        if is_local_primary_enabled():
+            # Salinan lokal adalah sumber utama: cek + commit di SQLite, replikasi ke sheet di background.
+            commit_local_cells(
+                "Sheet1",
+                pending_data,
+                changed_indices,
+                changed_columns,
+                expected_values,
+                username,
+                merge_conflicts=True,
+            )
+            return True
 
-        sheet_data = merge_with_latest_sheet(df, changed_indices, changed_columns, expected_values)
-        nonempty_input_rows = sheet_data['input'].fillna('').astype(str).str.strip().ne('').sum()
+        enqueue_cell_updates("Sheet1", pending_data, changed_indices, changed_columns, expected_values, username)
+        if defer_flush:
+            return True
 
-        if nonempty_input_rows < MIN_NONEMPTY_INPUT_ROWS:
-            if show_errors:
-                st.error("Penyimpanan dibatalkan: kolom input terbaca kosong. Muat ulang data sebelum mencoba lagi.")
-            return False
+        flush_result = flush_sheet_journal("Sheet1")
+        if flush_result["error"] is not None:
+            raise flush_result["error"]
 
-        if expected_rows is not None and len(sheet_data) < expected_rows:
-            if show_errors:
-                st.error(
-                    f"Penyimpanan dibatalkan: jumlah baris turun dari {expected_rows} ke {len(sheet_data)}. "
-                    "Ini mencegah Google Sheet tertimpa oleh data hasil filter."
-                )
-            return False
+        cell_conflicts = {
+            item['row_index']: item['cells']
+            for item in get_journal_conflicts("Sheet1")
+            if item['row_index'] in changed_indices
+        }
+        if cell_conflicts:
+            raise SheetMergeConflictError(
+                format_merge_conflict_message(cell_conflicts),
+                list(cell_conflicts),
+                cell_conflicts=cell_conflicts,
+            )
 
-        done_without_required_fields = [
-            index + 1
-            for index in changed_indices
-            if index in sheet_data.index
-            and normalize_cell(sheet_data.at[index, 'status']) == "Done"
-            and not has_required_ats_fields(sheet_data.loc[index])
-        ]
-        if done_without_required_fields:
-            if show_errors:
-                rows = ", ".join(map(str, done_without_required_fields))
-                st.error(
-                    f"Penyimpanan dibatalkan: baris {rows} belum mengisi instruction_ats dan output_ats."
-                )
-            return False
+        return True
+    except SheetMergeConflictError as e:
+        if show_errors:
+            st.error(f"Gagal menyimpan ke Google Sheets: {e}")
+            show_merge_conflicts(e.cell_conflicts)
+        return False
+    except Exception as e:
+        if show_errors:
+            st.error(f"Gagal menyimpan ke Google Sheets: {e}")
+        return False
 
-        length_violations = get_ats_length_violations(sheet_data, changed_indices)
-        if length_violations:
-            if show_errors:
-                show_length_violation_error(length_violations)
+def update_data_unlocked(
+    df,
+    changed_indices=None,
+    changed_columns=None,
+    expected_values=None,
+    show_errors=True,
+    full_df=None
+):
+    try:
+        pending_data = validate_pending_data(df, changed_indices, changed_columns, show_errors)
+        if pending_data is None:
             return False
 
-        update_sheet_cells_with_full_update_fallback(conn, "Sheet1", sheet_data, changed_indices, changed_columns)
-        st.session_state['loaded_sheet_rows'] = len(sheet_data)
-        # Clear cache data utama agar tampilan mengambil nilai terbaru setelah write.
-        load_data.clear()
+        try:
+            # Cek hanya cell expected_values lewat satu batchGet, lalu tulis cell yang berubah.
+            # Baris yang berubah di sheet digabung three-way; hanya cell yang bentrok yang ditolak.
+            update_sheet_cells_if_unchanged(
+                "Sheet1",
+                pending_data,
+                changed_indices,
+                changed_columns,
+                expected_values,
+                username,
+                merge_conflicts=True,
+            )
+            copy_row_meta(pending_data, df, changed_indices)
+        except RuntimeError as exc:
+            if not is_missing_service_account_error(exc):
+                raise
+            full_data = df if full_df is None else with_pending_rows(full_df, df, changed_indices, changed_columns)
+            if not update_full_sheet_unlocked(full_data, changed_indices, changed_columns, expected_values, show_errors):
+                return False
+            copy_row_meta(full_data, df, changed_indices)
+
+        # Snapshot bersama sudah ditimpa dengan nilai yang ditulis (read-your-writes), tidak perlu download ulang.
         return True
+    except SheetMergeConflictError as e:
+        if show_errors:
+            st.error(f"Gagal menyimpan ke Google Sheets: {e}")
+            show_merge_conflicts(e.cell_conflicts)
+        return False
     except Exception as e:
         if show_errors:
             st.error(f"Gagal menyimpan ke Google Sheets: {e}")
         return False
 
+def update_full_sheet_unlocked(df, changed_indices, changed_columns, expected_values=None, show_errors=True):
+    expected_rows = st.session_state.get('loaded_sheet_rows')
+    sheet_data = merge_with_latest_sheet(df, changed_indices, changed_columns, expected_values)
+    nonempty_input_rows = sheet_data['input'].fillna('').astype(str).str.strip().ne('').sum()
+
+    if nonempty_input_rows < MIN_NONEMPTY_INPUT_ROWS:
+        if show_errors:
+            st.error("Penyimpanan dibatalkan: kolom input terbaca kosong. Muat ulang data sebelum mencoba lagi.")
+        return False
+
+    if expected_rows is not None and len(sheet_data) < expected_rows:
+        if show_errors:
+            st.error(
+                f"Penyimpanan dibatalkan: jumlah baris turun dari {expected_rows} ke {len(sheet_data)}. "
+                "Ini mencegah Google Sheet tertimpa oleh data hasil filter."
+            )
+        return False
+
+    update_sheet_cells_with_full_update_fallback(conn, "Sheet1", sheet_data, changed_indices, changed_columns, username)
+    copy_row_meta(sheet_data, df, changed_indices)
+    st.session_state['loaded_sheet_rows'] = len(sheet_data)
+    return True
+
 def claim_new_tasks(batch_size):
-    with get_claim_lock():
-        available_indices = []
-        for _ in range(3):
-            latest_df = conn.read(worksheet="Sheet1", ttl=0)
-            if latest_df is None or latest_df.empty:
-                st.error("Tidak dapat mengambil tugas: Google Sheet kosong atau tidak dapat dibaca.")
-                return 0
+    try:
+        if not has_service_account():
+            with get_sheet_pool_lock("ambil tugas"):
+                return claim_new_tasks_full_sheet(batch_size)
+        return claim_new_tasks_from_pool(batch_size)
+    except SheetLockTimeoutError as e:
+        st.error(f"Tidak dapat mengambil tugas: {e}")
+        return 0
+
+def get_available_indices(df):
+    data = prepare_sheet_data(df)
+    return data.index[get_available_data_mask(data)]
+
+def get_claim_values(claimer):
+    # claimed_at hanya ditulis bila lease klaim aktif.
+    claim_values = {'validator': claimer, 'status': ''}
+    if is_claim_lease_enabled():
+        claim_values[CLAIM_LEASE_COLUMN] = format_claim_timestamp()
+    return claim_values
+
+def claim_pool_tasks(claimer, batch_size, snapshot_df, loaded_at):
+    # Antrian baris kosong dibangun dari snapshot bersama. Klaim yang datang bersamaan digabung
+    # jadi satu cek + satu batchUpdate + satu verifikasi untuk cell terpilih saja; di mode local
+    # primary klaim cukup satu transaksi SQLite lokal. Tanpa UI supaya bisa dijalankan worker mode kontinu.
+    claim_rows = claim_local_rows if is_local_primary_enabled() else claim_rows_grouped
+    return claim_rows(
+        "Sheet1",
+        "labeling",
+        loaded_at,
+        lambda: get_available_indices(snapshot_df),
+        batch_size,
+        get_claim_values(claimer),
+        {
+            'instruction_ats': '',
+            'output_ats': '',
+            'validator': '',
+            'status': ''
+        },
+        updated_by=claimer,
+    )
+
+def claim_prefetched_tasks(claimer, batch_size):
+    snapshot_df, loaded_at = get_last_sheet_snapshot("Sheet1", LOAD_COLUMNS)
+    if snapshot_df is None or snapshot_df.empty:
+        return [], [], []
+    return claim_pool_tasks(claimer, batch_size, snapshot_df, loaded_at)
+
+def claim_new_tasks_from_pool(batch_size):
+    snapshot_df, loaded_at = get_last_sheet_snapshot("Sheet1", LOAD_COLUMNS)
+    if snapshot_df is None:
+        load_data()
+        snapshot_df, loaded_at = get_last_sheet_snapshot("Sheet1", LOAD_COLUMNS)
+    if snapshot_df is None or snapshot_df.empty:
+        st.error("Tidak dapat mengambil tugas: Google Sheet kosong atau tidak dapat dibaca.")
+        return 0
+
+    claimed_indices, conflicts, unverified = claim_pool_tasks(username, batch_size, snapshot_df, loaded_at)
+
+    if unverified:
+        st.error("Sebagian tugas gagal dikunci karena ada update bersamaan. Silakan ambil ulang.")
+        return 0
+
+    if not claimed_indices:
+        if conflicts:
+            st.warning("Tugas yang tersedia baru saja berubah. Silakan klik Ambil Tugas Baru lagi.")
+        else:
+            st.error("Data habis diambil orang lain!")
+        return 0
 
-            latest_data = prepare_sheet_data(latest_df)
-            available_indices = latest_data[get_available_data_mask(latest_data)].head(batch_size).index
+    return len(claimed_indices)
 
-            if len(available_indices) == 0:
-                st.error("Data habis diambil orang lain!")
-                return 0
+def claim_new_tasks_full_sheet(batch_size):
+    available_indices = []
+    for _ in range(3):
+        latest_df = conn.read(worksheet="Sheet1", ttl=0)
+        if latest_df is None or latest_df.empty:
+            st.error("Tidak dapat mengambil tugas: Google Sheet kosong atau tidak dapat dibaca.")
+            return 0
 
-            latest_data.loc[available_indices, 'validator'] = username
-            latest_data.loc[available_indices, 'status'] = ''
+        latest_data = prepare_sheet_data(latest_df)
+        available_indices = latest_data[get_available_data_mask(latest_data)].head(batch_size).index
 
+        if len(available_indices) == 0:
+            st.error("Data habis diambil orang lain!")
+            return 0
+
+        claim_values = get_claim_values(username)
+        for col, value in claim_values.items():
+            latest_data.loc[available_indices, col] = value
+
+        # Pool lock menjaga pemilihan baris; stripe baris terpilih menahan save lain di baris yang sama.
+        with get_sheet_row_lock(available_indices, "ambil tugas"):
             saved = update_data_unlocked(
                 latest_data,
                 list(available_indices),
-                ['validator', 'status'],
+                list(claim_values),
                 expected_values={
                     'instruction_ats': '',
                     'output_ats': '',
@@ -364,32 +637,62 @@ def claim_new_tasks(batch_size):
                 },
                 show_errors=False
             )
-            if saved:
-                break
-        else:
-            st.warning("Tugas yang tersedia baru saja berubah. Silakan klik Ambil Tugas Baru lagi.")
-            load_data.clear()
-            return 0
+        if saved:
+            break
+    else:
+        st.warning("Tugas yang tersedia baru saja berubah. Silakan klik Ambil Tugas Baru lagi.")
+        invalidate_sheet_snapshot("Sheet1")
+        return 0
+
+    verified_df = conn.read(worksheet="Sheet1", ttl=0)
+    verified_data = prepare_sheet_data(verified_df)
+    verified_count = len(
+        [
+            index for index in available_indices
+            if index in verified_data.index
+            and verified_data.at[index, 'validator'] == username
+            and verified_data.at[index, 'instruction_ats'] == ''
+            and verified_data.at[index, 'output_ats'] == ''
+            and verified_data.at[index, 'status'] == ''
+        ]
+    )
 
-        verified_df = conn.read(worksheet="Sheet1", ttl=0)
-        verified_data = prepare_sheet_data(verified_df)
-        verified_count = len(
-            [
-                index for index in available_indices
-                if index in verified_data.index
-                and verified_data.at[index, 'validator'] == username
-                and verified_data.at[index, 'instruction_ats'] == ''
-                and verified_data.at[index, 'output_ats'] == ''
-                and verified_data.at[index, 'status'] == ''
-            ]
-        )
+    if verified_count != len(available_indices):
+        st.error("Sebagian tugas gagal dikunci karena ada update bersamaan. Silakan ambil ulang.")
+        invalidate_sheet_snapshot("Sheet1")
+        return 0
 
-        if verified_count != len(available_indices):
-            st.error("Sebagian tugas gagal dikunci karena ada update bersamaan. Silakan ambil ulang.")
-            load_data.clear()
-            return 0
+    return verified_count
+
+def save_task_row(df, index, instruction_value, output_value, status, defer_flush=False):
+    # Ditulis lewat salinan satu baris: df dipakai ulang oleh rerun fragment kartu, jadi baru diubah
+    # setelah tersimpan agar simpan yang gagal tidak membuat kartu memakai nilai yang belum ada di sheet.
+    row_df = df.loc[[index]].copy()
+    row_df.at[index, 'instruction_ats'] = instruction_value
+    row_df.at[index, 'output_ats'] = output_value
+    row_df.at[index, 'validator'] = username
+    row_df.at[index, 'status'] = status
 
-        return verified_count
+    if not update_data(
+        row_df,
+        [index],
+        TASK_SAVE_COLUMNS,
+        expected_values={
+            'instruction_ats': df.at[index, 'instruction_ats'],
+            'output_ats': df.at[index, 'output_ats'],
+            'validator': username,
+            'status': ['', 'Pending']
+        },
+        journaled=True,
+        defer_flush=defer_flush,
+        full_df=df
+    ):
+        return False
+
+    for col in TASK_SAVE_COLUMNS:
+        df.at[index, col] = row_df.at[index, col]
+    copy_row_meta(row_df, df, [index])
+    return True
 
 def auto_save_progress(df, index):
     if index not in df.index:
@@ -410,26 +713,428 @@ def auto_save_progress(df, index):
     ):
         return
 
-    expected_instruction = df.at[index, 'instruction_ats']
-    expected_output = df.at[index, 'output_ats']
+    if save_task_row(df, index, current_instr, current_output, "Pending", defer_flush=True):
+        st.toast("Progress tersimpan otomatis.", icon="✅")
 
-    df.at[index, 'instruction_ats'] = current_instr
-    df.at[index, 'output_ats'] = current_output
-    df.at[index, 'validator'] = username
-    df.at[index, 'status'] = "Pending"
+def get_task_input_values(df, index):
+    # Nilai yang sedang diketik (state widget kartu yang tampil) atau nilai tersimpan untuk kartu lain.
+    return (
+        st.session_state.get(f"instr_{index}", df.at[index, 'instruction_ats']),
+        st.session_state.get(f"output_{index}", df.at[index, 'output_ats']),
+    )
 
-    if update_data(
-        df,
-        [index],
-        ['instruction_ats', 'output_ats', 'validator', 'status'],
-        expected_values={
-            'instruction_ats': expected_instruction,
-            'output_ats': expected_output,
-            'validator': username,
-            'status': ['', 'Pending']
+def update_done_rows(df, pending_data, row_indices, expected_values):
+    # Semua baris dalam satu write bersyarat (satu batchGet cek + satu batchUpdate). Cell yang bentrok
+    # dilempar sebagai SheetMergeConflictError; di mode journal baris lain tetap terkirim.
+    if is_local_primary_enabled():
+        commit_local_cells(
+            "Sheet1",
+            pending_data,
+            row_indices,
+            TASK_SAVE_COLUMNS,
+            expected_values,
+            username,
+            merge_conflicts=True,
+        )
+        return
+
+    if is_write_behind_enabled():
+        enqueue_cell_updates("Sheet1", pending_data, row_indices, TASK_SAVE_COLUMNS, expected_values, username)
+        flush_result = flush_sheet_journal("Sheet1")
+        if flush_result["error"] is not None:
+            raise flush_result["error"]
+        cell_conflicts = {
+            item['row_index']: item['cells']
+            for item in get_journal_conflicts("Sheet1")
+            if item['row_index'] in row_indices
         }
-    ):
-        st.toast("Progress tersimpan otomatis.", icon="✅")
+        if cell_conflicts:
+            raise SheetMergeConflictError(
+                format_merge_conflict_message(cell_conflicts),
+                list(cell_conflicts),
+                cell_conflicts=cell_conflicts,
+            )
+        return
+
+    with get_sheet_row_lock(row_indices, "tandai selesai"):
+        try:
+            update_sheet_cells_if_unchanged(
+                "Sheet1",
+                pending_data,
+                row_indices,
+                TASK_SAVE_COLUMNS,
+                expected_values,
+                username,
+                merge_conflicts=True,
+            )
+        except RuntimeError as exc:
+            if not is_missing_service_account_error(exc):
+                raise
+            full_data = with_pending_rows(df, pending_data, row_indices, TASK_SAVE_COLUMNS)
+            if not update_full_sheet_unlocked(full_data, row_indices, TASK_SAVE_COLUMNS, expected_values, False):
+                raise ValueError("jumlah baris Google Sheet tidak sesuai, muat ulang data.")
+            copy_row_meta(full_data, pending_data, row_indices)
+
+def mark_tasks_done(df, row_indices):
+    # Validasi semua baris sekali jalan, lalu commit baris yang lolos dalam satu write bersyarat.
+    # Mengembalikan {row_index: hasil} untuk laporan per baris.
+    row_indices = [index for index in row_indices if index in df.index]
+    rows_df = df.loc[row_indices].copy()
+    for index in row_indices:
+        instruction_value, output_value = get_task_input_values(df, index)
+        rows_df.at[index, 'instruction_ats'] = instruction_value
+        rows_df.at[index, 'output_ats'] = output_value
+        rows_df.at[index, 'validator'] = username
+        rows_df.at[index, 'status'] = "Done"
+    pending_data = prepare_sheet_data(rows_df)
+
+    report = {}
+    for index in row_indices:
+        if not has_required_ats_fields(pending_data.loc[index]):
+            report[index] = "❌ instruction_ats dan output_ats wajib diisi"
+    for row_number, col, length in get_ats_length_violations(pending_data, row_indices):
+        report[row_number - 1] = f"❌ {col} {length:,} karakter (maks {MAX_SHEET_CELL_CHARS:,})"
+
+    ready = [index for index in row_indices if index not in report]
+    # Write langsung/lokal bersifat semua-atau-tidak: baris yang bentrok dikeluarkan lalu sisanya dicoba sekali lagi.
+    partial_writes = is_write_behind_enabled() and not is_local_primary_enabled()
+    for _ in range(2):
+        if not ready:
+            break
+        ready_data = pending_data.loc[ready].copy()
+        try:
+            update_done_rows(
+                df,
+                ready_data,
+                ready,
+                {
+                    'instruction_ats': {index: df.at[index, 'instruction_ats'] for index in ready},
+                    'output_ats': {index: df.at[index, 'output_ats'] for index in ready},
+                    'validator': username,
+                    'status': ['', 'Pending']
+                },
+            )
+        except SheetMergeConflictError as e:
+            conflicted = set(e.cell_conflicts) or set(e.row_indices)
+            for index in conflicted:
+                columns = ", ".join(conflict['column'] for conflict in e.cell_conflicts.get(index, []))
+                report[index] = f"⚠️ Bentrok dengan perubahan lain{f' ({columns})' if columns else ''}"
+            ready = [index for index in ready if index not in conflicted]
+            if not partial_writes:
+                continue
+        except Exception as e:
+            for index in ready:
+                report[index] = f"❌ Gagal menyimpan: {e}"
+            ready = []
+            break
+
+        for index in ready:
+            for col in TASK_SAVE_COLUMNS:
+                df.at[index, col] = pending_data.at[index, col]
+            report[index] = "✅ Selesai"
+        copy_row_meta(ready_data, df, ready)
+        ready = []
+        break
+
+    for index in ready:
+        report[index] = "⚠️ Belum tersimpan karena ada update bersamaan, coba lagi"
+    return report
+
+def mark_selected_tasks_done(df):
+    selected = st.session_state.get('bulk_done_rows', [])
+    if selected:
+        st.session_state['bulk_done_report'] = mark_tasks_done(df, selected)
+    st.session_state['bulk_done_rows'] = []
+
+def select_complete_tasks(df, task_indices):
+    st.session_state['bulk_done_rows'] = [
+        index for index in task_indices
+        if all(normalize_cell(value) != '' for value in get_task_input_values(df, index))
+    ]
+
+def show_bulk_done_panel(df, task_indices):
+    with st.expander("✅ Tandai Selesai Massal", expanded=bool(st.session_state.get('bulk_done_report'))):
+        st.multiselect(
+            "Pilih data yang ditandai selesai:",
+            task_indices,
+            format_func=lambda index: f"Data #{index + 1}",
+            key='bulk_done_rows'
+        )
+        col_select, col_submit = st.columns(2, gap="small")
+        with col_select:
+            st.button(
+                "Pilih semua yang sudah lengkap",
+                use_container_width=True,
+                on_click=select_complete_tasks,
+                args=(df, task_indices)
+            )
+        with col_submit:
+            st.button(
+                "✅ Tandai Selesai Terpilih",
+                type="primary",
+                use_container_width=True,
+                disabled=not st.session_state.get('bulk_done_rows'),
+                on_click=mark_selected_tasks_done,
+                args=(df,)
+            )
+
+        report = st.session_state.pop('bulk_done_report', None)
+        if report:
+            done_count = sum(result.startswith("✅") for result in report.values())
+            if done_count == len(report):
+                st.success(f"{done_count} data ditandai selesai.")
+            else:
+                st.warning(f"{done_count} dari {len(report)} data ditandai selesai. Periksa baris lainnya di bawah.")
+            st.dataframe(
+                pd.DataFrame([
+                    {'Data': f"#{index + 1}", 'Hasil': result}
+                    for index, result in sorted(report.items())
+                ]),
+                use_container_width=True,
+                hide_index=True,
+            )
+
+def show_task_metrics(task_metrics):
+    done_delta = st.session_state.get('task_done_delta', 0)
+    task_metrics['slots']['done'].metric("✅ Selesai Saya", task_metrics['done'] + done_delta)
+    task_metrics['slots']['active'].metric("⏳ Tugas Aktif Saya", task_metrics['active'] - done_delta)
+
+def maybe_prefetch_tasks(active_count, available_count):
+    # Mode kontinu: batch berikutnya diklaim di background sebelum tugas aktif habis, sehingga
+    # kartu baru sudah ada di snapshot saat validator menyelesaikan tugas terakhirnya.
+    if not st.session_state.get('continuous_mode') or not has_service_account():
+        return
+    if available_count <= 0 or active_count >= get_claim_prefetch_threshold():
+        return
+    claimer = username
+    batch_size = st.session_state.get('continuous_batch_size', CONTINUOUS_DEFAULT_BATCH_SIZE)
+    start_claim_prefetch("Sheet1", claimer, lambda: claim_prefetched_tasks(claimer, batch_size))
+
+def record_task_done(task_metrics):
+    # Metrik sidebar diperbarui dari delta tanpa menghitung ulang seluruh data.
+    st.session_state['task_done_delta'] = st.session_state.get('task_done_delta', 0) + 1
+    maybe_prefetch_tasks(task_metrics['active'] - st.session_state['task_done_delta'], task_metrics['pool'])
+    if task_metrics['active'] - st.session_state['task_done_delta'] <= 0:
+        # Semua tugas aktif selesai: form ambil tugas baru hanya muncul lewat rerun penuh.
+        st.rerun()
+    show_task_metrics(task_metrics)
+
+def rerun_task_card():
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitInvalidLayoutContextError:
+        # Klik yang tergabung ke rerun penuh (bukan rerun fragment) diulang sebagai rerun penuh.
+        st.rerun()
+
+@st.fragment
+def render_task_card(df, index, show_history, task_metrics):
+    # Satu kartu = satu fragment: ketik (autosave), shortcut, simpan, dan tandai selesai hanya menjalankan
+    # ulang kartu ini, bukan load data + statistik + seluruh kartu lain.
+    if index not in df.index:
+        return
+    row = df.loc[index]
+    # Tanda visual jika sudah selesai
+    is_done = row.get('status') == 'Done'
+    if is_done and not show_history:
+        return
+
+    with st.container():
+        sync_task_widget_state(index, row)
+        status_icon = "✅ SELESAI" if is_done else "⏳ BELUM SELESAI"
+        
+        # Header dengan status
+        header_color = "#dcfce7" if is_done else "#dbeafe"
+        st.markdown(f"""
+        <div style="background-color:{header_color}; padding: 12px; border-radius: 8px; margin-bottom: 20px; border-left: 5px solid {'#16a34a' if is_done else '#1e40af'};">
+            <h3 style="margin: 0; color: {'#166534' if is_done else '#1e40af'};">📌 Data #{index + 1} - {status_icon}</h3>
+        </div>
+        """, unsafe_allow_html=True)
+        
+        # ROW 1: INPUT (Read-only, Referensi) - Full Width
+        # Tampilkan sebagai custom box (bukan textarea) untuk clarity maksimal
+        input_text = row.get('input', '')
+        show_full_input = len(input_text) <= TASK_INPUT_PREVIEW_CHARS or st.session_state.get(f"full_input_{index}", False)
+        if not show_full_input:
+            input_text = input_text[:TASK_INPUT_PREVIEW_CHARS] + "…"
+        st.markdown(f"""
+        <div class='input-reference-box'>
+            <div class='input-reference-header'>📖 INPUT / REFERENSI PASIEN</div>
+            <div style="white-space: pre-wrap; font-size: 16px; line-height: 1.9; color: #2d2d2d;">
+                {input_text}
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+        if len(row.get('input', '')) > TASK_INPUT_PREVIEW_CHARS:
+            st.toggle(
+                f"Tampilkan input lengkap ({len(row.get('input', '')):,} karakter)",
+                key=f"full_input_{index}"
+            )
+        
+        # ROW 2: INSTRUCTION_ATS dan OUTPUT_ATS - 2 columns
+        st.markdown("<span class='box-header' style='color:#0369a1; margin-top: 15px; margin-bottom: 15px; font-size: 14px;'>✏️ ISI DATA BERIKUT (KOLOM WAJIB DIISI):</span>", unsafe_allow_html=True)
+        
+        col_instr, col_output = st.columns(2, gap="medium")
+        
+        with col_instr:
+            st.markdown("""
+            <div style='background-color: #f0f9ff; padding: 10px; border-radius: 6px; border-left: 4px solid #0284c7; margin-bottom: 10px;'>
+                <span style='font-weight: 700; color: #0369a1; font-size: 13px;'>✍️ INSTRUCTION ATS</span>
+            </div>
+            """, unsafe_allow_html=True)
+            instruksi_val = st.text_area(
+                label="Instruction ATS",
+                value=row.get('instruction_ats', ''),
+                height=140,
+                max_chars=MAX_SHEET_CELL_CHARS,
+                label_visibility="collapsed",
+                key=f"instr_{index}",
+                placeholder="Isi klasifikasi ATS berdasarkan instruksi...",
+                disabled=is_done,
+                on_change=auto_save_progress,
+                args=(df, index)
+            )
+        
+        with col_output:
+            st.markdown("""
+            <div style='background-color: #f0fce7; padding: 10px; border-radius: 6px; border-left: 4px solid #22c55e; margin-bottom: 10px;'>
+                <span style='font-weight: 700; color: #166534; font-size: 13px;'>✍️ OUTPUT ATS</span>
+            </div>
+            """, unsafe_allow_html=True)
+            output_val = st.text_area(
+                label="Output ATS",
+                value=row.get('output_ats', ''),
+                height=140,
+                max_chars=MAX_SHEET_CELL_CHARS,
+                label_visibility="collapsed",
+                key=f"output_{index}",
+                placeholder="Isi hasil triase/output ATS...",
+                disabled=is_done,
+                on_change=auto_save_progress,
+                args=(df, index)
+            )
+
+        st.markdown("<div style='margin-top: 10px;'></div>", unsafe_allow_html=True)
+        col_similar, col_too_many = st.columns(2, gap="small")
+        with col_similar:
+            st.button(
+                "Serupa",
+                key=f"shortcut_serupa_{index}",
+                use_container_width=True,
+                disabled=is_done,
+                on_click=fill_ats_shortcut,
+                args=(index, "serupa")
+            )
+        with col_too_many:
+            st.button(
+                "Kasus terlalu banyak",
+                key=f"shortcut_too_many_{index}",
+                use_container_width=True,
+                disabled=is_done,
+                on_click=fill_ats_shortcut,
+                args=(index, "kasus terlalu banyak")
+            )
+
+        can_mark_done = (
+            normalize_cell(instruksi_val) != ''
+            and normalize_cell(output_val) != ''
+        )
+        if not is_done and not can_mark_done:
+            st.warning("Isi instruction_ats dan output_ats sebelum menandai tugas sebagai selesai.")
+
+        current_length_violations = get_current_ats_length_violations(index, instruksi_val, output_val)
+        if current_length_violations:
+            show_length_violation_error(current_length_violations)
+         
+        # ROW 3: BUTTONS
+        st.markdown("<div style='margin-top: 15px;'></div>", unsafe_allow_html=True)
+        
+        col_save, col_done, col_status = st.columns([2, 2, 2], gap="small")
+        
+        with col_save:
+            if st.button(
+                "💾 Simpan Progress",
+                key=f"save_{index}",
+                use_container_width=True,
+                disabled=is_done
+            ):
+                with st.spinner("💫 Menyimpan progress..."):
+                    current_length_violations = get_current_ats_length_violations(index, instruksi_val, output_val)
+                    if current_length_violations:
+                        show_length_violation_error(current_length_violations)
+                        st.stop()
+                    # Set status ke "Pending" untuk menandakan sedang dikerjakan
+                    if save_task_row(df, index, instruksi_val, output_val, "Pending"):
+                        st.toast("✅ Progress tersimpan! Status: Sedang Dikerjakan", icon="✅")
+        
+        with col_done:
+            if st.button(
+                "✅ Tandai Selesai",
+                key=f"done_{index}",
+                use_container_width=True,
+                type="primary",
+                disabled=is_done or not can_mark_done
+            ):
+                with st.spinner("💫 Menyelesaikan data..."):
+                    current_length_violations = get_current_ats_length_violations(index, instruksi_val, output_val)
+                    if current_length_violations:
+                        show_length_violation_error(current_length_violations, action_label="Tandai selesai")
+                        st.stop()
+                    if not can_mark_done:
+                        st.error("Tidak bisa menandai selesai: instruction_ats dan output_ats wajib diisi.")
+                        st.stop()
+                    if save_task_row(df, index, instruksi_val, output_val, "Done"):
+                        st.toast("✅ Data selesai! Status diubah ke Done.", icon="✅")
+                        record_task_done(task_metrics)
+                        rerun_task_card()
+        
+        with col_status:
+            status_text = "🎉 SELESAI" if is_done else "⏳ Aktif"
+            st.markdown(f"""
+            <div style="text-align: center; padding: 10px; background-color: {'#dcfce7' if is_done else '#fef08a'}; border-radius: 6px; border: 1px solid {'#bbf7d0' if is_done else '#fcd34d'};">
+                <small style="font-weight: bold; color: {'#166534' if is_done else '#92400e'};"><strong>{status_text}</strong></small>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        st.divider()
+
+def jump_to_task(task_indices):
+    row_number = st.session_state.get('task_jump_row')
+    if row_number is None:
+        return
+    page_size = st.session_state.get('task_page_size', TASK_DEFAULT_PAGE_SIZE)
+    st.session_state['task_page'] = task_indices.index(row_number - 1) // page_size + 1
+    st.session_state['task_jump_row'] = None
+
+def show_task_pagination(task_indices):
+    # Hanya kartu di halaman aktif yang dirender, jadi widget, state, dan isi input yang dikirim ke
+    # browser tetap sebanyak satu halaman berapa pun jumlah tugas yang dipegang.
+    col_size, col_page, col_jump = st.columns([1, 1, 2], gap="small")
+    with col_size:
+        page_size = st.selectbox(
+            "Kartu per halaman",
+            TASK_PAGE_SIZES,
+            index=TASK_PAGE_SIZES.index(TASK_DEFAULT_PAGE_SIZE),
+            key='task_page_size'
+        )
+    page_count = max(1, -(-len(task_indices) // page_size))
+    st.session_state['task_page'] = min(max(1, st.session_state.get('task_page', 1)), page_count)
+    with col_page:
+        page = st.number_input("Halaman", min_value=1, max_value=page_count, step=1, key='task_page')
+    with col_jump:
+        st.selectbox(
+            "Loncat ke Data #",
+            [index + 1 for index in task_indices],
+            index=None,
+            placeholder="Pilih nomor data...",
+            key='task_jump_row',
+            on_change=jump_to_task,
+            args=(task_indices,)
+        )
+
+    start = (page - 1) * page_size
+    page_indices = task_indices[start:start + page_size]
+    st.caption(f"Menampilkan data ke-{start + 1}–{start + len(page_indices)} dari {len(task_indices)} (halaman {page}/{page_count}).")
+    return page_indices
 
 def show_ats_guidance():
     with st.expander("📘 PANDUAN TRIASE ATS (KLIK UNTUK MEMBUKA)", expanded=False):
@@ -520,6 +1225,14 @@ st.sidebar.divider()
 st.title("🏥 Validator ATS Online")
 show_ats_guidance()
 
+# Hasil klaim mode kontinu sudah ditimpakan ke snapshot; cukup kabari validator sekali per batch.
+if st.session_state.get('continuous_mode'):
+    prefetch_result = pop_claim_prefetch_result("Sheet1", username)
+    if prefetch_result and prefetch_result['claimed']:
+        st.toast(f"🔁 {len(prefetch_result['claimed'])} tugas berikutnya sudah diambil otomatis.", icon="✅")
+    elif prefetch_result and prefetch_result['error']:
+        st.warning(f"Mode kontinu gagal mengambil tugas berikutnya: {prefetch_result['error']}")
+
 # --- LOAD DATA ---
 try:
     df = load_data()
@@ -533,35 +1246,62 @@ try:
         st.stop()
 
     st.session_state['loaded_sheet_rows'] = len(df)
+    st.sidebar.caption(f"🕒 {describe_sheet_snapshot_freshness('Sheet1', LOAD_COLUMNS)}")
     
-    # Cek kolom yang tersedia (gunakan nama kolom dari Google Sheet)
-    # Priority: gunakan kolom yang sudah ada, jika tidak ada buat baru
-    if 'instruction_ats' not in df.columns and 'instruksi_ats' in df.columns:
-        df.rename(columns={'instruksi_ats': 'instruction_ats'}, inplace=True)
-    elif 'instruction_ats' not in df.columns:
-        df['instruction_ats'] = ""
-    
-    if 'validator' not in df.columns and 'nama_validator' in df.columns:
-        df.rename(columns={'nama_validator': 'validator'}, inplace=True)
-    elif 'validator' not in df.columns:
-        df['validator'] = ""
-    
-    # Pastikan kolom penting ada
-    required_cols = ['instruction_ats', 'input', 'output_ats', 'status', 'validator']
-    for col in required_cols:
-        if col not in df.columns:
-            df[col] = ""
-    
-    # KONVERSI DATA KE STRING - LEBIH ROBUST
-    # Handle NaN, None, dan nilai null lainnya
-    for col in required_cols:
-        df[col] = df[col].fillna('').astype(str).str.strip()
-        # Hilangkan string 'nan' 
-        df[col] = df[col].replace('nan', '').str.strip()
-        # Hilangkan 'none' (case-insensitive)
-        df[col] = df[col].mask(df[col].str.lower() == 'none', '')
-        # Final strip setelah semua cleaning
-        df[col] = df[col].str.strip()
+    # Nama kolom lama diganti, kolom penting dibuat bila belum ada, dan nilai NaN/None dikosongkan.
+    # Snapshot bersama cukup dinormalisasi sekali per versi, bukan ulang di setiap rerun.
+    prepared_df = get_prepared_snapshot("Sheet1", LOAD_COLUMNS, SHEET_COLUMNS, rename_legacy=False)
+    df = prepared_df if prepared_df is not None else prepare_sheet_data(df)
+
+    # Klaim yang tidak pernah dimulai dilepas otomatis setelah lease habis.
+    if is_claim_lease_enabled():
+        start_claim_lease_sweeper()
+
+    # Timpa dengan perubahan yang masih di journal supaya tampilan tidak mundur sebelum flush.
+    journal_cells = {}
+    if is_write_behind_enabled():
+        start_journal_flusher()
+        journal_cells = get_journal_cells("Sheet1")
+        df = apply_journal_overlay(df, "Sheet1", journal_cells)
+
+        journal_conflicts = get_journal_conflicts("Sheet1", username)
+        if journal_conflicts:
+            conflict_rows = ", ".join(str(item['row_index'] + 1) for item in journal_conflicts)
+            st.warning(
+                f"Perubahan Anda pada baris {conflict_rows} belum terkirim karena cell yang sama sudah diubah "
+                "di Google Sheet oleh orang lain. Perubahan lain di baris tersebut sudah digabung otomatis."
+            )
+            show_merge_conflicts({item['row_index']: item['cells'] for item in journal_conflicts})
+            col_keep, col_discard = st.columns(2)
+            with col_keep:
+                if st.button("✍️ Pakai versi saya", key="keep_journal_conflicts", use_container_width=True):
+                    keep_journal_changes("Sheet1", [item['row_index'] for item in journal_conflicts])
+                    flush_sheet_journal("Sheet1")
+                    invalidate_sheet_snapshot("Sheet1")
+                    st.rerun()
+            with col_discard:
+                if st.button("🗑️ Pakai versi di Sheet", key="discard_journal_conflicts", use_container_width=True):
+                    discard_journal_rows("Sheet1", [item['row_index'] for item in journal_conflicts])
+                    invalidate_sheet_snapshot("Sheet1")
+                    st.rerun()
+
+        journal_summary = get_journal_summary("Sheet1")
+        if journal_summary['pending_cells']:
+            st.sidebar.caption(
+                f"⏳ {journal_summary['pending_cells']} cell menunggu dikirim "
+                f"({journal_summary['oldest_pending_age']:.0f} detik)."
+            )
+        if journal_summary['last_error']:
+            st.sidebar.caption(f"⚠️ Pengiriman terakhir gagal: {journal_summary['last_error']}")
+        if is_local_primary_enabled():
+            local_status = get_local_store_status("Sheet1")
+            if local_status['pulled_at']:
+                st.sidebar.caption(
+                    f"💾 Mode lokal: {local_status['rows']} baris, sinkron dari Google Sheet "
+                    f"{time.time() - local_status['pulled_at']:.0f} detik lalu."
+                )
+            if local_status['last_error']:
+                st.sidebar.caption(f"⚠️ Sinkronisasi terakhir gagal: {local_status['last_error']}")
     
     # Debug info (untuk test purposes)
     if 'debug_mode' not in st.session_state:
@@ -612,11 +1352,14 @@ except Exception as e:
 # 4. Kolom validator kosong (belum diambil siapapun)
 # 5. Kolom status kosong (belum pernah dikerjakan)
 
-has_input_mask = df['input'] != ''
-available_data_mask = get_available_data_mask(df)
+# Query lewat index bersama (validator/status + flag per baris) alih-alih scan seluruh DataFrame tiap rerun.
+query_index = get_sheet_query_index("Sheet1", LOAD_COLUMNS, journal_cells) or build_query_index(df)
 
 # Data milik user ini
-my_all_tasks = df[has_input_mask & (df['validator'] == username)]
+my_all_tasks = select_index_rows(
+    df,
+    find_index_rows(query_index, equals={'validator': username}, flags=['has_input']),
+)
 
 # Data milik user ini yang BELUM SELESAI (Status bukan 'Done')
 # Termasuk: data baru (status kosong), data sedang dikerjakan, etc
@@ -625,7 +1368,11 @@ my_pending_tasks = my_all_tasks[my_all_tasks['status'] != 'Done']
 my_done_tasks = my_all_tasks[my_all_tasks['status'] == 'Done']
 
 # Hitung Statistik
-sisa_pool = len(df[available_data_mask])
+sisa_pool = len(find_index_rows(
+    query_index,
+    equals={'validator': '', 'status': ''},
+    flags=['has_input', 'labels_empty'],
+))
 total_dikerjakan_saya = len(my_all_tasks)
 sisa_tugas_saya = len(my_pending_tasks)
 selesai_saya = len(my_done_tasks)
@@ -633,14 +1380,45 @@ selesai_saya = len(my_done_tasks)
 st.sidebar.divider()
 st.sidebar.metric("📊 Sisa Data Tersedia", sisa_pool)
 st.sidebar.metric("📋 Total Tugas Saya", total_dikerjakan_saya)
-st.sidebar.metric("✅ Selesai Saya", selesai_saya)
-st.sidebar.metric("⏳ Tugas Aktif Saya", sisa_tugas_saya)
+# Dua metrik ini ikut diperbarui oleh fragment kartu tugas (lihat record_task_done) tanpa rerun penuh.
+task_metrics = {
+    'slots': {'done': st.sidebar.empty(), 'active': st.sidebar.empty()},
+    'done': selesai_saya,
+    'active': sisa_tugas_saya,
+    'pool': sisa_pool,
+}
+st.session_state['task_done_delta'] = 0
+show_task_metrics(task_metrics)
+
+if has_service_account():
+    st.sidebar.toggle(
+        "🔁 Mode kontinu",
+        key='continuous_mode',
+        help=(
+            f"Saat tugas aktif tinggal kurang dari {get_claim_prefetch_threshold()}, batch berikutnya "
+            "diambil otomatis di background."
+        )
+    )
+    if st.session_state.get('continuous_mode'):
+        st.sidebar.number_input(
+            "Jumlah per batch otomatis:",
+            min_value=5,
+            max_value=100,
+            value=CONTINUOUS_DEFAULT_BATCH_SIZE,
+            key='continuous_batch_size'
+        )
+    maybe_prefetch_tasks(sisa_tugas_saya, sisa_pool)
 
 # --- BAGIAN AMBIL TUGAS ---
 # Tombol ambil tugas muncul jika:
 # 1. TIDAK ADA tugas aktif (pending == 0)
 # 2. Ada data tersedia di pool (sisa_pool > 0)
 
+if sisa_tugas_saya == 0 and is_claim_prefetch_running("Sheet1", username):
+    with st.spinner("🔁 Mode kontinu: batch berikutnya sedang diambil..."):
+        wait_claim_prefetch("Sheet1", username, CONTINUOUS_WAIT_SECONDS)
+    st.rerun()
+
 if sisa_tugas_saya == 0 and sisa_pool > 0:
     if total_dikerjakan_saya > 0:
         st.success("🎉 Hebat! Anda telah menyelesaikan semua tugas sebelumnya. Siap ambil lagi?")
@@ -650,6 +1428,11 @@ if sisa_tugas_saya == 0 and sisa_pool > 0:
     with st.form("ambil_tugas_form"):
         st.write("### 📥 Ambil paket data baru untuk dilabeli")
         batch_size = st.number_input("Jumlah baris yang ingin diambil:", min_value=5, max_value=100, value=10)
+        if is_claim_lease_enabled():
+            st.caption(
+                f"Tugas yang belum mulai dikerjakan dalam {get_claim_lease_seconds() / 60:g} menit "
+                "akan dilepas otomatis agar bisa diambil validator lain."
+            )
         
         col1, col2 = st.columns(2)
         with col1:
@@ -670,201 +1453,19 @@ show_history = st.checkbox("📚 Tampilkan riwayat tugas yang sudah selesai", va
 
 if show_history:
     # Tampilkan semua tugas milik user (Active + Done)
-    working_df = my_all_tasks.copy()
+    working_df = my_all_tasks
     st.subheader(f"📋 Semua Tugas Saya ({len(working_df)} data)")
 else:
     # Tampilkan hanya tugas aktif (Pending)
-    working_df = my_pending_tasks.copy()
+    working_df = my_pending_tasks
     st.subheader(f"📝 Area Kerja - Tugas Aktif ({len(working_df)} data)")
 
 if not working_df.empty:
-    for index, row in working_df.iterrows():
-        with st.container():
-            # Tanda visual jika sudah selesai
-            is_done = row.get('status') == 'Done'
-            sync_task_widget_state(index, row)
-            status_icon = "✅ SELESAI" if is_done else "⏳ BELUM SELESAI"
-            
-            # Header dengan status
-            header_color = "#dcfce7" if is_done else "#dbeafe"
-            st.markdown(f"""
-            <div style="background-color:{header_color}; padding: 12px; border-radius: 8px; margin-bottom: 20px; border-left: 5px solid {'#16a34a' if is_done else '#1e40af'};">
-                <h3 style="margin: 0; color: {'#166534' if is_done else '#1e40af'};">📌 Data #{index + 1} - {status_icon}</h3>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            # ROW 1: INPUT (Read-only, Referensi) - Full Width
-            # Tampilkan sebagai custom box (bukan textarea) untuk clarity maksimal
-            input_text = row.get('input', '')
-            st.markdown(f"""
-            <div class='input-reference-box'>
-                <div class='input-reference-header'>📖 INPUT / REFERENSI PASIEN</div>
-                <div style="white-space: pre-wrap; font-size: 16px; line-height: 1.9; color: #2d2d2d;">
-                    {input_text}
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            # ROW 2: INSTRUCTION_ATS dan OUTPUT_ATS - 2 columns
-            st.markdown("<span class='box-header' style='color:#0369a1; margin-top: 15px; margin-bottom: 15px; font-size: 14px;'>✏️ ISI DATA BERIKUT (KOLOM WAJIB DIISI):</span>", unsafe_allow_html=True)
-            
-            col_instr, col_output = st.columns(2, gap="medium")
-            
-            with col_instr:
-                st.markdown("""
-                <div style='background-color: #f0f9ff; padding: 10px; border-radius: 6px; border-left: 4px solid #0284c7; margin-bottom: 10px;'>
-                    <span style='font-weight: 700; color: #0369a1; font-size: 13px;'>✍️ INSTRUCTION ATS</span>
-                </div>
-                """, unsafe_allow_html=True)
-                instruksi_val = st.text_area(
-                    label="Instruction ATS",
-                    value=row.get('instruction_ats', ''),
-                    height=140,
-                    max_chars=MAX_SHEET_CELL_CHARS,
-                    label_visibility="collapsed",
-                    key=f"instr_{index}",
-                    placeholder="Isi klasifikasi ATS berdasarkan instruksi...",
-                    disabled=is_done,
-                    on_change=auto_save_progress,
-                    args=(df, index)
-                )
-            
-            with col_output:
-                st.markdown("""
-                <div style='background-color: #f0fce7; padding: 10px; border-radius: 6px; border-left: 4px solid #22c55e; margin-bottom: 10px;'>
-                    <span style='font-weight: 700; color: #166534; font-size: 13px;'>✍️ OUTPUT ATS</span>
-                </div>
-                """, unsafe_allow_html=True)
-                output_val = st.text_area(
-                    label="Output ATS",
-                    value=row.get('output_ats', ''),
-                    height=140,
-                    max_chars=MAX_SHEET_CELL_CHARS,
-                    label_visibility="collapsed",
-                    key=f"output_{index}",
-                    placeholder="Isi hasil triase/output ATS...",
-                    disabled=is_done,
-                    on_change=auto_save_progress,
-                    args=(df, index)
-                )
-
-            st.markdown("<div style='margin-top: 10px;'></div>", unsafe_allow_html=True)
-            col_similar, col_too_many = st.columns(2, gap="small")
-            with col_similar:
-                st.button(
-                    "Serupa",
-                    key=f"shortcut_serupa_{index}",
-                    use_container_width=True,
-                    disabled=is_done,
-                    on_click=fill_ats_shortcut,
-                    args=(index, "serupa")
-                )
-            with col_too_many:
-                st.button(
-                    "Kasus terlalu banyak",
-                    key=f"shortcut_too_many_{index}",
-                    use_container_width=True,
-                    disabled=is_done,
-                    on_click=fill_ats_shortcut,
-                    args=(index, "kasus terlalu banyak")
-                )
-
-            can_mark_done = (
-                normalize_cell(instruksi_val) != ''
-                and normalize_cell(output_val) != ''
-            )
-            if not is_done and not can_mark_done:
-                st.warning("Isi instruction_ats dan output_ats sebelum menandai tugas sebagai selesai.")
-
-            current_length_violations = get_current_ats_length_violations(index, instruksi_val, output_val)
-            if current_length_violations:
-                show_length_violation_error(current_length_violations)
-             
-            # ROW 3: BUTTONS
-            st.markdown("<div style='margin-top: 15px;'></div>", unsafe_allow_html=True)
-            
-            col_save, col_done, col_status = st.columns([2, 2, 2], gap="small")
-            
-            with col_save:
-                if st.button(
-                    "💾 Simpan Progress",
-                    key=f"save_{index}",
-                    use_container_width=True,
-                    disabled=is_done
-                ):
-                    with st.spinner("💫 Menyimpan progress..."):
-                        current_length_violations = get_current_ats_length_violations(index, instruksi_val, output_val)
-                        if current_length_violations:
-                            show_length_violation_error(current_length_violations)
-                            st.stop()
-                        expected_instruction = row.get('instruction_ats', '')
-                        expected_output = row.get('output_ats', '')
-                        df.at[index, 'instruction_ats'] = instruksi_val
-                        df.at[index, 'output_ats'] = output_val
-                        df.at[index, 'validator'] = username
-                        # Set status ke "Pending" untuk menandakan sedang dikerjakan
-                        df.at[index, 'status'] = "Pending"
-                        if update_data(
-                            df,
-                            [index],
-                            ['instruction_ats', 'output_ats', 'validator', 'status'],
-                            expected_values={
-                                'instruction_ats': expected_instruction,
-                                'output_ats': expected_output,
-                                'validator': username,
-                                'status': ['', 'Pending']
-                            }
-                        ):
-                            st.toast("✅ Progress tersimpan! Status: Sedang Dikerjakan", icon="✅")
-                            time.sleep(0.3)
-            
-            with col_done:
-                if st.button(
-                    "✅ Tandai Selesai",
-                    key=f"done_{index}",
-                    use_container_width=True,
-                    type="primary",
-                    disabled=is_done or not can_mark_done
-                ):
-                    with st.spinner("💫 Menyelesaikan data..."):
-                        current_length_violations = get_current_ats_length_violations(index, instruksi_val, output_val)
-                        if current_length_violations:
-                            show_length_violation_error(current_length_violations, action_label="Tandai selesai")
-                            st.stop()
-                        expected_instruction = row.get('instruction_ats', '')
-                        expected_output = row.get('output_ats', '')
-                        df.at[index, 'instruction_ats'] = instruksi_val
-                        df.at[index, 'output_ats'] = output_val
-                        df.at[index, 'validator'] = username
-                        if not can_mark_done:
-                            st.error("Tidak bisa menandai selesai: instruction_ats dan output_ats wajib diisi.")
-                            st.stop()
-                        df.at[index, 'status'] = "Done"
-                        if update_data(
-                            df,
-                            [index],
-                            ['instruction_ats', 'output_ats', 'validator', 'status'],
-                            expected_values={
-                                'instruction_ats': expected_instruction,
-                                'output_ats': expected_output,
-                                'validator': username,
-                                'status': ['', 'Pending']
-                            }
-                        ):
-                            st.toast("✅ Data selesai! Status diubah ke Done.", icon="✅")
-                            time.sleep(0.5)
-                            if not show_history:
-                                st.rerun()
-            
-            with col_status:
-                status_text = "🎉 SELESAI" if is_done else "⏳ Aktif"
-                st.markdown(f"""
-                <div style="text-align: center; padding: 10px; background-color: {'#dcfce7' if is_done else '#fef08a'}; border-radius: 6px; border: 1px solid {'#bbf7d0' if is_done else '#fcd34d'};">
-                    <small style="font-weight: bold; color: {'#166534' if is_done else '#92400e'};"><strong>{status_text}</strong></small>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            st.divider()
+    pending_indices = list(my_pending_tasks.index)
+    if pending_indices:
+        show_bulk_done_panel(df, pending_indices)
+    for index in show_task_pagination(list(working_df.index)):
+        render_task_card(df, index, show_history, task_metrics)
 
 elif sisa_tugas_saya == 0 and sisa_pool == 0 and total_dikerjakan_saya == 0:
     # User baru, tidak ada tugas, tidak ada data tersedia
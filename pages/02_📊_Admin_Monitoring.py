@@ -1,7 +1,6 @@
 import streamlit as st
 import pandas as pd
 from io import BytesIO
-from streamlit_gsheets import GSheetsConnection
 import plotly.graph_objects as go
 import plotly.express as px
 import os
@@ -10,34 +9,60 @@ from difflib import SequenceMatcher
 import re
 import time
 from auth_config import AUTHORIZED_USERS, ADMIN_CREDENTIALS, AUTHORIZED_ADMINS, REPLACEMENT_ADMINS, SYNTHETIC_DATA_ADMINS
-from sheet_lock import get_sheet_write_lock
+from claim_leases import (
+    CLAIM_LEASE_COLUMN,
+    get_claim_lease_ages,
+    get_claim_lease_status,
+    is_claim_lease_enabled,
+    start_claim_lease_sweeper,
+)
+from sheet_lock import get_sheet_lock_status, get_sheet_row_lock, get_sheet_write_lock
+from sheet_normalize import get_prepared_snapshot, get_prepared_snapshot_status, prepare_sheet_frame
+from sheet_query_index import (
+    PROBLEM_PATTERN,
+    build_query_index,
+    find_index_rows,
+    get_query_index_status,
+    get_sheet_query_index,
+)
 from sheet_range_update import (
+    ROW_VERSION_COLUMN,
+    SheetConflictError,
     append_sheet_rows,
+    ensure_row_ids,
+    get_gsheets_connection,
+    has_service_account,
     is_missing_service_account_error,
+    load_worksheet_snapshot,
+    read_sheet_cells,
+    stamp_row_versions_in_frame,
     update_sheet_cells,
+    update_sheet_cells_if_unchanged,
     update_sheet_cells_with_full_update_fallback,
 )
+from sheet_row_index import ROW_ID_COLUMN, get_row_index_status
+from sheet_snapshot import describe_sheet_snapshot_freshness, get_last_sheet_snapshot, invalidate_sheet_snapshot, replace_sheet_snapshot
 from synthetic_ats_data import ATS_LEVELS, generate_synthetic_ats_cases, get_synthetic_balance_summary
 
 # --- KONFIGURASI HALAMAN ---
 st.set_page_config(layout="wide", page_title="Admin Monitoring Pelabelan")
 
 # --- KONEKSI KE GOOGLE SHEETS ---
-conn = st.connection("gsheets", type=GSheetsConnection)
+conn = get_gsheets_connection()
 
 SHEET_COLUMNS = ['instruction_ats', 'input', 'output_ats', 'validator', 'status']
+# Dashboard cukup membaca kolom inti (plus nama lama dan ID sintetis); kolom replacement yang lebar tidak ikut diunduh.
+LOAD_COLUMNS = SHEET_COLUMNS + ['instruksi_ats', 'nama_validator', 'synthetic_case_id', CLAIM_LEASE_COLUMN, ROW_VERSION_COLUMN, ROW_ID_COLUMN]
 MIN_NONEMPTY_INPUT_ROWS = 1
 MAX_SHEET_CELL_CHARS = 50000
 LENGTH_LIMIT_COLUMNS = ['instruction_ats', 'output_ats']
 PROBLEM_KEYWORDS_LABEL = "sama, serupa, double, seperti sebelumnya, atau terlalu banyak"
-PROBLEM_PATTERN = r"\b(?:sama|serupa|double)\b|seperti\s+sebelumnya|terlalu\s+banyak"
 SYNTHETIC_SIMILARITY_THRESHOLD = 0.86
 SYNTHETIC_CASE_ID_PATTERN = re.compile(r"^ATS-SYN-(\d+)$")
 GEMINI_RETRY_DELAYS = [15, 45, 90]
 GEMINI_INTER_REQUEST_DELAY_SECONDS = 6
 SYNTHETIC_FULL_TOTAL = 700
 SYNTHETIC_INPUT_ONLY_TOTAL = 50
-LOAD_DATA_TTL_SECONDS = 20
 
 def normalize_cell(value):
     if pd.isna(value):
@@ -48,11 +73,6 @@ def normalize_cell(value):
         return ''
     return text
 
-def remember_loaded_sheet(df):
-    if df is not None and not df.empty:
-        st.session_state['admin_last_good_sheet_df'] = df.copy()
-        st.session_state['admin_last_good_sheet_at'] = time.strftime("%Y-%m-%d %H:%M:%S")
-
 def read_sheet_with_retry(attempts=3, delay_seconds=0.5):
     last_error = None
     last_df = None
@@ -69,13 +89,16 @@ def read_sheet_with_retry(attempts=3, delay_seconds=0.5):
     return last_df, last_error
 
 
-@st.cache_data(ttl=LOAD_DATA_TTL_SECONDS)
 def read_sheet_for_display():
-    return conn.read(worksheet="Sheet1", ttl=0)
+    return load_worksheet_snapshot("Sheet1", lambda: conn.read(worksheet="Sheet1", ttl=0), LOAD_COLUMNS)
+
+
+def read_full_sheet_for_export():
+    return load_worksheet_snapshot("Sheet1", lambda: conn.read(worksheet="Sheet1", ttl=0))
 
 
 def clear_display_sheet_cache():
-    read_sheet_for_display.clear()
+    invalidate_sheet_snapshot("Sheet1")
 
 
 def load_data():
@@ -86,7 +109,6 @@ def load_data():
         try:
             last_df = read_sheet_for_display()
             if last_df is not None and not last_df.empty:
-                remember_loaded_sheet(last_df)
                 return last_df
             clear_display_sheet_cache()
         except Exception as e:
@@ -94,12 +116,11 @@ def load_data():
         time.sleep(0.5)
 
     if last_df is not None and not last_df.empty:
-        remember_loaded_sheet(last_df)
         return last_df
 
-    cached_df = st.session_state.get('admin_last_good_sheet_df')
+    cached_df, cached_loaded_at = get_last_sheet_snapshot("Sheet1", LOAD_COLUMNS)
     if cached_df is not None and not cached_df.empty:
-        cached_at = st.session_state.get('admin_last_good_sheet_at', 'sebelumnya')
+        cached_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(cached_loaded_at))
         if last_error:
             st.warning(
                 f"Google Sheet sedang tidak dapat dibaca ({last_error}). "
@@ -117,18 +138,7 @@ def load_data():
     return last_df
 
 def prepare_sheet_data(df):
-    sheet_df = df.copy()
-
-    for col in SHEET_COLUMNS:
-        if col not in sheet_df.columns:
-            sheet_df[col] = ''
-        sheet_df[col] = sheet_df[col].map(normalize_cell)
-
-    legacy_cols = ['instruksi_ats', 'nama_validator']
-    sheet_df = sheet_df.drop(columns=[col for col in legacy_cols if col in sheet_df.columns])
-
-    ordered_cols = SHEET_COLUMNS + [col for col in sheet_df.columns if col not in SHEET_COLUMNS]
-    return sheet_df[ordered_cols]
+    return prepare_sheet_frame(df, SHEET_COLUMNS, rename_legacy=False)
 
 def row_has_problem_label(row):
     instruction = normalize_cell(row.get('instruction_ats', ''))
@@ -196,12 +206,11 @@ def merge_with_latest_sheet(df, changed_indices, changed_columns, expected_value
     return latest_data
 
 def update_data(df, changed_indices=None, changed_columns=None, expected_values=None):
-    with get_sheet_write_lock():
+    with get_sheet_row_lock(changed_indices, "simpan admin"):
         return update_data_unlocked(df, changed_indices, changed_columns, expected_values)
 
 def update_data_unlocked(df, changed_indices=None, changed_columns=None, expected_values=None):
     try:
-        expected_rows = st.session_state.get('admin_loaded_sheet_rows')
         if df is None or df.empty:
             st.error("Update dibatalkan: data yang akan ditulis kosong.")
             return False
@@ -210,53 +219,74 @@ def update_data_unlocked(df, changed_indices=None, changed_columns=None, expecte
             st.error("Update dibatalkan: perubahan baris/kolom tidak diketahui.")
             return False
 
-        sheet_data = merge_with_latest_sheet(df, changed_indices, changed_columns, expected_values)
-        nonempty_input_rows = sheet_data['input'].fillna('').astype(str).str.strip().ne('').sum()
+        missing_rows = [index + 1 for index in changed_indices if index not in df.index]
+        if missing_rows:
+            raise ValueError(f"Baris {missing_rows[0]} tidak ditemukan saat sinkronisasi.")
 
-        if nonempty_input_rows < MIN_NONEMPTY_INPUT_ROWS:
-            st.error("Update dibatalkan: kolom input terbaca kosong. Muat ulang data sebelum mencoba lagi.")
-            return False
-
-        if expected_rows is not None and len(sheet_data) < expected_rows:
-            st.error(
-                f"Update dibatalkan: jumlah baris turun dari {expected_rows} ke {len(sheet_data)}. "
-                "Ini mencegah Google Sheet tertimpa oleh data hasil filter."
-            )
+        pending_data = prepare_sheet_data(df.loc[list(changed_indices)])
+        length_violations = get_ats_length_violations(pending_data, changed_indices)
+        if length_violations:
+            show_length_violation_error(length_violations)
             return False
 
-        length_violations = get_ats_length_violations(sheet_data, changed_indices)
-        if length_violations:
-            details = ", ".join(
-                f"baris {row} kolom {col}: {length:,} karakter"
-                for row, col, length in length_violations
-            )
-            st.error(
-                f"Update dibatalkan: {details}. "
-                f"Batas maksimal Google Sheets adalah {MAX_SHEET_CELL_CHARS:,} karakter per cell."
+        try:
+            update_sheet_cells_if_unchanged(
+                "Sheet1", pending_data, changed_indices, changed_columns, expected_values, admin_username
             )
-            return False
+        except RuntimeError as exc:
+            if not is_missing_service_account_error(exc):
+                raise
+            if not update_full_sheet_unlocked(df, changed_indices, changed_columns, expected_values):
+                return False
 
-        update_sheet_cells_with_full_update_fallback(conn, "Sheet1", sheet_data, changed_indices, changed_columns)
-        st.session_state['admin_loaded_sheet_rows'] = len(sheet_data)
-        remember_loaded_sheet(sheet_data)
-        clear_display_sheet_cache()
         return True
     except Exception as e:
         st.error(f"Gagal update Google Sheet: {e}")
         return False
 
-def replace_problem_inputs(selected_indices, replacement_input, expected_values):
-    try:
-        with get_sheet_write_lock():
-            expected_rows = st.session_state.get('admin_loaded_sheet_rows')
-            latest_df, latest_error = read_sheet_with_retry()
-            if latest_df is None or latest_df.empty:
-                if latest_error:
-                    st.error(f"Replace dibatalkan: Google Sheet terbaru tidak dapat dibaca ({latest_error}).")
-                else:
-                    st.error("Replace dibatalkan: Google Sheet terbaru kosong atau tidak dapat dibaca.")
-                return False
+def update_full_sheet_unlocked(df, changed_indices, changed_columns, expected_values=None):
+    expected_rows = st.session_state.get('admin_loaded_sheet_rows')
+    sheet_data = merge_with_latest_sheet(df, changed_indices, changed_columns, expected_values)
+    nonempty_input_rows = sheet_data['input'].fillna('').astype(str).str.strip().ne('').sum()
 
+    if nonempty_input_rows < MIN_NONEMPTY_INPUT_ROWS:
+        st.error("Update dibatalkan: kolom input terbaca kosong. Muat ulang data sebelum mencoba lagi.")
+        return False
+
+    if expected_rows is not None and len(sheet_data) < expected_rows:
+        st.error(
+            f"Update dibatalkan: jumlah baris turun dari {expected_rows} ke {len(sheet_data)}. "
+            "Ini mencegah Google Sheet tertimpa oleh data hasil filter."
+        )
+        return False
+
+    update_sheet_cells_with_full_update_fallback(
+        conn, "Sheet1", sheet_data, changed_indices, changed_columns, admin_username
+    )
+    st.session_state['admin_loaded_sheet_rows'] = len(sheet_data)
+    return True
+
+def show_length_violation_error(violations, action_label="Update"):
+    details = ", ".join(
+        f"baris {row} kolom {col}: {length:,} karakter"
+        for row, col, length in violations
+    )
+    st.error(
+        f"{action_label} dibatalkan: {details}. "
+        f"Batas maksimal Google Sheets adalah {MAX_SHEET_CELL_CHARS:,} karakter per cell."
+    )
+
+def build_replaced_input_rows(data, selected_indices, replacement_input):
+    replaced_data = prepare_sheet_data(data.loc[list(selected_indices)])
+    replaced_data.loc[selected_indices, 'input'] = replacement_input
+    replaced_data.loc[selected_indices, ['instruction_ats', 'output_ats']] = ''
+    replaced_data.loc[selected_indices, 'status'] = 'Pending'
+    return replaced_data
+
+def replace_problem_inputs(selected_indices, replacement_input, expected_values, current_data):
+    replace_columns = ['input', 'instruction_ats', 'output_ats', 'status']
+    try:
+        with get_sheet_row_lock(selected_indices, "replace input"):
             normalized_replacement_input = replacement_input.strip()
             replacement_input_length = len(normalize_cell(normalized_replacement_input))
             if replacement_input_length > MAX_SHEET_CELL_CHARS:
@@ -266,94 +296,57 @@ def replace_problem_inputs(selected_indices, replacement_input, expected_values)
                 )
                 return False
 
-            latest_data = prepare_sheet_data(latest_df)
-            if expected_rows is not None and len(latest_data) < expected_rows:
-                st.error(
-                    f"Replace dibatalkan: jumlah baris turun dari {expected_rows} ke {len(latest_data)}. "
-                    "Muat ulang data sebelum mencoba lagi."
-                )
-                return False
-
             for index in selected_indices:
-                if index not in latest_data.index:
+                if index not in current_data.index:
                     st.error(f"Replace dibatalkan: baris {index + 1} tidak ditemukan di Google Sheet terbaru.")
                     return False
-
-                for col, expected_by_row in expected_values.items():
-                    if col not in latest_data.columns:
-                        latest_data[col] = ''
-                    latest_value = normalize_cell(latest_data.at[index, col])
-                    expected_value = normalize_cell(expected_by_row.get(index, ''))
-                    if latest_value != expected_value:
-                        st.error(
-                            f"Replace dibatalkan: baris {index + 1} sudah berubah oleh admin/user lain. "
-                            "Muat ulang halaman sebelum mencoba lagi."
-                        )
-                        return False
-
-                if not row_has_problem_label(latest_data.loc[index]):
+                # expected_values berisi instruction_ats/output_ats yang lolos filter, jadi cukup
+                # memastikan cell tersebut belum berubah di Google Sheet.
+                expected_row = pd.Series({col: expected_by_row.get(index, '') for col, expected_by_row in expected_values.items()})
+                if not row_has_problem_label(expected_row):
                     st.error(
                         f"Replace dibatalkan: baris {index + 1} sudah tidak masuk filter label bermasalah. "
                         "Muat ulang halaman sebelum mencoba lagi."
                     )
                     return False
 
-            latest_data.loc[selected_indices, 'input'] = normalized_replacement_input
-            latest_data.loc[selected_indices, ['instruction_ats', 'output_ats']] = ''
-            latest_data.loc[selected_indices, 'status'] = 'Pending'
-
-            length_violations = get_ats_length_violations(latest_data, selected_indices)
+            replaced_data = build_replaced_input_rows(current_data, selected_indices, normalized_replacement_input)
+            length_violations = get_ats_length_violations(replaced_data, selected_indices)
             if length_violations:
-                details = ", ".join(
-                    f"baris {row} kolom {col}: {length:,} karakter"
-                    for row, col, length in length_violations
+                show_length_violation_error(length_violations, action_label="Replace")
+                return False
+
+            try:
+                update_sheet_cells_if_unchanged(
+                    "Sheet1", replaced_data, selected_indices, replace_columns, expected_values, admin_username
                 )
+            except SheetConflictError as exc:
+                rows = ", ".join(str(index + 1) for index in exc.row_indices)
                 st.error(
-                    f"Replace dibatalkan: {details}. "
-                    f"Batas maksimal Google Sheets adalah {MAX_SHEET_CELL_CHARS:,} karakter per cell."
+                    f"Replace dibatalkan: baris {rows} sudah berubah oleh admin/user lain. "
+                    "Muat ulang halaman sebelum mencoba lagi."
                 )
                 return False
+            except RuntimeError as exc:
+                if not is_missing_service_account_error(exc):
+                    raise
+                return replace_problem_inputs_full_sheet(selected_indices, normalized_replacement_input, expected_values)
 
-            update_sheet_cells_with_full_update_fallback(
-                conn,
-                "Sheet1",
-                latest_data,
-                selected_indices,
-                ['input', 'instruction_ats', 'output_ats', 'status'],
-            )
-            st.session_state['admin_loaded_sheet_rows'] = len(latest_data)
-            remember_loaded_sheet(latest_data)
-            clear_display_sheet_cache()
-
-            verified_df, verified_error = read_sheet_with_retry()
-            if verified_df is None or verified_df.empty:
-                if verified_error:
-                    st.warning(
-                        f"Replace tersimpan, tetapi verifikasi Google Sheet belum dapat dibaca ({verified_error}). "
-                        "Dashboard akan memakai data terbaru dari proses replace."
-                    )
-                else:
-                    st.warning(
-                        "Replace tersimpan, tetapi verifikasi Google Sheet terbaca kosong. "
-                        "Dashboard akan memakai data terbaru dari proses replace."
-                    )
+            try:
+                verified_cells = read_sheet_cells("Sheet1", selected_indices, replace_columns)
+            except Exception as verify_error:
+                st.warning(
+                    f"Replace tersimpan, tetapi verifikasi Google Sheet belum dapat dibaca ({verify_error}). "
+                    "Dashboard akan memakai data terbaru dari proses replace."
+                )
                 return True
 
-            verified_data = prepare_sheet_data(verified_df)
-            remember_loaded_sheet(verified_data)
             for index in selected_indices:
-                if index not in verified_data.index:
-                    st.warning(
-                        f"Replace terkirim, tetapi baris {index + 1} tidak ditemukan saat verifikasi. "
-                        "Muat ulang halaman untuk melihat data terbaru."
-                    )
-                    return False
-
                 if (
-                    normalize_cell(verified_data.at[index, 'input']) != normalized_replacement_input
-                    or normalize_cell(verified_data.at[index, 'instruction_ats']) != ''
-                    or normalize_cell(verified_data.at[index, 'output_ats']) != ''
-                    or normalize_cell(verified_data.at[index, 'status']) != 'Pending'
+                    normalize_cell(verified_cells.get((index, 'input'), '')) != normalized_replacement_input
+                    or normalize_cell(verified_cells.get((index, 'instruction_ats'), '')) != ''
+                    or normalize_cell(verified_cells.get((index, 'output_ats'), '')) != ''
+                    or normalize_cell(verified_cells.get((index, 'status'), '')) != 'Pending'
                 ):
                     st.warning(
                         "Replace terkirim, tetapi hasil verifikasi berbeda dari yang diharapkan. "
@@ -366,6 +359,56 @@ def replace_problem_inputs(selected_indices, replacement_input, expected_values)
         st.error(f"Gagal replace input: {e}")
         return False
 
+def replace_problem_inputs_full_sheet(selected_indices, normalized_replacement_input, expected_values):
+    expected_rows = st.session_state.get('admin_loaded_sheet_rows')
+    latest_df, latest_error = read_sheet_with_retry()
+    if latest_df is None or latest_df.empty:
+        if latest_error:
+            st.error(f"Replace dibatalkan: Google Sheet terbaru tidak dapat dibaca ({latest_error}).")
+        else:
+            st.error("Replace dibatalkan: Google Sheet terbaru kosong atau tidak dapat dibaca.")
+        return False
+
+    latest_data = prepare_sheet_data(latest_df)
+    if expected_rows is not None and len(latest_data) < expected_rows:
+        st.error(
+            f"Replace dibatalkan: jumlah baris turun dari {expected_rows} ke {len(latest_data)}. "
+            "Muat ulang data sebelum mencoba lagi."
+        )
+        return False
+
+    for index in selected_indices:
+        if index not in latest_data.index:
+            st.error(f"Replace dibatalkan: baris {index + 1} tidak ditemukan di Google Sheet terbaru.")
+            return False
+
+        for col, expected_by_row in expected_values.items():
+            if col not in latest_data.columns:
+                latest_data[col] = ''
+            latest_value = normalize_cell(latest_data.at[index, col])
+            expected_value = normalize_cell(expected_by_row.get(index, ''))
+            if latest_value != expected_value:
+                st.error(
+                    f"Replace dibatalkan: baris {index + 1} sudah berubah oleh admin/user lain. "
+                    "Muat ulang halaman sebelum mencoba lagi."
+                )
+                return False
+
+    latest_data.loc[selected_indices, 'input'] = normalized_replacement_input
+    latest_data.loc[selected_indices, ['instruction_ats', 'output_ats']] = ''
+    latest_data.loc[selected_indices, 'status'] = 'Pending'
+
+    update_sheet_cells_with_full_update_fallback(
+        conn,
+        "Sheet1",
+        latest_data,
+        selected_indices,
+        ['input', 'instruction_ats', 'output_ats', 'status'],
+        admin_username,
+    )
+    st.session_state['admin_loaded_sheet_rows'] = len(latest_data)
+    return True
+
 def get_gemini_api_key_from_secrets():
     try:
         if "GEMINI_API_KEY" in st.secrets:
@@ -1102,7 +1145,8 @@ def append_synthetic_ats_cases(
     input_only=False,
 ):
     try:
-        with get_sheet_write_lock():
+        # Upsert bisa menyentuh baris mana pun dan append menambah pool klaim, jadi pakai lock global.
+        with get_sheet_write_lock("data sintetis"):
             latest_df, latest_error = read_sheet_with_retry()
             if latest_df is None or latest_df.empty:
                 if latest_error:
@@ -1197,11 +1241,13 @@ def append_synthetic_ats_cases(
             try:
                 update_columns = list(synthetic_data.columns)
                 if updated_count:
-                    update_sheet_cells("Sheet1", latest_data, sorted(set(updated_indices)), update_columns)
+                    update_sheet_cells(
+                        "Sheet1", latest_data, sorted(set(updated_indices)), update_columns, admin_username
+                    )
 
                 if not missing_data.empty:
                     missing_data = prepare_sheet_data(missing_data.fillna(""))
-                    append_sheet_rows("Sheet1", missing_data)
+                    append_sheet_rows("Sheet1", missing_data, admin_username)
             except RuntimeError as exc:
                 if not is_missing_service_account_error(exc):
                     raise
@@ -1210,11 +1256,15 @@ def append_synthetic_ats_cases(
                     "Aplikasi memakai fallback update penuh sementara; tambahkan "
                     "[connections.gsheets.gcp_service_account] agar append per-row aktif."
                 )
+                stamp_row_versions_in_frame(
+                    updated_data,
+                    sorted(set(updated_indices)) + list(range(len(latest_data), len(updated_data))),
+                    admin_username,
+                )
                 conn.update(worksheet="Sheet1", data=updated_data)
+                replace_sheet_snapshot("Sheet1", updated_data)
 
             st.session_state['admin_loaded_sheet_rows'] = len(updated_data)
-            remember_loaded_sheet(updated_data)
-            clear_display_sheet_cache()
             return len(missing_data) + updated_count, len(updated_data)
     except Exception as e:
         st.error(f"Gagal menambahkan data sintetis ke Google Sheet: {e}")
@@ -1290,28 +1340,16 @@ try:
         st.stop()
 
     st.session_state['admin_loaded_sheet_rows'] = len(df)
+    st.caption(f"🕒 {describe_sheet_snapshot_freshness('Sheet1', LOAD_COLUMNS)}")
 
-    # Rename jika kolom yang lama ada
-    if 'nama_validator' in df.columns and 'validator' not in df.columns:
-        df.rename(columns={'nama_validator': 'validator'}, inplace=True)
-    if 'instruksi_ats' in df.columns and 'instruction_ats' not in df.columns:
-        df.rename(columns={'instruksi_ats': 'instruction_ats'}, inplace=True)
+    # Rename kolom lama dan normalisasi string memakai snapshot bersama yang sudah dinormalisasi per versi.
+    prepared_df = get_prepared_snapshot("Sheet1", LOAD_COLUMNS, SHEET_COLUMNS, rename_legacy=False)
+    df = prepared_df if prepared_df is not None else prepare_sheet_data(df)
 
-    for col in ['validator', 'instruction_ats', 'status', 'input', 'output_ats']:
-        if col not in df.columns: df[col] = ""
-    
-    # KONVERSI DATA KE STRING - LEBIH ROBUST
-    # Handle NaN, None, dan nilai null lainnya
-    for col in ['validator', 'instruction_ats', 'status', 'input', 'output_ats']:
-        df[col] = df[col].fillna('').astype(str).str.strip()
-        # Hilangkan string 'nan' 
-        df[col] = df[col].replace('nan', '').str.strip()
-        # Hilangkan 'none' (case-insensitive)
-        df[col] = df[col].mask(df[col].str.lower() == 'none', '')
-        # Final strip setelah semua cleaning
-        df[col] = df[col].str.strip()
-    
     has_input_mask = df['input'] != ''
+    # Baris bermasalah (kata kunci di label) sudah dihitung di index bersama, tidak perlu regex ulang tiap rerun.
+    query_index = get_sheet_query_index("Sheet1", LOAD_COLUMNS) or build_query_index(df)
+    problem_rows = find_index_rows(query_index, flags=['has_input', 'has_problem_text'])
     
 except Exception as e:
     st.error(f"Gagal memuat data: {e}")
@@ -1948,10 +1986,7 @@ def calculate_stats(df, username):
 # --- HITUNG STATISTIK GLOBAL ---
 visible_df = df[has_input_mask].copy()
 
-problem_text_mask = (
-    visible_df['instruction_ats'].str.contains(PROBLEM_PATTERN, case=False, na=False, regex=True)
-    | visible_df['output_ats'].str.contains(PROBLEM_PATTERN, case=False, na=False, regex=True)
-)
+problem_text_mask = visible_df.index.isin(problem_rows)
 
 total_data = len(visible_df)
 unassigned_mask = (
@@ -2026,6 +2061,54 @@ if total_over_length_limit > 0:
         f"{MAX_SHEET_CELL_CHARS:,} karakter. Penyimpanan/update untuk baris tersebut akan dibatalkan."
     )
 
+# --- LEASE KLAIM ---
+with st.expander(f"⏱️ Umur Lease Tugas Diambil (Belum Dimulai): {total_available}"):
+    if is_claim_lease_enabled():
+        start_claim_lease_sweeper()
+    lease_status = get_claim_lease_status()
+    lease_minutes = lease_status['lease_seconds'] / 60
+    lease_ages = get_claim_lease_ages(visible_df)
+
+    if lease_status['lease_seconds'] <= 0:
+        st.caption("Pelepasan otomatis nonaktif (claim_lease_minutes = 0).")
+    elif not is_claim_lease_enabled():
+        st.caption("Pelepasan otomatis butuh Service Account agar klaim bisa dilepas per-row dengan aman.")
+    else:
+        last_run = (
+            time.strftime("%H:%M:%S", time.localtime(lease_status['last_run_at']))
+            if lease_status['last_run_at'] else "belum berjalan"
+        )
+        st.caption(
+            f"Lease {lease_minutes:g} menit · sweeper tiap {lease_status['interval_seconds']:g} detik · "
+            f"terakhir {last_run} · dilepas {lease_status['released']} · "
+            f"diberi timestamp {lease_status['stamped']} · bentrok {lease_status['conflicts']}"
+        )
+        if lease_status['last_error']:
+            st.warning(f"Sweeper terakhir gagal: {lease_status['last_error']}")
+
+    if lease_ages.empty:
+        st.caption("Tidak ada tugas yang diambil tapi belum dimulai.")
+    else:
+        age_minutes = lease_ages['age_seconds'] / 60
+        lease_df = pd.DataFrame({
+            'Baris': lease_ages.index + 1,
+            'Validator': lease_ages['validator'],
+            'Diambil': lease_ages['claimed_at'].map(
+                lambda value: '-' if pd.isna(value) else time.strftime("%Y-%m-%d %H:%M", time.localtime(value))
+            ),
+            'Umur (menit)': age_minutes.round(1),
+            'Sisa Lease (menit)': (lease_minutes - age_minutes).clip(lower=0).round(1),
+        }).sort_values('Umur (menit)', ascending=False, na_position='first')
+
+        col_lease1, col_lease2, col_lease3 = st.columns(3)
+        with col_lease1:
+            st.metric("Tanpa timestamp", int(lease_ages['claimed_at'].isna().sum()))
+        with col_lease2:
+            st.metric("Lease habis", int((age_minutes >= lease_minutes).sum()) if lease_minutes > 0 else 0)
+        with col_lease3:
+            st.metric("Umur terlama (menit)", round(float(age_minutes.max()), 1) if age_minutes.notna().any() else 0)
+        st.dataframe(lease_df, use_container_width=True, hide_index=True)
+
 st.divider()
 
 # --- REKAP PROGRESS PER USER ---
@@ -2239,13 +2322,7 @@ if show_cols:
 st.divider()
 st.markdown("### Replace Input Berdasarkan Label Bermasalah")
 
-problem_mask = (
-    has_input_mask
-    & (
-        df['instruction_ats'].str.contains(PROBLEM_PATTERN, case=False, na=False, regex=True)
-        | df['output_ats'].str.contains(PROBLEM_PATTERN, case=False, na=False, regex=True)
-    )
-)
+problem_mask = has_input_mask & df.index.isin(problem_rows)
 problem_df = df[problem_mask].copy()
 
 st.caption(f"Filter otomatis mencari data dengan instruction_ats atau output_ats yang mengandung kata: {PROBLEM_KEYWORDS_LABEL}.")
@@ -2316,7 +2393,7 @@ else:
                     for index in selected_indices
                 },
             }
-            if replace_problem_inputs(selected_indices, replacement_input, expected_replace_values):
+            if replace_problem_inputs(selected_indices, replacement_input, expected_replace_values, df):
                 st.success(f"Berhasil mengganti input untuk {len(selected_indices)} baris.")
                 st.rerun()
 
@@ -2326,15 +2403,24 @@ st.markdown("### 📥 Export Data")
 col_export1, col_export2 = st.columns(2)
 
 with col_export1:
-    # Export sebagai CSV
-    csv = filtered_df.to_csv(index=False)
-    st.download_button(
-        label="📄 Download CSV",
-        data=csv,
-        file_name="monitoring_pelabelan.csv",
-        mime="text/csv",
-        use_container_width=True
-    )
+    # Export sebagai CSV dari sheet lengkap: snapshot halaman ini hanya memuat LOAD_COLUMNS, sedangkan
+    # export memuat semua kolom (termasuk replacement). Sheet lengkap baru dibaca saat diminta.
+    export_rows = tuple(filtered_df.index)
+    if st.button("📄 Siapkan CSV", use_container_width=True, key="prepare_monitoring_csv"):
+        full_df = prepare_sheet_data(read_full_sheet_for_export())
+        st.session_state['monitoring_csv'] = (
+            export_rows,
+            full_df.loc[full_df.index.intersection(filtered_df.index)].to_csv(index=False),
+        )
+    prepared_export = st.session_state.get('monitoring_csv')
+    if prepared_export and prepared_export[0] == export_rows:
+        st.download_button(
+            label="📄 Download CSV",
+            data=prepared_export[1],
+            file_name="monitoring_pelabelan.csv",
+            mime="text/csv",
+            use_container_width=True
+        )
 
 with col_export2:
     # Export statistics sebagai CSV
@@ -2386,5 +2472,74 @@ with col_ready_excel:
     if not excel_ready:
         st.caption("Export Excel belum tersedia karena dependency Excel tidak aktif. Gunakan CSV.")
 
+# --- KONTENSI LOCK ---
+with st.expander("🔒 Kontensi Lock Google Sheet"):
+    try:
+        lock_status = get_sheet_lock_status()
+        st.caption(
+            f"Backend: {lock_status['backend']} · {lock_status['stripes']} stripe baris · "
+            f"proses {lock_status['process']}"
+        )
+        if lock_status['pool_owner']:
+            owner = lock_status['pool_owner']
+            st.caption(
+                f"Pool klaim sedang dipegang {owner.get('host', '?')} pid {owner.get('pid', '?')} "
+                f"untuk {owner.get('operation', '-')}."
+            )
+        row_index_status = get_row_index_status("Sheet1")
+        st.caption(
+            f"Index row_id: {row_index_status['rows']} baris · dibaca ulang {row_index_status['refreshes']}x · "
+            f"write dialihkan ke posisi baru {row_index_status['remapped_rows']}x"
+        )
+        query_index_status = get_query_index_status("Sheet1", LOAD_COLUMNS)
+        st.caption(
+            f"Index query: {query_index_status['rows']} baris · dibangun ulang {query_index_status['rebuilds']}x · "
+            f"diperbarui inkremental {query_index_status['patches']}x"
+        )
+        prepared_snapshot_status = get_prepared_snapshot_status()
+        st.caption(
+            f"Normalisasi snapshot: {prepared_snapshot_status['entries']} proyeksi · "
+            f"dihitung {prepared_snapshot_status['builds']}x · dipakai ulang {prepared_snapshot_status['hits']}x"
+        )
+        if row_index_status['missing']:
+            st.warning(
+                f"Ada {row_index_status['missing']} baris tanpa row_id (baris lama atau ditambah manual). "
+                "Baris tersebut disimpan lewat posisi sampai row_id-nya diisi."
+            )
+            if has_service_account() and st.button("🆔 Isi row_id yang kosong", key="backfill_row_ids"):
+                with st.spinner("Mengisi row_id..."):
+                    ensure_row_ids("Sheet1", df)
+                st.success("row_id baris yang kosong sudah diisi.")
+        if row_index_status['duplicates']:
+            st.warning(
+                f"Ada {row_index_status['duplicates']} row_id ganda di Google Sheet (mis. hasil copy-paste baris). "
+                "Baris tersebut disimpan lewat posisi; kosongkan row_id salinan agar diisi ulang otomatis."
+            )
+        if lock_status['lease_takeovers'] or lock_status['lease_lost']:
+            st.warning(
+                f"Lease diambil alih: {lock_status['lease_takeovers']}x · "
+                f"lease hilang saat dipegang: {lock_status['lease_lost']}x"
+            )
+
+        lock_rows = []
+        for operation, metrics in sorted(lock_status['operations'].items()):
+            count = max(metrics['count'], 1)
+            lock_rows.append({
+                'Operasi': operation,
+                'Jumlah': metrics['count'],
+                'Menunggu': metrics['contended'],
+                'Timeout': metrics['timeouts'],
+                'Rata-rata tunggu (dtk)': round(metrics['wait_seconds'] / count, 3),
+                'Maks tunggu (dtk)': round(metrics['max_wait_seconds'], 3),
+                'Rata-rata tahan (dtk)': round(metrics['hold_seconds'] / count, 3),
+                'Maks tahan (dtk)': round(metrics['max_hold_seconds'], 3),
+            })
+        if lock_rows:
+            st.dataframe(pd.DataFrame(lock_rows), use_container_width=True, hide_index=True)
+        else:
+            st.caption("Belum ada operasi tulis sejak server dijalankan.")
+    except Exception as e:
+        st.caption(f"Status lock tidak tersedia: {e}")
+
 st.divider()
 st.caption("🔒 Admin Monitoring Panel - Akses Terbatas")
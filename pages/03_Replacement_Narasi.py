@@ -6,21 +6,29 @@ import pandas as pd
 import requests
 import streamlit as st
 import streamlit.components.v1 as components
-from streamlit_gsheets import GSheetsConnection
 
 from auth_config import AUTHORIZED_REPLACEMENT_USERS, REPLACEMENT_USER_CREDENTIALS
-from sheet_lock import get_sheet_write_lock
-from sheet_range_update import update_sheet_cells_with_full_update_fallback
+from sheet_local_store import commit_local_cells
+from sheet_lock import SheetLockTimeoutError, get_sheet_pool_lock, get_sheet_row_lock
+from sheet_normalize import get_prepared_snapshot, prepare_sheet_frame
+from sheet_query_index import DELIMITER_TEXT, build_query_index, find_index_rows, get_sheet_query_index, select_index_rows
+from sheet_range_update import (
+    get_gsheets_connection,
+    is_local_primary_enabled,
+    is_missing_service_account_error,
+    load_worksheet_snapshot,
+    update_sheet_cells_if_unchanged,
+    update_sheet_cells_with_full_update_fallback,
+)
+from sheet_snapshot import describe_sheet_snapshot_freshness, invalidate_sheet_snapshot
 
 
 st.set_page_config(layout="wide", page_title="Replacement Narasi")
 
-conn = st.connection("gsheets", type=GSheetsConnection)
+conn = get_gsheets_connection()
 
-DELIMITER_TEXT = "----- INI PEMBATAS SAJA -----"
 WORKSHEET_NAME = "Sheet1"
 MAX_SHEET_CELL_CHARS = 50000
-LOAD_DATA_TTL_SECONDS = 20
 BASE_COLUMNS = ["instruction_ats", "input", "output_ats", "validator", "status"]
 PROTECTED_LABELING_COLUMNS = {"instruction_ats", "output_ats", "validator", "status"}
 REPLACEMENT_COLUMNS = [
@@ -151,36 +159,15 @@ def get_secret_value(*keys):
 
 
 def prepare_sheet_data(df):
-    sheet_df = df.copy()
-
-    if "instruction_ats" not in sheet_df.columns and "instruksi_ats" in sheet_df.columns:
-        sheet_df = sheet_df.rename(columns={"instruksi_ats": "instruction_ats"})
-    if "validator" not in sheet_df.columns and "nama_validator" in sheet_df.columns:
-        sheet_df = sheet_df.rename(columns={"nama_validator": "validator"})
-
-    for col in BASE_COLUMNS + REPLACEMENT_COLUMNS:
-        if col not in sheet_df.columns:
-            sheet_df[col] = ""
-        sheet_df[col] = sheet_df[col].map(normalize_cell)
+    return prepare_sheet_frame(df, BASE_COLUMNS + REPLACEMENT_COLUMNS)
 
-    legacy_cols = ["instruksi_ats", "nama_validator"]
-    sheet_df = sheet_df.drop(columns=[col for col in legacy_cols if col in sheet_df.columns])
-
-    ordered_cols = (
-        BASE_COLUMNS
-        + REPLACEMENT_COLUMNS
-        + [col for col in sheet_df.columns if col not in BASE_COLUMNS + REPLACEMENT_COLUMNS]
-    )
-    return sheet_df[ordered_cols]
 
-
-@st.cache_data(ttl=LOAD_DATA_TTL_SECONDS)
 def read_sheet_for_display():
-    return conn.read(worksheet=WORKSHEET_NAME, ttl=0)
+    return load_worksheet_snapshot(WORKSHEET_NAME, lambda: conn.read(worksheet=WORKSHEET_NAME, ttl=0))
 
 
 def clear_display_sheet_cache():
-    read_sheet_for_display.clear()
+    invalidate_sheet_snapshot(WORKSHEET_NAME)
 
 
 def load_data():
@@ -209,19 +196,18 @@ def unclaimed_pool_mask(df):
     )
 
 
-def active_replacement_mask(df, username):
-    replacement_status = df["replacement_status"].map(normalize_cell)
-    return (
-        (df["replacement_user"] == username)
-        & (replacement_status != "Done")
-        & (
-            (replacement_status == "Claimed")
-            | (
-                df["input"].str.contains(DELIMITER_TEXT, case=False, na=False, regex=False)
-                & (df["status"] == "Done")
-            )
-        )
+def find_active_replacement_rows(query_index, username):
+    claimed_rows = find_index_rows(
+        query_index,
+        equals={"replacement_user": username, "replacement_status": "Claimed"},
     )
+    delimiter_rows = find_index_rows(
+        query_index,
+        equals={"replacement_user": username, "status": "Done"},
+        not_equals={"replacement_status": "Done"},
+        flags=["has_delimiter"],
+    )
+    return sorted(set(claimed_rows) | set(delimiter_rows))
 
 
 def merge_update_rows(pending_df, changed_indices, changed_columns, expected_values=None):
@@ -273,16 +259,39 @@ def update_rows(df, changed_indices, changed_columns, expected_values=None):
             st.error(f"Penyimpanan replacement dibatalkan: kolom labeling tidak boleh diubah ({protected_list}).")
             return False
 
-        with get_sheet_write_lock():
-            sheet_data = merge_update_rows(df, changed_indices, changed_columns, expected_values)
-            update_sheet_cells_with_full_update_fallback(
-                conn,
-                WORKSHEET_NAME,
-                sheet_data,
-                changed_indices,
-                changed_columns,
-            )
-            clear_display_sheet_cache()
+        missing_rows = [index + 1 for index in changed_indices if index not in df.index]
+        if missing_rows:
+            raise ValueError(f"Baris {missing_rows[0]} tidak ditemukan saat sinkronisasi.")
+
+        if is_local_primary_enabled():
+            # Draft replacement langsung di-commit ke salinan lokal; replikator mengirimnya ke sheet.
+            pending_data = prepare_sheet_data(df.loc[list(changed_indices)])
+            commit_local_cells(WORKSHEET_NAME, pending_data, changed_indices, changed_columns, expected_values, username)
+            return True
+
+        with get_sheet_row_lock(changed_indices, "replacement"):
+            pending_data = prepare_sheet_data(df.loc[list(changed_indices)])
+            try:
+                update_sheet_cells_if_unchanged(
+                    WORKSHEET_NAME,
+                    pending_data,
+                    changed_indices,
+                    changed_columns,
+                    expected_values,
+                    username,
+                )
+            except RuntimeError as exc:
+                if not is_missing_service_account_error(exc):
+                    raise
+                sheet_data = merge_update_rows(df, changed_indices, changed_columns, expected_values)
+                update_sheet_cells_with_full_update_fallback(
+                    conn,
+                    WORKSHEET_NAME,
+                    sheet_data,
+                    changed_indices,
+                    changed_columns,
+                    username,
+                )
             return True
     except Exception as e:
         st.error(f"Gagal menyimpan ke Google Sheet: {e}")
@@ -290,37 +299,48 @@ def update_rows(df, changed_indices, changed_columns, expected_values=None):
 
 
 def claim_tasks(df, username, batch_size):
-    with get_sheet_write_lock():
+    try:
+        with get_sheet_pool_lock("ambil tugas replacement"):
+            return claim_tasks_unlocked(username, batch_size)
+    except SheetLockTimeoutError as exc:
+        st.error(f"Tidak dapat mengambil tugas: {exc}")
+        return 0
+
+
+def claim_tasks_unlocked(username, batch_size):
+    if is_local_primary_enabled():
+        latest_df = read_sheet_for_display()
+    else:
         latest_df = conn.read(worksheet=WORKSHEET_NAME, ttl=0)
-        if latest_df is None or latest_df.empty:
-            st.error("Tidak dapat mengambil tugas: Google Sheet kosong atau tidak dapat dibaca.")
-            return 0
-
-        latest_data = prepare_sheet_data(latest_df)
-        available_indices = latest_data[unclaimed_pool_mask(latest_data)].head(batch_size).index.tolist()
-        if not available_indices:
-            st.info("Tidak ada data replacement baru yang bisa diambil.")
-            return 0
-
-        expected_values = {
-            "input": {index: latest_data.at[index, "input"] for index in available_indices},
-            "status": {index: "Done" for index in available_indices},
-            "replacement_user": {index: "" for index in available_indices},
-            "replacement_status": {index: "" for index in available_indices},
-        }
-        latest_data.loc[available_indices, "replacement_user"] = username
-        latest_data.loc[available_indices, "replacement_status"] = "Claimed"
-        latest_data.loc[available_indices, "replacement_original_input"] = latest_data.loc[available_indices, "input"]
-
-        if update_rows(
-            latest_data,
-            available_indices,
-            ["replacement_user", "replacement_status", "replacement_original_input"],
-            expected_values,
-        ):
-            return len(available_indices)
+    if latest_df is None or latest_df.empty:
+        st.error("Tidak dapat mengambil tugas: Google Sheet kosong atau tidak dapat dibaca.")
+        return 0
+
+    latest_data = prepare_sheet_data(latest_df)
+    available_indices = latest_data[unclaimed_pool_mask(latest_data)].head(batch_size).index.tolist()
+    if not available_indices:
+        st.info("Tidak ada data replacement baru yang bisa diambil.")
         return 0
 
+    expected_values = {
+        "input": {index: latest_data.at[index, "input"] for index in available_indices},
+        "status": {index: "Done" for index in available_indices},
+        "replacement_user": {index: "" for index in available_indices},
+        "replacement_status": {index: "" for index in available_indices},
+    }
+    latest_data.loc[available_indices, "replacement_user"] = username
+    latest_data.loc[available_indices, "replacement_status"] = "Claimed"
+    latest_data.loc[available_indices, "replacement_original_input"] = latest_data.loc[available_indices, "input"]
+
+    if update_rows(
+        latest_data,
+        available_indices,
+        ["replacement_user", "replacement_status", "replacement_original_input"],
+        expected_values,
+    ):
+        return len(available_indices)
+    return 0
+
 
 def build_generation_prompt(source_text):
     return (
@@ -578,14 +598,22 @@ if df is None or df.empty:
     st.error("Google Sheet kosong atau tidak dapat diakses.")
     st.stop()
 
-df = prepare_sheet_data(df)
-
-available_count = len(df[unclaimed_pool_mask(df)])
-my_active_df = df[
-    active_replacement_mask(df, username)
-].copy()
-my_done_count = len(df[(df["replacement_user"] == username) & (df["replacement_status"] == "Done")])
-all_done_count = len(df[df["replacement_status"] == "Done"])
+# Normalisasi snapshot dihitung sekali per versi dan dipakai bersama semua session.
+prepared_df = get_prepared_snapshot(WORKSHEET_NAME, None, BASE_COLUMNS + REPLACEMENT_COLUMNS)
+df = prepared_df if prepared_df is not None else prepare_sheet_data(df)
+st.sidebar.caption(describe_sheet_snapshot_freshness(WORKSHEET_NAME))
+
+# Hitungan sidebar dan area kerja memakai index bersama, bukan mask penuh di setiap rerun.
+query_index = get_sheet_query_index(WORKSHEET_NAME) or build_query_index(df)
+available_count = len(find_index_rows(
+    query_index,
+    equals={"status": "Done", "replacement_user": ""},
+    not_equals={"replacement_status": "Done"},
+    flags=["has_delimiter"],
+))
+my_active_df = select_index_rows(df, find_active_replacement_rows(query_index, username)).copy()
+my_done_count = len(find_index_rows(query_index, equals={"replacement_user": username, "replacement_status": "Done"}))
+all_done_count = len(find_index_rows(query_index, equals={"replacement_status": "Done"}))
 
 st.sidebar.metric("Tersedia", available_count)
 st.sidebar.metric("Tugas Aktif Saya", len(my_active_df))
@@ -7,20 +7,15 @@ import pandas as pd
 import requests
 import streamlit as st
 
-from sheet_range_update import (
-    column_index_to_letter,
-    execute_google_request_with_retry,
-    get_sheets_values_service,
-    get_spreadsheet_id,
-    quote_worksheet_name,
-)
+from sheet_normalize import get_prepared_snapshot, normalize_column, normalize_columns, prepare_sheet_frame
+from sheet_query_index import DELIMITER_TEXT, build_query_index, find_index_rows, get_sheet_query_index, select_index_rows
+from sheet_range_update import load_worksheet_snapshot
+from sheet_snapshot import invalidate_sheet_snapshot
 
 
 st.set_page_config(layout="wide", page_title="Replacement Narasi Mandiri")
 
-DELIMITER_TEXT = "----- INI PEMBATAS SAJA -----"
 WORKSHEET_NAME = "Sheet1"
-LOAD_DATA_TTL_SECONDS = 20
 MAX_CELL_CHARS = 50000
 AUTOSAVE_DIR = Path("outputs")
 AUTOSAVE_XLSX = AUTOSAVE_DIR / "hasil_replacement_huggingface_autosave.xlsx"
@@ -151,66 +146,15 @@ def get_secret_value(*keys):
 
 
 def prepare_sheet_data(df):
-    sheet_df = df.copy()
-
-    if "instruction_ats" not in sheet_df.columns and "instruksi_ats" in sheet_df.columns:
-        sheet_df = sheet_df.rename(columns={"instruksi_ats": "instruction_ats"})
-    if "validator" not in sheet_df.columns and "nama_validator" in sheet_df.columns:
-        sheet_df = sheet_df.rename(columns={"nama_validator": "validator"})
-
-    for col in BASE_COLUMNS + REPLACEMENT_COLUMNS:
-        if col not in sheet_df.columns:
-            sheet_df[col] = ""
-        sheet_df[col] = sheet_df[col].map(normalize_cell)
-
-    legacy_cols = ["instruksi_ats", "nama_validator"]
-    sheet_df = sheet_df.drop(columns=[col for col in legacy_cols if col in sheet_df.columns])
-
-    ordered_cols = (
-        BASE_COLUMNS
-        + REPLACEMENT_COLUMNS
-        + [col for col in sheet_df.columns if col not in BASE_COLUMNS + REPLACEMENT_COLUMNS]
-    )
-    return sheet_df[ordered_cols]
+    return prepare_sheet_frame(df, BASE_COLUMNS + REPLACEMENT_COLUMNS)
 
 
-@st.cache_data(ttl=LOAD_DATA_TTL_SECONDS)
 def read_sheet_for_display():
-    service = get_sheets_values_service()
-    spreadsheet_id = get_spreadsheet_id()
-    header_result = execute_google_request_with_retry(
-        lambda: service.get(
-            spreadsheetId=spreadsheet_id,
-            range=f"{quote_worksheet_name(WORKSHEET_NAME)}!1:1",
-        )
-    )
-    header_values = header_result.get("values", [[]])
-    headers = [normalize_cell(header) for header in (header_values[0] if header_values else [])]
-    headers = [header for header in headers if header]
-    if not headers:
-        return pd.DataFrame()
-
-    end_column = column_index_to_letter(len(headers))
-    result = execute_google_request_with_retry(
-        lambda: service.get(
-            spreadsheetId=spreadsheet_id,
-            range=f"{quote_worksheet_name(WORKSHEET_NAME)}!A:{end_column}",
-        )
-    )
-    values = result.get("values", [])
-    if not values:
-        return pd.DataFrame()
-
-    rows = values[1:]
-    normalized_rows = [
-        row + [""] * (len(headers) - len(row))
-        for row in rows
-    ]
-    return pd.DataFrame(normalized_rows, columns=headers)
+    return load_worksheet_snapshot(WORKSHEET_NAME)
 
 
 def clear_display_sheet_cache():
-    read_sheet_for_display.clear()
+    invalidate_sheet_snapshot(WORKSHEET_NAME)
 
 
 def load_sheet_data():
@@ -222,7 +166,8 @@ def load_sheet_data():
         try:
             df = read_sheet_for_display()
             if df is not None:
-                return prepare_sheet_data(df)
+                prepared_df = get_prepared_snapshot(WORKSHEET_NAME, None, BASE_COLUMNS + REPLACEMENT_COLUMNS)
+                return prepared_df if prepared_df is not None else prepare_sheet_data(df)
         except Exception as e:
             last_error = e
             clear_display_sheet_cache()
@@ -237,8 +182,18 @@ def replacement_candidate_mask(df):
     return (
         (df["input"].str.contains(DELIMITER_TEXT, case=False, na=False, regex=False))
         & (df["status"] == "Done")
-        & (df["replacement_status"].map(normalize_cell) == "")
-        & (df["replacement_user"].map(normalize_cell) == "")
+        & (normalize_column(df["replacement_status"]) == "")
+        & (normalize_column(df["replacement_user"]) == "")
+    )
+
+
+def find_replacement_candidate_rows(sheet_df):
+    # Kriteria sama dengan replacement_candidate_mask, dijawab dari index snapshot bersama.
+    query_index = get_sheet_query_index(WORKSHEET_NAME) or build_query_index(sheet_df)
+    return find_index_rows(
+        query_index,
+        equals={"status": "Done", "replacement_status": "", "replacement_user": ""},
+        flags=["has_delimiter"],
     )
 
 
@@ -414,15 +369,7 @@ def call_huggingface_replacement(model_id, source_text, temperature, max_output_
 
 
 def prepare_dataframe(df):
-    prepared_df = df.copy()
-    for col in prepared_df.columns:
-        prepared_df[col] = prepared_df[col].map(normalize_cell)
-    for col in REPLACEMENT_COLUMNS:
-        if col not in prepared_df.columns:
-            prepared_df[col] = ""
-        else:
-            prepared_df[col] = prepared_df[col].map(normalize_cell)
-    return prepared_df
+    return normalize_columns(df, list(df.columns) + [col for col in REPLACEMENT_COLUMNS if col not in df.columns])
 
 
 def dataframe_to_excel_bytes(df):
@@ -575,13 +522,13 @@ with col_load:
         elif sheet_df.empty:
             st.error("Google Sheet terbaca, tetapi tidak ada data di worksheet.")
         else:
-            candidate_df = sheet_df[replacement_candidate_mask(sheet_df)].copy()
+            candidate_df = select_index_rows(sheet_df, find_replacement_candidate_rows(sheet_df)).copy()
             candidate_df = prepare_dataframe(candidate_df)
             st.session_state["sheet_replacement_summary"] = {
                 "total_candidate": len(candidate_df),
-                "replacement_user_filled": int(candidate_df["replacement_user"].map(normalize_cell).ne("").sum()),
-                "replacement_user_empty": int(candidate_df["replacement_user"].map(normalize_cell).eq("").sum()),
-                "old_replacement_done": int(candidate_df["replacement_status"].map(normalize_cell).eq("Done").sum()),
+                "replacement_user_filled": int(normalize_column(candidate_df["replacement_user"]).ne("").sum()),
+                "replacement_user_empty": int(normalize_column(candidate_df["replacement_user"]).eq("").sum()),
+                "old_replacement_done": int(normalize_column(candidate_df["replacement_status"]).eq("Done").sum()),
             }
             st.session_state["sheet_replacement_df"] = candidate_df
             autosave_result(candidate_df)
@@ -596,9 +543,9 @@ with col_autosave:
             st.session_state["sheet_replacement_df"] = autosave_df
             st.session_state["sheet_replacement_summary"] = {
                 "total_candidate": len(autosave_df),
-                "replacement_user_filled": int(autosave_df["replacement_user"].map(normalize_cell).ne("").sum()) if "replacement_user" in autosave_df.columns else 0,
-                "replacement_user_empty": int(autosave_df["replacement_user"].map(normalize_cell).eq("").sum()) if "replacement_user" in autosave_df.columns else 0,
-                "old_replacement_done": int(autosave_df["replacement_status"].map(normalize_cell).eq("Done").sum()) if "replacement_status" in autosave_df.columns else 0,
+                "replacement_user_filled": int(normalize_column(autosave_df["replacement_user"]).ne("").sum()) if "replacement_user" in autosave_df.columns else 0,
+                "replacement_user_empty": int(normalize_column(autosave_df["replacement_user"]).eq("").sum()) if "replacement_user" in autosave_df.columns else 0,
+                "old_replacement_done": int(normalize_column(autosave_df["replacement_status"]).eq("Done").sum()) if "replacement_status" in autosave_df.columns else 0,
             }
             st.success(f"Autosave dimuat: {len(autosave_df)} baris.")
             st.rerun()
@@ -628,10 +575,10 @@ retry_error_rows = st.checkbox(
 )
 completed_statuses = ["Done"] if retry_error_rows else ["Done", "Error"]
 pending_indices = replacement_df[
-    ~replacement_df["hf_replacement_status"].map(normalize_cell).isin(completed_statuses)
+    ~normalize_column(replacement_df["hf_replacement_status"]).isin(completed_statuses)
 ].index.tolist()
-error_count = int(replacement_df["hf_replacement_status"].map(normalize_cell).eq("Error").sum())
-done_count = int(replacement_df["hf_replacement_status"].map(normalize_cell).eq("Done").sum())
+error_count = int(normalize_column(replacement_df["hf_replacement_status"]).eq("Error").sum())
+done_count = int(normalize_column(replacement_df["hf_replacement_status"]).eq("Done").sum())
 
 summary = st.session_state.get("sheet_replacement_summary", {})
 col_total, col_done_session, col_pending_session, col_batch = st.columns(4)
@@ -0,0 +1,450 @@
+import json
+import logging
+import threading
+import time
+from contextlib import closing
+
+import pandas as pd
+import streamlit as st
+
+from claim_pool import (
+    CLAIM_MAX_ATTEMPTS,
+    pop_claim_candidates,
+    record_claim_result,
+    return_claim_candidates,
+    sync_claim_pool,
+)
+from sheet_merge import SheetMergeConflictError, format_merge_conflict_message, merge_row_cells
+from sheet_range_update import (
+    SheetConflictError,
+    find_missing_row_ids,
+    format_conflict_message,
+    get_allowed_values,
+    get_change_token_probe,
+    get_gsheets_option,
+    is_local_primary_enabled,
+    normalize_cell_for_compare,
+    normalize_cell_for_sheet,
+    read_sheet_dataframe,
+)
+from sheet_row_index import record_missing_row_ids
+from sheet_snapshot import apply_cells_to_snapshot, load_sheet_snapshot, project_snapshot_columns
+from sheet_write_journal import (
+    connect_journal,
+    insert_journal_cells,
+    select_journal_cells,
+    select_journal_cells_since,
+    start_journal_flusher,
+)
+
+
+LOCAL_PULL_INTERVAL_SECONDS = 30
+# Probe perubahan bisa buta terhadap edit manual (mis. "local"); tarik ulang penuh minimal sekali per interval ini.
+LOCAL_PULL_MAX_AGE_SECONDS = 300
+LOCAL_SNAPSHOT_TTL_SECONDS = 2
+
+logger = logging.getLogger(__name__)
+
+# Disimpan di file SQLite yang sama dengan journal supaya cek precondition dan pencatatan
+# perubahan berada dalam satu transaksi.
+LOCAL_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS local_sheets (
+    worksheet TEXT PRIMARY KEY,
+    columns TEXT NOT NULL,
+    change_token TEXT,
+    pulled_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS local_rows (
+    worksheet TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    row_values TEXT NOT NULL,
+    PRIMARY KEY (worksheet, row_index)
+);
+"""
+
+
+def get_local_pull_interval_seconds():
+    try:
+        return max(5.0, float(get_gsheets_option("local_pull_interval_seconds", LOCAL_PULL_INTERVAL_SECONDS)))
+    except (TypeError, ValueError):
+        return LOCAL_PULL_INTERVAL_SECONDS
+
+
+def connect_local_store():
+    connection = connect_journal()
+    connection.executescript(LOCAL_STORE_SCHEMA)
+    return connection
+
+
+@st.cache_resource
+def get_local_replicator_store():
+    return {
+        "lock": threading.Lock(),
+        "last_pull_at": None,
+        "last_pull_seconds": None,
+        "pulls": 0,
+        "skipped_pulls": 0,
+        "last_error": None,
+    }
+
+
+def record_pull_result(pulled, seconds=None, error=None):
+    store = get_local_replicator_store()
+    with store["lock"]:
+        store["last_error"] = error
+        if pulled:
+            store["last_pull_at"] = time.time()
+            store["last_pull_seconds"] = seconds
+            store["pulls"] += 1
+        elif error is None:
+            store["skipped_pulls"] += 1
+
+
+def get_local_store_status(worksheet):
+    store = get_local_replicator_store()
+    with store["lock"]:
+        status = {key: value for key, value in store.items() if key != "lock"}
+    with closing(connect_local_store()) as connection:
+        pulled = connection.execute(
+            "SELECT pulled_at FROM local_sheets WHERE worksheet = ?",
+            (worksheet,),
+        ).fetchone()
+        status["rows"] = connection.execute(
+            "SELECT COUNT(*) FROM local_rows WHERE worksheet = ?",
+            (worksheet,),
+        ).fetchone()[0]
+    status["pulled_at"] = pulled[0] if pulled else None
+    return status
+
+
+def read_change_token(worksheet):
+    probe = get_change_token_probe(worksheet)
+    if probe is None:
+        return None
+    try:
+        return probe()
+    except Exception:
+        logger.exception("Probe perubahan worksheet %s gagal; salinan lokal ditarik penuh.", worksheet)
+        return None
+
+
+def pull_local_store(worksheet, force=False):
+    # Tarik isi Google Sheet ke salinan lokal bila probe melihat perubahan (atau salinan sudah tua).
+    # Perubahan lokal yang belum terkirim tetap di journal dan terus ditimpakan di atas salinan ini.
+    change_token = read_change_token(worksheet)
+    with closing(connect_local_store()) as connection:
+        stored = connection.execute(
+            "SELECT change_token, pulled_at FROM local_sheets WHERE worksheet = ?",
+            (worksheet,),
+        ).fetchone()
+    if (
+        not force
+        and stored
+        and change_token is not None
+        and str(change_token) == stored[0]
+        and time.time() - stored[1] < LOCAL_PULL_MAX_AGE_SECONDS
+    ):
+        return False
+
+    df = read_sheet_dataframe(worksheet)
+    if df is None or df.empty:
+        return False
+    # Replikator tidak menulis ke sheet: baris tanpa row_id disimpan apa adanya (dialamatkan lewat
+    # posisi) dan hanya dilaporkan; pengisian row_id lewat aksi admin ensure_row_ids.
+    record_missing_row_ids(worksheet, len(find_missing_row_ids(df)))
+
+    columns = [str(column) for column in df.columns]
+    rows = [
+        (worksheet, int(row_index), json.dumps([normalize_cell_for_sheet(value) for value in values]))
+        for row_index, values in zip(df.index, df.itertuples(index=False, name=None))
+    ]
+    with closing(connect_local_store()) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM local_rows WHERE worksheet = ?", (worksheet,))
+            connection.executemany(
+                "INSERT INTO local_rows (worksheet, row_index, row_values) VALUES (?, ?, ?)",
+                rows,
+            )
+            connection.execute(
+                """
+                INSERT INTO local_sheets (worksheet, columns, change_token, pulled_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (worksheet) DO UPDATE SET
+                    columns = excluded.columns,
+                    change_token = excluded.change_token,
+                    pulled_at = excluded.pulled_at
+                """,
+                (worksheet, json.dumps(columns), None if change_token is None else str(change_token), time.time()),
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+    return True
+
+
+def ensure_local_store(worksheet):
+    with closing(connect_local_store()) as connection:
+        exists = connection.execute(
+            "SELECT 1 FROM local_sheets WHERE worksheet = ?",
+            (worksheet,),
+        ).fetchone()
+    if not exists:
+        pull_local_store(worksheet, force=True)
+
+
+def read_local_frame(connection, worksheet, row_indices=None):
+    # Salinan lokal = isi sheet terakhir yang ditarik + perubahan di journal (pending/baru terkirim).
+    meta = connection.execute(
+        "SELECT columns FROM local_sheets WHERE worksheet = ?",
+        (worksheet,),
+    ).fetchone()
+    if meta is None:
+        return None
+
+    query = "SELECT row_index, row_values FROM local_rows WHERE worksheet = ?"
+    params = [worksheet]
+    if row_indices is not None:
+        row_indices = list(row_indices)
+        query += f" AND row_index IN ({','.join('?' * len(row_indices))})"
+        params.extend(row_indices)
+    index = []
+    values = []
+    for row_index, row_values in connection.execute(query + " ORDER BY row_index", params):
+        index.append(row_index)
+        values.append(json.loads(row_values))
+    df = pd.DataFrame(values, index=index, columns=json.loads(meta[0]), dtype=object)
+
+    for (row_index, column), value in select_journal_cells(connection, worksheet).items():
+        if row_index not in df.index:
+            continue
+        if column not in df.columns:
+            df[column] = ""
+        df.at[row_index, column] = value
+    return df
+
+
+def read_local_worksheet(worksheet, columns=None):
+    ensure_local_store(worksheet)
+    with closing(connect_local_store()) as connection:
+        df = read_local_frame(connection, worksheet)
+    return project_snapshot_columns(df, columns)
+
+
+def get_local_store_token(worksheet):
+    # Murah: satu query kecil; hanya berubah saat salinan ditarik ulang dari sheet. Perubahan journal
+    # tidak ikut token agar autosave tidak memaksa semua session men-decode ulang seluruh tabel.
+    with closing(connect_local_store()) as connection:
+        pulled = connection.execute(
+            "SELECT pulled_at FROM local_sheets WHERE worksheet = ?",
+            (worksheet,),
+        ).fetchone()
+    return pulled[0] if pulled else None
+
+
+@st.cache_resource
+def get_local_journal_watermarks():
+    return {"lock": threading.Lock(), "updated_at": {}}
+
+
+def sync_local_journal_cells(worksheet):
+    # Cell journal yang berubah sejak dicek terakhir (juga dari proses lain) ditimpakan ke snapshot
+    # bersama; nilai yang sudah ada di snapshot aman ditimpa ulang.
+    watermarks = get_local_journal_watermarks()
+    with watermarks["lock"]:
+        updated_after = watermarks["updated_at"].get(worksheet, 0.0)
+        with closing(connect_local_store()) as connection:
+            rows = select_journal_cells_since(connection, worksheet, updated_after)
+        if not rows:
+            return
+        apply_cells_to_snapshot(worksheet, {(row_index, column): value for row_index, column, value, _ in rows})
+        watermarks["updated_at"][worksheet] = max(updated_at for *_, updated_at in rows)
+
+
+def load_local_worksheet(worksheet, columns=None):
+    start_local_replicator()
+    sync_local_journal_cells(worksheet)
+    return load_sheet_snapshot(
+        worksheet,
+        lambda: read_local_worksheet(worksheet, columns),
+        ttl=LOCAL_SNAPSHOT_TTL_SECONDS,
+        columns=columns,
+        probe=lambda: get_local_store_token(worksheet),
+    )
+
+
+def find_local_conflicts(local_data, row_indices, expected_values):
+    conflicts = []
+    for row_index in row_indices:
+        if row_index not in local_data.index:
+            conflicts.append(row_index)
+            continue
+        for column, expected_value in (expected_values or {}).items():
+            if isinstance(expected_value, dict) and row_index not in expected_value:
+                continue
+            latest_value = local_data.at[row_index, column] if column in local_data.columns else ""
+            if normalize_cell_for_compare(latest_value) not in get_allowed_values(expected_value, row_index):
+                conflicts.append(row_index)
+                break
+    return conflicts
+
+
+def commit_local_cells(
+    worksheet,
+    data,
+    row_indices,
+    columns,
+    expected_values=None,
+    updated_by="",
+    merge_conflicts=False,
+):
+    # Transaksi lokal: precondition dicek terhadap salinan lokal lalu perubahan dicatat ke journal,
+    # tanpa round-trip ke Google Sheets. Replikasi ke sheet berjalan di background.
+    row_indices = [] if row_indices is None else list(row_indices)
+    columns = [] if columns is None else list(columns)
+    if not row_indices or not columns:
+        return {}
+
+    ensure_local_store(worksheet)
+    written_values = {}
+    with closing(connect_local_store()) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            local_data = read_local_frame(connection, worksheet, row_indices)
+            if merge_conflicts:
+                row_columns, cell_conflicts = merge_local_rows(local_data, data, row_indices, columns, expected_values)
+                if cell_conflicts:
+                    raise SheetMergeConflictError(
+                        format_merge_conflict_message(cell_conflicts),
+                        list(cell_conflicts),
+                        cell_conflicts=cell_conflicts,
+                    )
+            else:
+                conflicts = find_local_conflicts(local_data, row_indices, expected_values)
+                if conflicts:
+                    raise SheetConflictError(format_conflict_message(conflicts), conflicts)
+                row_columns = {row_index: columns for row_index in row_indices}
+
+            for row_index, changed_columns in row_columns.items():
+                if not changed_columns:
+                    continue
+                insert_journal_cells(
+                    connection, worksheet, data, [row_index], changed_columns, expected_values, updated_by
+                )
+                for column in changed_columns:
+                    written_values[(row_index, column)] = normalize_cell_for_sheet(data.at[row_index, column])
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    apply_cells_to_snapshot(worksheet, written_values)
+    return written_values
+
+
+def merge_local_rows(local_data, data, row_indices, columns, expected_values):
+    row_columns = {}
+    cell_conflicts = {}
+    for row_index in row_indices:
+        if row_index not in local_data.index:
+            raise ValueError(f"Baris {row_index + 1} tidak ditemukan di salinan lokal.")
+        merged, row_conflicts = merge_row_cells(
+            row_index,
+            {column: data.at[row_index, column] for column in columns},
+            expected_values,
+            local_data.loc[row_index].to_dict(),
+        )
+        if row_conflicts:
+            cell_conflicts[row_index] = row_conflicts
+        row_columns[row_index] = list(merged)
+    return row_columns, cell_conflicts
+
+
+def commit_local_claims(worksheet, row_indices, claim_values, expected_values, updated_by=""):
+    written_values = {}
+    with closing(connect_local_store()) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            local_data = read_local_frame(connection, worksheet, row_indices)
+            conflicts = find_local_conflicts(local_data, row_indices, expected_values)
+            free_rows = [row_index for row_index in row_indices if row_index not in conflicts]
+            if free_rows:
+                claim_data = local_data.loc[free_rows].copy()
+                for column, value in claim_values.items():
+                    claim_data[column] = value
+                insert_journal_cells(
+                    connection, worksheet, claim_data, free_rows, list(claim_values), expected_values, updated_by
+                )
+                for row_index in free_rows:
+                    for column, value in claim_values.items():
+                        written_values[(row_index, column)] = normalize_cell_for_sheet(value)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    apply_cells_to_snapshot(worksheet, written_values)
+    return free_rows
+
+
+def claim_local_rows(
+    worksheet,
+    pool_name,
+    loaded_at,
+    build_available_indices,
+    batch_size,
+    claim_values,
+    expected_values,
+    operation="ambil tugas",
+    updated_by="",
+):
+    # Pengganti claim_rows_grouped di mode local primary: kandidat tetap dari antrian claim_pool,
+    # tetapi cek dan klaim cukup satu transaksi SQLite lokal. Hasil: (diklaim, konflik, belum terverifikasi).
+    ensure_local_store(worksheet)
+    pool = sync_claim_pool(worksheet, pool_name, loaded_at, build_available_indices)
+    claimed = []
+    conflicts = []
+    for _ in range(CLAIM_MAX_ATTEMPTS):
+        candidates = pop_claim_candidates(pool, batch_size - len(claimed))
+        if not candidates:
+            break
+        try:
+            free_rows = commit_local_claims(worksheet, candidates, claim_values, expected_values, updated_by)
+        except Exception:
+            return_claim_candidates(pool, candidates)
+            raise
+        claimed.extend(free_rows)
+        candidate_conflicts = [row_index for row_index in candidates if row_index not in free_rows]
+        conflicts.extend(candidate_conflicts)
+        if not candidate_conflicts:
+            break
+    record_claim_result(pool, len(claimed), len(conflicts))
+    return claimed, conflicts, []
+
+
+def list_local_worksheets():
+    with closing(connect_local_store()) as connection:
+        return [worksheet for (worksheet,) in connection.execute("SELECT worksheet FROM local_sheets")]
+
+
+def run_local_replicator():
+    # Push ditangani flusher journal (batchUpdate per interval); thread ini menarik edit dari luar aplikasi.
+    while True:
+        time.sleep(get_local_pull_interval_seconds())
+        if not is_local_primary_enabled():
+            continue
+        for worksheet in list_local_worksheets():
+            started_at = time.time()
+            try:
+                record_pull_result(pull_local_store(worksheet), time.time() - started_at)
+            except Exception as exc:
+                record_pull_result(False, error=str(exc))
+                logger.exception("Gagal menarik perubahan worksheet %s ke salinan lokal.", worksheet)
+
+
+@st.cache_resource
+def start_local_replicator():
+    start_journal_flusher()
+    thread = threading.Thread(target=run_local_replicator, name="sheet-local-replicator", daemon=True)
+    thread.start()
+    return thread
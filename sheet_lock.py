@@ -1,6 +1,486 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
 import threading
+import time
+import uuid
+from contextlib import closing
+from pathlib import Path
 
-SHEET_WRITE_LOCK = threading.RLock()
+from sheet_range_update import get_gsheets_option, has_service_account
 
-def get_sheet_write_lock():
-    return SHEET_WRITE_LOCK
+SHEET_LOCK_POOL_NAME = "pool"
+SHEET_LOCK_STRIPES = 64
+SHEET_LOCK_BACKENDS = ("thread", "file", "sqlite")
+SHEET_LOCK_DEFAULT_PATHS = {
+    "file": "outputs/sheet_write.lock",
+    "sqlite": "outputs/sheet_write_lock.sqlite3",
+}
+SHEET_LOCK_TIMEOUT_SECONDS = 30
+SHEET_LOCK_LEASE_SECONDS = 60
+SHEET_LOCK_POLL_SECONDS = 0.05
+SHEET_LOCK_PROCESS_IDS = {}
+SHEET_LOCK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheet_lock_leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    owner_info TEXT NOT NULL,
+    acquired_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+logger = logging.getLogger(__name__)
+
+# Satu entry per nama lock (pool atau stripe baris); field selain "lock" hanya diubah oleh
+# thread yang sedang memegang RLock entry tersebut.
+SHEET_NAMED_LOCKS = {}
+SHEET_NAMED_LOCKS_GUARD = threading.Lock()
+SHEET_LEASE_RENEWER = {"lock": threading.Lock(), "leases": {}, "thread": None}
+SHEET_LOCK_METRICS = {"lock": threading.Lock(), "operations": {}, "lease_takeovers": 0, "lease_lost": 0}
+
+
+class SheetLockTimeoutError(RuntimeError):
+    def __init__(self, message, owner_info=None):
+        super().__init__(message)
+        self.owner_info = dict(owner_info or {})
+
+
+def get_lock_backend():
+    backend = str(get_gsheets_option("lock_backend", "thread")).strip().lower()
+    if backend not in SHEET_LOCK_BACKENDS:
+        raise RuntimeError(
+            f"lock_backend '{backend}' tidak dikenal. Pilih salah satu: {', '.join(SHEET_LOCK_BACKENDS)}."
+        )
+    return backend
+
+
+def get_lock_path(backend):
+    return Path(get_gsheets_option("lock_path", SHEET_LOCK_DEFAULT_PATHS.get(backend, "")))
+
+
+def get_lock_seconds_option(key, default):
+    try:
+        return max(0.0, float(get_gsheets_option(key, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_lock_stripe_count():
+    # Semua replika harus memakai jumlah stripe yang sama agar baris yang sama memetakan ke lock yang sama.
+    try:
+        return max(1, int(get_gsheets_option("lock_stripes", SHEET_LOCK_STRIPES)))
+    except (TypeError, ValueError):
+        return SHEET_LOCK_STRIPES
+
+
+def get_lock_process_id():
+    # Dihitung per pid agar proses hasil fork tidak mewarisi identitas pemilik lock induknya.
+    pid = os.getpid()
+    if pid not in SHEET_LOCK_PROCESS_IDS:
+        SHEET_LOCK_PROCESS_IDS[pid] = f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:8]}"
+    return SHEET_LOCK_PROCESS_IDS[pid]
+
+
+def build_owner_info(operation):
+    return {
+        "owner": get_lock_process_id(),
+        "host": socket.gethostname(),
+        "pid": os.getpid(),
+        "thread": threading.current_thread().name,
+        "operation": operation,
+        "acquired_at": time.time(),
+    }
+
+
+def describe_lock_owner(owner_info):
+    if not owner_info:
+        return "pemilik tidak diketahui"
+    age = time.time() - float(owner_info.get("acquired_at") or time.time())
+    operation = f" untuk {owner_info['operation']}" if owner_info.get("operation") else ""
+    return (
+        f"{owner_info.get('host', '?')} pid {owner_info.get('pid', '?')} "
+        f"thread {owner_info.get('thread', '?')}{operation}, {age:.0f} detik lalu"
+    )
+
+
+def get_named_lock(name):
+    with SHEET_NAMED_LOCKS_GUARD:
+        entry = SHEET_NAMED_LOCKS.get(name)
+        if entry is None:
+            entry = {
+                "name": name,
+                "lock": threading.RLock(),
+                "depth": 0,
+                "backend": None,
+                "handle": None,
+                "owner_info": None,
+            }
+            SHEET_NAMED_LOCKS[name] = entry
+        return entry
+
+
+def get_file_lock_path(path, name):
+    return path.with_name(f"{path.name}.{name}")
+
+
+def acquire_file_lock(path, name, owner_info, deadline, lease_seconds):
+    # flock dilepas otomatis oleh kernel saat proses mati, jadi tidak ada lock yatim yang perlu kedaluwarsa.
+    try:
+        import fcntl
+    except ImportError as exc:
+        raise RuntimeError("lock_backend 'file' membutuhkan fcntl (Linux/macOS).") from exc
+
+    path = get_file_lock_path(path, name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handle = open(path, "a+", encoding="utf-8")
+    while True:
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                handle.close()
+                return None
+            time.sleep(SHEET_LOCK_POLL_SECONDS)
+
+    handle.seek(0)
+    handle.truncate()
+    handle.write(json.dumps(owner_info))
+    handle.flush()
+    return handle
+
+
+def release_file_lock(handle):
+    import fcntl
+
+    try:
+        handle.seek(0)
+        handle.truncate()
+        handle.flush()
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+    finally:
+        handle.close()
+
+
+def read_file_lock_owner(path, name):
+    try:
+        with open(get_file_lock_path(path, name), encoding="utf-8") as handle:
+            content = handle.read().strip()
+        return json.loads(content) if content else None
+    except (OSError, ValueError):
+        return None
+
+
+def connect_lock_database(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    connection.executescript(SHEET_LOCK_SCHEMA)
+    return connection
+
+
+def try_acquire_sqlite_lease(connection, name, owner_info, lease_seconds):
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        row = connection.execute(
+            "SELECT owner, owner_info, expires_at FROM sheet_lock_leases WHERE name = ?",
+            (name,),
+        ).fetchone()
+        if row is not None and row[0] != owner_info["owner"] and row[2] > now:
+            connection.execute("ROLLBACK")
+            return False
+        if row is not None and row[0] != owner_info["owner"]:
+            # Pemegang lama tidak memperpanjang lease (proses mati/hang); lease diambil alih.
+            with SHEET_LOCK_METRICS["lock"]:
+                SHEET_LOCK_METRICS["lease_takeovers"] += 1
+            logger.warning(
+                "Lease lock sheet %s milik %s kedaluwarsa; diambil alih oleh %s.",
+                name,
+                describe_lock_owner(json.loads(row[1] or "{}")),
+                owner_info["owner"],
+            )
+        connection.execute(
+            "INSERT OR REPLACE INTO sheet_lock_leases (name, owner, owner_info, acquired_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (name, owner_info["owner"], json.dumps(owner_info), now, now + lease_seconds),
+        )
+        connection.execute("COMMIT")
+        return True
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+
+
+def run_lease_renewer():
+    # Satu thread per proses memperpanjang semua lease yang sedang dipegang, berapa pun jumlah stripe-nya.
+    while True:
+        with SHEET_LEASE_RENEWER["lock"]:
+            leases = dict(SHEET_LEASE_RENEWER["leases"])
+        interval = min((lease["lease_seconds"] for lease in leases.values()), default=SHEET_LOCK_LEASE_SECONDS)
+        time.sleep(max(interval / 3, SHEET_LOCK_POLL_SECONDS))
+
+        for (path, name), lease in leases.items():
+            try:
+                with closing(connect_lock_database(path)) as connection:
+                    renewed = connection.execute(
+                        "UPDATE sheet_lock_leases SET expires_at = ? WHERE name = ? AND owner = ?",
+                        (time.time() + lease["lease_seconds"], name, lease["owner"]),
+                    ).rowcount
+                with SHEET_LEASE_RENEWER["lock"]:
+                    still_held = SHEET_LEASE_RENEWER["leases"].get((path, name)) is lease
+                if not renewed and still_held:
+                    with SHEET_LOCK_METRICS["lock"]:
+                        SHEET_LOCK_METRICS["lease_lost"] += 1
+                    logger.error("Lease lock sheet %s milik %s hilang sebelum dilepas.", name, lease["owner"])
+            except Exception:
+                logger.exception("Gagal memperpanjang lease lock sheet %s.", name)
+
+
+def acquire_sqlite_lock(path, name, owner_info, deadline, lease_seconds):
+    with closing(connect_lock_database(path)) as connection:
+        while not try_acquire_sqlite_lease(connection, name, owner_info, lease_seconds):
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(SHEET_LOCK_POLL_SECONDS)
+
+    lease = {"path": path, "name": name, "owner": owner_info["owner"], "lease_seconds": lease_seconds}
+    with SHEET_LEASE_RENEWER["lock"]:
+        SHEET_LEASE_RENEWER["leases"][(path, name)] = lease
+        if SHEET_LEASE_RENEWER["thread"] is None:
+            SHEET_LEASE_RENEWER["thread"] = threading.Thread(
+                target=run_lease_renewer,
+                name="sheet-lock-lease-renewer",
+                daemon=True,
+            )
+            SHEET_LEASE_RENEWER["thread"].start()
+    return lease
+
+
+def release_sqlite_lock(handle):
+    with SHEET_LEASE_RENEWER["lock"]:
+        SHEET_LEASE_RENEWER["leases"].pop((handle["path"], handle["name"]), None)
+    with closing(connect_lock_database(handle["path"])) as connection:
+        connection.execute(
+            "DELETE FROM sheet_lock_leases WHERE name = ? AND owner = ?",
+            (handle["name"], handle["owner"]),
+        )
+
+
+def read_sqlite_lock_owner(path, name):
+    if not path.exists():
+        return None
+    with closing(connect_lock_database(path)) as connection:
+        row = connection.execute(
+            "SELECT owner_info, expires_at FROM sheet_lock_leases WHERE name = ?",
+            (name,),
+        ).fetchone()
+    if row is None:
+        return None
+    owner_info = json.loads(row[0] or "{}")
+    owner_info["expires_in_seconds"] = row[1] - time.time()
+    return owner_info
+
+
+SHEET_LOCK_BACKEND_HANDLERS = {
+    "file": (acquire_file_lock, release_file_lock, read_file_lock_owner),
+    "sqlite": (acquire_sqlite_lock, release_sqlite_lock, read_sqlite_lock_owner),
+}
+
+
+def get_operation_metrics(operation):
+    # Dipanggil dengan SHEET_LOCK_METRICS["lock"] dipegang.
+    return SHEET_LOCK_METRICS["operations"].setdefault(
+        operation,
+        {
+            "count": 0,
+            "contended": 0,
+            "timeouts": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "hold_seconds": 0.0,
+            "max_hold_seconds": 0.0,
+        },
+    )
+
+
+def record_lock_wait(operation, wait_seconds):
+    with SHEET_LOCK_METRICS["lock"]:
+        metrics = get_operation_metrics(operation)
+        metrics["count"] += 1
+        if wait_seconds >= SHEET_LOCK_POLL_SECONDS:
+            metrics["contended"] += 1
+        metrics["wait_seconds"] += wait_seconds
+        metrics["max_wait_seconds"] = max(metrics["max_wait_seconds"], wait_seconds)
+
+
+def record_lock_hold(operation, hold_seconds):
+    with SHEET_LOCK_METRICS["lock"]:
+        metrics = get_operation_metrics(operation)
+        metrics["hold_seconds"] += hold_seconds
+        metrics["max_hold_seconds"] = max(metrics["max_hold_seconds"], hold_seconds)
+
+
+def record_lock_timeout(operation):
+    with SHEET_LOCK_METRICS["lock"]:
+        get_operation_metrics(operation)["timeouts"] += 1
+
+
+def raise_lock_timeout(owner_info, timeout):
+    raise SheetLockTimeoutError(
+        f"Data Google Sheet yang sama sedang dipakai proses lain lebih dari {timeout:g} detik "
+        f"(dipegang {describe_lock_owner(owner_info)}). Coba lagi sebentar lagi.",
+        owner_info,
+    )
+
+
+def acquire_process_lock(entry, operation, deadline, timeout):
+    backend = get_lock_backend()
+    owner_info = build_owner_info(operation)
+    handle = None
+    if backend in SHEET_LOCK_BACKEND_HANDLERS:
+        acquire, _, read_owner = SHEET_LOCK_BACKEND_HANDLERS[backend]
+        path = get_lock_path(backend)
+        lease_seconds = get_lock_seconds_option("lock_lease_seconds", SHEET_LOCK_LEASE_SECONDS)
+        handle = acquire(path, entry["name"], owner_info, deadline, lease_seconds)
+        if handle is None:
+            raise_lock_timeout(read_owner(path, entry["name"]), timeout)
+
+    entry["backend"] = backend
+    entry["handle"] = handle
+    entry["owner_info"] = owner_info
+
+
+def acquire_named_lock(name, operation, deadline, timeout):
+    # Reentrant per thread; lock lintas proses hanya diambil di level terluar.
+    entry = get_named_lock(name)
+    if not entry["lock"].acquire(timeout=max(0.0, deadline - time.monotonic())):
+        raise_lock_timeout(entry["owner_info"], timeout)
+
+    if entry["depth"] == 0:
+        try:
+            acquire_process_lock(entry, operation, deadline, timeout)
+        except BaseException:
+            entry["lock"].release()
+            raise
+    entry["depth"] += 1
+
+
+def release_named_lock(name):
+    entry = get_named_lock(name)
+    entry["depth"] -= 1
+    try:
+        if entry["depth"] == 0:
+            handle = entry["handle"]
+            entry["handle"] = None
+            entry["owner_info"] = None
+            if handle is not None:
+                SHEET_LOCK_BACKEND_HANDLERS[entry["backend"]][1](handle)
+    finally:
+        entry["lock"].release()
+
+
+def get_lock_order(name):
+    # Urutan tetap (pool dulu, lalu stripe menaik) mencegah deadlock antar operasi.
+    return name != SHEET_LOCK_POOL_NAME, name
+
+
+class SheetLockSet:
+    def __init__(self, names, operation):
+        self.names = sorted(set(names), key=get_lock_order)
+        self.operation = operation
+        self.acquired = []
+        self.acquired_at = None
+
+    def acquire(self, timeout=None):
+        if timeout is None:
+            timeout = get_lock_seconds_option("lock_timeout_seconds", SHEET_LOCK_TIMEOUT_SECONDS)
+        started_at = time.monotonic()
+        deadline = started_at + timeout
+        try:
+            for name in self.names:
+                acquire_named_lock(name, self.operation, deadline, timeout)
+                self.acquired.append(name)
+        except BaseException as exc:
+            self.release()
+            if isinstance(exc, SheetLockTimeoutError):
+                record_lock_timeout(self.operation)
+            raise
+
+        self.acquired_at = time.monotonic()
+        record_lock_wait(self.operation, self.acquired_at - started_at)
+        return True
+
+    def release(self):
+        try:
+            while self.acquired:
+                release_named_lock(self.acquired.pop())
+        finally:
+            if self.acquired_at is not None:
+                record_lock_hold(self.operation, time.monotonic() - self.acquired_at)
+                self.acquired_at = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def get_stripe_name(stripe):
+    return f"stripe-{stripe:03d}"
+
+
+def get_row_stripe_names(row_indices):
+    stripe_count = get_lock_stripe_count()
+    return [get_stripe_name(int(row_index) % stripe_count) for row_index in row_indices]
+
+
+def get_sheet_write_lock(operation="tulis penuh"):
+    # Lock global = pool + semua stripe; untuk operasi yang menulis ulang seluruh sheet.
+    return SheetLockSet(
+        [SHEET_LOCK_POOL_NAME] + [get_stripe_name(stripe) for stripe in range(get_lock_stripe_count())],
+        operation,
+    )
+
+
+def get_sheet_row_lock(row_indices, operation="simpan"):
+    # Tanpa service account write jatuh ke update penuh (conn.update), jadi tetap perlu lock global.
+    if not has_service_account():
+        return get_sheet_write_lock(operation)
+    return SheetLockSet(get_row_stripe_names(row_indices or []), operation)
+
+
+def get_sheet_pool_lock(operation="ambil tugas"):
+    # Lock pendek untuk memilih baris kosong saat klaim; baris terpilih tetap dikunci lewat stripe-nya.
+    return SheetLockSet([SHEET_LOCK_POOL_NAME], operation)
+
+
+def get_sheet_lock_status():
+    backend = get_lock_backend()
+    with SHEET_NAMED_LOCKS_GUARD:
+        entries = list(SHEET_NAMED_LOCKS.values())
+    held = sorted((entry["name"] for entry in entries if entry["depth"] > 0), key=get_lock_order)
+    pool_owner = get_named_lock(SHEET_LOCK_POOL_NAME)["owner_info"]
+    if pool_owner is None and backend in SHEET_LOCK_BACKEND_HANDLERS:
+        pool_owner = SHEET_LOCK_BACKEND_HANDLERS[backend][2](get_lock_path(backend), SHEET_LOCK_POOL_NAME)
+    with SHEET_LOCK_METRICS["lock"]:
+        operations = {
+            operation: dict(metrics)
+            for operation, metrics in SHEET_LOCK_METRICS["operations"].items()
+        }
+        lease_takeovers = SHEET_LOCK_METRICS["lease_takeovers"]
+        lease_lost = SHEET_LOCK_METRICS["lease_lost"]
+    return {
+        "backend": backend,
+        "process": get_lock_process_id(),
+        "stripes": get_lock_stripe_count(),
+        "held_by_this_process": held,
+        "pool_owner": pool_owner,
+        "lease_takeovers": lease_takeovers,
+        "lease_lost": lease_lost,
+        "operations": operations,
+    }
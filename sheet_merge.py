@@ -0,0 +1,94 @@
+from sheet_range_update import (
+    ROW_VERSION_COLUMN,
+    SheetConflictError,
+    get_allowed_values,
+    normalize_cell_for_compare,
+    read_sheet_cells,
+)
+
+
+# Kolom kepemilikan/status: perubahan orang lain di sini selalu dianggap bentrok walaupun nilai kita
+# sendiri tidak berubah (tugas diambil alih, dilepas lease, atau sudah Done).
+MERGE_GUARD_COLUMNS = {"validator", "status", "replacement_user", "replacement_status"}
+
+
+class SheetMergeConflictError(SheetConflictError):
+    def __init__(self, message, row_indices=None, latest_values=None, cell_conflicts=None):
+        super().__init__(message, row_indices, latest_values)
+        # {row_index: [{"column", "base", "mine", "theirs"}]} hanya untuk cell yang benar-benar bentrok.
+        self.cell_conflicts = dict(cell_conflicts or {})
+
+
+def merge_row_cells(row_index, mine_values, base_values, theirs_values, guard_columns=MERGE_GUARD_COLUMNS):
+    # Three-way merge satu baris. base_values memakai format expected_values; nilai dasar adalah
+    # nilai yang dilihat pemanggil saat mulai mengedit, theirs adalah nilai terbaru di Google Sheet.
+    merged = {}
+    cell_conflicts = []
+    columns = list(dict.fromkeys(list(mine_values) + list(base_values or {})))
+    for column in columns:
+        if column == ROW_VERSION_COLUMN:
+            continue
+        base_value = (base_values or {}).get(column)
+        if isinstance(base_value, dict) and row_index not in base_value:
+            base_value = None
+        allowed_values = None if base_value is None else get_allowed_values(base_value, row_index)
+        theirs = normalize_cell_for_compare(theirs_values.get(column, ""))
+
+        if column not in mine_values:
+            # Kolom yang hanya jadi precondition (mis. row_id, input) tidak boleh berubah.
+            if allowed_values is not None and theirs not in allowed_values:
+                cell_conflicts.append(build_cell_conflict(column, allowed_values, None, theirs))
+            continue
+
+        mine = normalize_cell_for_compare(mine_values[column])
+        if allowed_values is None or theirs in allowed_values:
+            merged[column] = mine_values[column]
+        elif theirs == mine:
+            continue
+        elif mine in allowed_values and column not in guard_columns:
+            # Hanya orang lain yang mengubah cell ini; nilai mereka dipertahankan.
+            continue
+        else:
+            cell_conflicts.append(build_cell_conflict(column, allowed_values, mine, theirs))
+    return merged, cell_conflicts
+
+
+def build_cell_conflict(column, allowed_values, mine, theirs):
+    return {"column": column, "base": sorted(allowed_values), "mine": mine, "theirs": theirs}
+
+
+def merge_conflicted_rows(worksheet, row_indices, cell_values, base_values, guard_columns=MERGE_GUARD_COLUMNS):
+    # Baca cell terbaru baris yang bentrok (satu batchGet), lalu gabungkan per baris.
+    # Mengembalikan cell hasil merge yang aman ditulis, nilai terbaru, dan cell yang benar-benar bentrok.
+    row_indices = list(row_indices)
+    if not row_indices:
+        return {}, {}, {}
+
+    columns = list(dict.fromkeys(
+        [column for _, column in cell_values] + list(base_values or {}) + [ROW_VERSION_COLUMN]
+    ))
+    latest_values = read_sheet_cells(worksheet, row_indices, columns)
+    merged_values = {}
+    cell_conflicts = {}
+    for row_index in row_indices:
+        mine_values = {
+            column: value
+            for (cell_row_index, column), value in cell_values.items()
+            if cell_row_index == row_index
+        }
+        theirs_values = {column: latest_values.get((row_index, column), "") for column in columns}
+        merged, row_conflicts = merge_row_cells(row_index, mine_values, base_values, theirs_values, guard_columns)
+        if row_conflicts:
+            cell_conflicts[row_index] = row_conflicts
+            continue
+        for column, value in merged.items():
+            merged_values[(row_index, column)] = value
+    return merged_values, latest_values, cell_conflicts
+
+
+def format_merge_conflict_message(cell_conflicts):
+    details = "; ".join(
+        f"baris {row_index + 1} ({', '.join(conflict['column'] for conflict in conflicts)})"
+        for row_index, conflicts in sorted(cell_conflicts.items())
+    )
+    return f"Cell yang sama sudah diubah orang lain di Google Sheet: {details}. Pilih versi yang dipakai."
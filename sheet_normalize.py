@@ -0,0 +1,80 @@
+import threading
+
+import streamlit as st
+
+from sheet_snapshot import get_sheet_snapshot_frame
+
+
+NULL_CELL_TEXTS = ["nan", "none", "<na>"]
+LEGACY_COLUMN_NAMES = {"instruksi_ats": "instruction_ats", "nama_validator": "validator"}
+
+
+def normalize_column(series):
+    # Normalisasi satu kolom sekaligus: NaN/None -> "", strip, dan teks "nan"/"none"/"<na>" -> "".
+    text = series.astype(object).where(series.notna(), "").astype(str).str.strip()
+    return text.mask(text.str.lower().isin(NULL_CELL_TEXTS), "")
+
+
+def normalize_columns(df, columns):
+    # Salinan df dengan kolom terpilih dinormalisasi; kolom yang belum ada dibuat kosong.
+    normalized_df = df.copy()
+    for column in columns:
+        if column in normalized_df.columns:
+            normalized_df[column] = normalize_column(normalized_df[column])
+        else:
+            normalized_df[column] = ""
+    return normalized_df
+
+
+def rename_legacy_columns(df):
+    return df.rename(columns={
+        legacy: column
+        for legacy, column in LEGACY_COLUMN_NAMES.items()
+        if legacy in df.columns and column not in df.columns
+    })
+
+
+def prepare_sheet_frame(df, sheet_columns, rename_legacy=True):
+    # Dipakai prepare_sheet_data semua halaman: nama kolom lama diganti, kolom inti dinormalisasi,
+    # sisa kolom lama dibuang, dan kolom inti ditaruh di depan. rename_legacy=False (User Labeling,
+    # Admin Monitoring) langsung membuang kolom lama tanpa memakai isinya, seperti sebelumnya.
+    sheet_columns = list(sheet_columns)
+    if rename_legacy:
+        df = rename_legacy_columns(df)
+    sheet_df = normalize_columns(df, sheet_columns)
+    sheet_df = sheet_df.drop(columns=[column for column in LEGACY_COLUMN_NAMES if column in sheet_df.columns])
+    return sheet_df[sheet_columns + [column for column in sheet_df.columns if column not in sheet_columns]]
+
+
+@st.cache_resource
+def get_prepared_snapshot_store():
+    # Frame ternormalisasi per versi snapshot, dipakai bersama semua session dan halaman di proses ini.
+    return {"lock": threading.Lock(), "entries": {}, "builds": 0, "hits": 0}
+
+
+def get_prepared_snapshot(worksheet, columns=None, sheet_columns=(), rename_legacy=True):
+    # Normalisasi snapshot hanya dihitung sekali per versi; pemanggil menerima salinan sehingga
+    # boleh mengubahnya (overlay journal, df.at saat simpan). None bila snapshot belum dimuat.
+    df, version, _ = get_sheet_snapshot_frame(worksheet, columns)
+    if df is None:
+        return None
+
+    key = worksheet, tuple(columns) if columns else None, tuple(sheet_columns), rename_legacy
+    store = get_prepared_snapshot_store()
+    with store["lock"]:
+        entry = store["entries"].get(key)
+        if entry is not None and entry["version"] == version:
+            store["hits"] += 1
+            return entry["df"].copy()
+
+    prepared_df = prepare_sheet_frame(df, sheet_columns, rename_legacy)
+    with store["lock"]:
+        store["entries"][key] = {"version": version, "df": prepared_df}
+        store["builds"] += 1
+    return prepared_df.copy()
+
+
+def get_prepared_snapshot_status():
+    store = get_prepared_snapshot_store()
+    with store["lock"]:
+        return {"entries": len(store["entries"]), "builds": store["builds"], "hits": store["hits"]}
@@ -0,0 +1,212 @@
+import re
+import threading
+
+import pandas as pd
+import streamlit as st
+
+from sheet_normalize import LEGACY_COLUMN_NAMES, normalize_column, rename_legacy_columns
+from sheet_range_update import normalize_cell_for_compare
+from sheet_snapshot import get_sheet_snapshot_frame
+
+
+DELIMITER_TEXT = "----- INI PEMBATAS SAJA -----"
+PROBLEM_PATTERN = r"\b(?:sama|serupa|double)\b|seperti\s+sebelumnya|terlalu\s+banyak"
+PROBLEM_REGEX = re.compile(PROBLEM_PATTERN, re.IGNORECASE)
+# Kolom yang di-index nilai -> baris; kolom sumber flag hanya disimpan untuk menghitung ulang flag saat patch.
+INDEX_COLUMNS = ["validator", "status", "replacement_status", "replacement_user"]
+FLAG_SOURCE_COLUMNS = ["input", "instruction_ats", "output_ats"]
+INDEX_FLAGS = ["has_input", "has_delimiter", "labels_empty", "has_problem_text"]
+
+
+@st.cache_resource
+def get_query_index_store():
+    # Index query per proyeksi snapshot, dipakai bersama semua session dan halaman di proses ini.
+    return {"lock": threading.Lock(), "entries": {}}
+
+
+def get_query_index_entry(worksheet, columns=None):
+    key = worksheet, tuple(columns) if columns else None
+    store = get_query_index_store()
+    with store["lock"]:
+        entry = store["entries"].get(key)
+        if entry is None:
+            entry = {
+                "lock": threading.Lock(),
+                "index": None,
+                "version": None,
+                "rebuilds": 0,
+                "patches": 0,
+            }
+            store["entries"][key] = entry
+        return entry
+
+
+def compute_row_flags(values):
+    flags = set()
+    if values["input"]:
+        flags.add("has_input")
+    if DELIMITER_TEXT.casefold() in values["input"].casefold():
+        flags.add("has_delimiter")
+    if not values["instruction_ats"] and not values["output_ats"]:
+        flags.add("labels_empty")
+    if PROBLEM_REGEX.search(values["instruction_ats"]) or PROBLEM_REGEX.search(values["output_ats"]):
+        flags.add("has_problem_text")
+    return flags
+
+
+def build_query_index(df):
+    # Satu kali scan penuh: nilai ternormalisasi per kolom, bucket nilai -> set baris, dan set baris per flag.
+    df = rename_legacy_columns(df)
+    values = {}
+    for column in INDEX_COLUMNS + FLAG_SOURCE_COLUMNS:
+        if column in df.columns:
+            values[column] = normalize_column(df[column]).astype(object)
+        else:
+            values[column] = pd.Series("", index=df.index, dtype=object)
+
+    flag_masks = {
+        "has_input": values["input"] != "",
+        "has_delimiter": values["input"].str.contains(DELIMITER_TEXT, case=False, regex=False),
+        "labels_empty": (values["instruction_ats"] == "") & (values["output_ats"] == ""),
+        "has_problem_text": (
+            values["instruction_ats"].str.contains(PROBLEM_PATTERN, case=False, regex=True)
+            | values["output_ats"].str.contains(PROBLEM_PATTERN, case=False, regex=True)
+        ),
+    }
+    return {
+        "rows": {int(row_index) for row_index in df.index},
+        "values": {column: series.to_dict() for column, series in values.items()},
+        "buckets": {
+            column: {
+                value: {int(row_index) for row_index in row_indices}
+                for value, row_indices in values[column].groupby(values[column], sort=False).groups.items()
+            }
+            for column in INDEX_COLUMNS
+        },
+        "flags": {flag: {int(row_index) for row_index in df.index[mask]} for flag, mask in flag_masks.items()},
+    }
+
+
+def apply_cells_to_index(index, cell_values):
+    # Update inkremental dari cell yang ditulis, copy-on-write: hanya kolom, bucket, dan flag yang
+    # tersentuh yang disalin sehingga index lama tetap utuh untuk session yang sedang membacanya.
+    # Baris di luar index (belum ada di snapshot) diabaikan.
+    patched = {
+        "rows": index["rows"],
+        "values": dict(index["values"]),
+        "buckets": dict(index["buckets"]),
+        "flags": dict(index["flags"]),
+    }
+    copied = set()
+    touched_rows = set()
+    for (row_index, column), value in cell_values.items():
+        column = LEGACY_COLUMN_NAMES.get(column, column)
+        if row_index not in patched["rows"] or column not in patched["values"]:
+            continue
+        value = normalize_cell_for_compare(value)
+        old_value = patched["values"][column].get(row_index, "")
+        if value == old_value:
+            continue
+        if ("values", column) not in copied:
+            patched["values"][column] = dict(patched["values"][column])
+            copied.add(("values", column))
+        patched["values"][column][row_index] = value
+        touched_rows.add(row_index)
+        if column in patched["buckets"]:
+            if ("buckets", column) not in copied:
+                patched["buckets"][column] = dict(patched["buckets"][column])
+                copied.add(("buckets", column))
+            buckets = patched["buckets"][column]
+            buckets[old_value] = buckets.get(old_value, set()) - {row_index}
+            buckets[value] = buckets.get(value, set()) | {row_index}
+
+    for row_index in touched_rows:
+        row_flags = compute_row_flags({
+            column: patched["values"][column].get(row_index, "")
+            for column in FLAG_SOURCE_COLUMNS
+        })
+        for flag in INDEX_FLAGS:
+            if (flag in row_flags) == (row_index in patched["flags"][flag]):
+                continue
+            if ("flags", flag) not in copied:
+                patched["flags"][flag] = set(patched["flags"][flag])
+                copied.add(("flags", flag))
+            if flag in row_flags:
+                patched["flags"][flag].add(row_index)
+            else:
+                patched["flags"][flag].discard(row_index)
+    return patched
+
+
+def sync_query_index(entry, df, version, patch_log):
+    # Patch yang terjadi sejak index terakhir diterapkan satu per satu; celah versi (download ulang,
+    # append, invalidate) berarti isi DataFrame berubah di luar patch sehingga index dibangun ulang.
+    if entry["index"] is not None and entry["version"] is not None:
+        pending_patches = [(patch_version, cells) for patch_version, cells in patch_log if patch_version > entry["version"]]
+        if [patch_version for patch_version, _ in pending_patches] == list(range(entry["version"] + 1, version + 1)):
+            index = entry["index"]
+            for _, cell_values in pending_patches:
+                index = apply_cells_to_index(index, cell_values)
+            entry["patches"] += len(pending_patches)
+            return index
+    entry["rebuilds"] += 1
+    return build_query_index(df)
+
+
+def get_sheet_query_index(worksheet, columns=None, overlay_cells=None):
+    # Index untuk snapshot bersama worksheet/kolom ini; None bila snapshot belum pernah dimuat.
+    df, version, patch_log = get_sheet_snapshot_frame(worksheet, columns)
+    if df is None:
+        return None
+
+    entry = get_query_index_entry(worksheet, columns)
+    with entry["lock"]:
+        if entry["index"] is None or entry["version"] != version:
+            entry["index"] = sync_query_index(entry, df, version, patch_log)
+            entry["version"] = version
+        index = entry["index"]
+
+    if overlay_cells:
+        index = apply_cells_to_index(index, overlay_cells)
+    return index
+
+
+def find_index_rows(index, equals=None, not_equals=None, flags=(), without_flags=()):
+    # equals/not_equals: {kolom: nilai atau list nilai} memakai nilai ternormalisasi. Mengembalikan
+    # row_index terurut sehingga hasilnya bisa langsung dipakai untuk df.loc.
+    rows = None
+    for column, column_values in (equals or {}).items():
+        if not isinstance(column_values, (list, tuple, set)):
+            column_values = [column_values]
+        buckets = index["buckets"][column]
+        matched = set().union(*(buckets.get(value, set()) for value in column_values))
+        rows = matched if rows is None else rows & matched
+    for flag in flags:
+        rows = set(index["flags"][flag]) if rows is None else rows & index["flags"][flag]
+    if rows is None:
+        rows = set(index["rows"])
+
+    for column, column_values in (not_equals or {}).items():
+        if not isinstance(column_values, (list, tuple, set)):
+            column_values = [column_values]
+        for value in column_values:
+            rows -= index["buckets"][column].get(value, set())
+    for flag in without_flags:
+        rows -= index["flags"][flag]
+    return sorted(rows)
+
+
+def select_index_rows(df, row_indices):
+    # Snapshot bisa maju sedikit dari DataFrame milik session; baris yang belum ada di df dilewati.
+    return df.loc[df.index.intersection(row_indices)]
+
+
+def get_query_index_status(worksheet, columns=None):
+    entry = get_query_index_entry(worksheet, columns)
+    with entry["lock"]:
+        return {
+            "rows": len(entry["index"]["rows"]) if entry["index"] is not None else 0,
+            "version": entry["version"],
+            "rebuilds": entry["rebuilds"],
+            "patches": entry["patches"],
+        }
@@ -1,14 +1,83 @@
+import email.utils
+import logging
 import math
+import random
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import ExitStack, nullcontext
 
+import pandas as pd
 import streamlit as st
 
+from sheet_normalize import normalize_column
+from sheet_row_index import (
+    ROW_ID_COLUMN,
+    lookup_row_positions,
+    new_row_id,
+    normalize_row_id,
+    publish_row_index,
+    record_missing_row_ids,
+    record_row_remaps,
+)
+from sheet_snapshot import (
+    append_rows_to_snapshot,
+    apply_cells_to_snapshot,
+    get_local_change_token,
+    invalidate_sheet_snapshot,
+    load_sheet_snapshot,
+    project_snapshot_columns,
+    replace_sheet_snapshot,
+)
+
 
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+DRIVE_METADATA_SCOPES = ["https://www.googleapis.com/auth/drive.metadata.readonly"]
 MAX_VALUE_RANGES_PER_BATCH = 500
+# batchGet mengirim range lewat query string; batasi jumlahnya agar URL tidak terlalu panjang.
+MAX_READ_RANGES_PER_BATCH = 100
 SHEETS_RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
 SHEETS_RETRY_DELAYS = [1, 2, 4, 8]
+SHEETS_MAX_RETRY_AFTER_SECONDS = 60
+SHEETS_READ_REQUESTS_PER_MINUTE = 60
+SHEETS_WRITE_REQUESTS_PER_MINUTE = 60
+DRIVE_REQUESTS_PER_MINUTE = 60
+QUOTA_REQUESTS_PER_MINUTE = {
+    "read": SHEETS_READ_REQUESTS_PER_MINUTE,
+    "write": SHEETS_WRITE_REQUESTS_PER_MINUTE,
+    "drive": DRIVE_REQUESTS_PER_MINUTE,
+}
+SHEETS_READ_METHODS = {"get", "batchGet", "batchGetByDataFilter"}
+SHEETS_QUOTA_BURST_SECONDS = 10
+SHEETS_MAX_CONCURRENT_REQUESTS = 4
+SHEETS_MAX_IDLE_CONNECTIONS = 8
+SHEETS_HTTP_TIMEOUT_SECONDS = 60
+ROW_VERSION_COLUMN = "row_version"
+ROW_UPDATED_AT_COLUMN = "updated_at"
+ROW_UPDATED_BY_COLUMN = "updated_by"
+ROW_META_COLUMNS = [ROW_VERSION_COLUMN, ROW_UPDATED_AT_COLUMN, ROW_UPDATED_BY_COLUMN]
+# Precondition untuk kolom teks panjang ini cukup diwakili row_version; kolom pendek seperti
+# validator/status tetap dibandingkan agar edit manual di Google Sheet masih terdeteksi.
+ROW_VERSION_PRECONDITION_COLUMNS = {
+    "instruction_ats",
+    "output_ats",
+    "input",
+    "replacement_original_input",
+    "replacement_narrative",
+}
+ROW_ID_BACKFILL_LOCK = threading.Lock()
+MOVED_ROWS_LOCK_ATTEMPTS = 5
+MOVED_ROWS_LOCK_RETRY_SECONDS = 0.2
+
+logger = logging.getLogger(__name__)
+
+
+class SheetConflictError(ValueError):
+    def __init__(self, message, row_indices=None, latest_values=None):
+        super().__init__(message)
+        self.row_indices = list(row_indices or [])
+        self.latest_values = dict(latest_values or {})
 
 
 def normalize_cell_for_sheet(value):
@@ -25,6 +94,10 @@ def normalize_cell_for_sheet(value):
     return text
 
 
+def normalize_cell_for_compare(value):
+    return normalize_cell_for_sheet(value).strip()
+
+
 def column_index_to_letter(index):
     letters = ""
     while index:
@@ -44,6 +117,14 @@ def get_gsheets_secret_config():
         raise RuntimeError("Konfigurasi connections.gsheets tidak ditemukan di Streamlit secrets.") from exc
 
 
+def get_gsheets_option(key, default=None):
+    try:
+        value = get_gsheets_secret_config().get(key, default)
+    except Exception:
+        return default
+    return default if value is None else value
+
+
 def as_plain_dict(value):
     if value is None:
         return {}
@@ -85,11 +166,31 @@ def get_service_account_info(config):
     return {}
 
 
+def is_sheets_emulator_enabled():
+    from sheets_emulator import is_sheets_emulator_enabled as is_enabled
+
+    return is_enabled()
+
+
+def has_service_account():
+    # Emulator menggantikan service account sehingga semua jalur Sheets API ikut teruji.
+    if is_sheets_emulator_enabled():
+        return True
+    try:
+        return bool(get_service_account_info(get_gsheets_secret_config()))
+    except RuntimeError:
+        return False
+
+
+def is_local_primary_enabled():
+    # SQLite lokal menjadi penyimpanan utama Sheet1; Google Sheet direplikasi di background.
+    return bool(get_gsheets_option("local_primary", False)) and has_service_account()
+
+
 @st.cache_resource
-def get_sheets_values_service():
+def get_service_account_credentials():
     try:
         from google.oauth2 import service_account
-        from googleapiclient.discovery import build
     except ImportError as exc:
         raise RuntimeError(
             "Dependency Google Sheets API belum tersedia. "
@@ -105,11 +206,51 @@ def get_sheets_values_service():
             "dari JSON service account dan share Google Sheet ke client_email tersebut sebagai Editor."
         )
 
-    credentials = service_account.Credentials.from_service_account_info(
+    return service_account.Credentials.from_service_account_info(
         service_account_info,
-        scopes=SCOPES,
+        scopes=SCOPES + (DRIVE_METADATA_SCOPES if get_change_probe_name() == "drive" else []),
     )
-    return build("sheets", "v4", credentials=credentials, cache_discovery=False).spreadsheets().values()
+
+
+def build_google_service(api_name, api_version):
+    try:
+        from googleapiclient.discovery import build
+    except ImportError as exc:
+        raise RuntimeError(
+            "Dependency Google Sheets API belum tersedia. "
+            "Pastikan google-api-python-client dan google-auth terinstall."
+        ) from exc
+
+    return build(api_name, api_version, credentials=get_service_account_credentials(), cache_discovery=False)
+
+
+@st.cache_resource
+def get_sheets_values_service():
+    if is_sheets_emulator_enabled():
+        from sheets_emulator import get_emulated_values_service
+
+        return get_emulated_values_service()
+    return build_google_service("sheets", "v4").spreadsheets().values()
+
+
+@st.cache_resource
+def get_drive_files_service():
+    if is_sheets_emulator_enabled():
+        from sheets_emulator import get_emulated_files_service
+
+        return get_emulated_files_service()
+    return build_google_service("drive", "v3").files()
+
+
+def get_gsheets_connection():
+    if is_sheets_emulator_enabled():
+        from sheets_emulator import get_emulated_connection
+
+        return get_emulated_connection()
+
+    from streamlit_gsheets import GSheetsConnection
+
+    return st.connection("gsheets", type=GSheetsConnection)
 
 
 def get_spreadsheet_id():
@@ -131,23 +272,224 @@ def get_google_api_status_code(error):
         return None
 
 
+@st.cache_resource
+def get_sheets_http_pool():
+    # Koneksi HTTP keep-alive dipakai ulang antar request; httplib2 tidak thread-safe,
+    # jadi tiap request meminjam satu koneksi dari pool. "open" = koneksi hidup (dipinjam + idle).
+    return {"lock": threading.Lock(), "idle": [], "open": 0}
+
+
+def checkout_sheets_http():
+    pool = get_sheets_http_pool()
+    with pool["lock"]:
+        if pool["idle"]:
+            return pool["idle"].pop()
+        pool["open"] += 1
+
+    import google_auth_httplib2
+    import httplib2
+
+    return google_auth_httplib2.AuthorizedHttp(
+        get_service_account_credentials(),
+        http=httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT_SECONDS),
+    )
+
+
+def checkin_sheets_http(http):
+    pool = get_sheets_http_pool()
+    with pool["lock"]:
+        if len(pool["idle"]) < SHEETS_MAX_IDLE_CONNECTIONS:
+            pool["idle"].append(http)
+            return
+    discard_sheets_http(http)
+
+
+def discard_sheets_http(http):
+    # Koneksi yang tidak kembali ke pool (pool penuh atau error transport) ditutup dan tidak dihitung lagi.
+    pool = get_sheets_http_pool()
+    with pool["lock"]:
+        pool["open"] = max(0, pool["open"] - 1)
+    for connection in getattr(getattr(http, "http", None), "connections", {}).values():
+        connection.close()
+
+
+@st.cache_resource
+def get_sheets_rate_limiter():
+    return {
+        "lock": threading.Lock(),
+        "buckets": {},
+        "stats": {"requests": 0, "waits": 0, "wait_seconds": 0.0, "throttled": 0, "retries": 0},
+    }
+
+
+def get_quota_bucket(limiter, kind):
+    bucket = limiter["buckets"].get(kind)
+    if bucket is None:
+        default_rate = QUOTA_REQUESTS_PER_MINUTE[kind]
+        try:
+            per_minute = float(get_gsheets_option(f"{kind}_requests_per_minute", default_rate))
+        except (TypeError, ValueError):
+            per_minute = default_rate
+        rate = max(per_minute, 1.0) / 60
+        capacity = max(1.0, rate * SHEETS_QUOTA_BURST_SECONDS)
+        bucket = {
+            "rate": rate,
+            "capacity": capacity,
+            "tokens": capacity,
+            "updated_at": time.monotonic(),
+            "paused_until": 0.0,
+        }
+        limiter["buckets"][kind] = bucket
+    return bucket
+
+
+def acquire_sheets_quota(kind):
+    # Token bucket per proses: semua session berbagi kuota baca/tulis project yang sama.
+    limiter = get_sheets_rate_limiter()
+    waited_seconds = 0.0
+    while True:
+        with limiter["lock"]:
+            bucket = get_quota_bucket(limiter, kind)
+            now = time.monotonic()
+            bucket["tokens"] = min(
+                bucket["capacity"],
+                bucket["tokens"] + (now - bucket["updated_at"]) * bucket["rate"],
+            )
+            bucket["updated_at"] = now
+            wait_seconds = max(0.0, bucket["paused_until"] - now)
+            if not wait_seconds and bucket["tokens"] >= 1:
+                bucket["tokens"] -= 1
+                limiter["stats"]["requests"] += 1
+                if waited_seconds:
+                    limiter["stats"]["waits"] += 1
+                    limiter["stats"]["wait_seconds"] += waited_seconds
+                return waited_seconds
+            if not wait_seconds:
+                wait_seconds = (1 - bucket["tokens"]) / bucket["rate"]
+        time.sleep(wait_seconds)
+        waited_seconds += wait_seconds
+
+
+def pause_sheets_quota(kind, seconds):
+    # Setelah 429, semua session menahan request jenis yang sama, bukan hanya yang kena.
+    limiter = get_sheets_rate_limiter()
+    with limiter["lock"]:
+        bucket = get_quota_bucket(limiter, kind)
+        bucket["paused_until"] = max(bucket["paused_until"], time.monotonic() + seconds)
+        bucket["tokens"] = 0.0
+        limiter["stats"]["throttled"] += 1
+
+
+def get_request_quota_kind(http_request):
+    # Digolongkan per operasi API (methodId, mis. "sheets.spreadsheets.values.batchGet"), bukan
+    # per HTTP method. Drive punya kuota sendiri, terpisah dari baca/tulis Sheets.
+    method_id = str(getattr(http_request, "methodId", "") or "")
+    if method_id.startswith("drive."):
+        return "drive"
+    if method_id.startswith("sheets."):
+        return "read" if method_id.rsplit(".", 1)[-1] in SHEETS_READ_METHODS else "write"
+    return None
+
+
+def get_retry_after_seconds(error):
+    response = getattr(error, "resp", None)
+    value = response.get("retry-after") if hasattr(response, "get") else None
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        try:
+            seconds = email.utils.parsedate_to_datetime(str(value)).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), SHEETS_MAX_RETRY_AFTER_SECONDS)
+
+
+def get_retry_delay(attempt_index, error):
+    base_delay = SHEETS_RETRY_DELAYS[attempt_index]
+    # Jitter agar session yang gagal bersamaan tidak mencoba ulang di detik yang sama.
+    delay = base_delay / 2 + random.uniform(0, base_delay / 2)
+    retry_after = get_retry_after_seconds(error)
+    return delay if retry_after is None else max(delay, retry_after)
+
+
+def execute_google_request(http_request):
+    # Request googleapiclient asli punya atribut http; request emulator dieksekusi langsung.
+    if not hasattr(http_request, "http"):
+        return http_request.execute()
+
+    http = checkout_sheets_http()
+    try:
+        result = http_request.execute(http=http)
+    except Exception as exc:
+        if get_google_api_status_code(exc) is not None:
+            checkin_sheets_http(http)
+        else:
+            discard_sheets_http(http)
+        raise
+    checkin_sheets_http(http)
+    return result
+
+
 def execute_google_request_with_retry(request):
-    last_error = None
-    for attempt_index, delay in enumerate([0] + SHEETS_RETRY_DELAYS):
-        if delay:
-            time.sleep(delay)
+    for attempt_index in range(len(SHEETS_RETRY_DELAYS) + 1):
+        http_request = request()
+        quota_kind = get_request_quota_kind(http_request)
+        if quota_kind:
+            acquire_sheets_quota(quota_kind)
         try:
-            return request().execute()
+            return execute_google_request(http_request)
         except Exception as exc:
-            last_error = exc
             status_code = get_google_api_status_code(exc)
             if (
                 status_code not in SHEETS_RETRYABLE_STATUS_CODES
                 or attempt_index >= len(SHEETS_RETRY_DELAYS)
             ):
                 raise
+            delay = get_retry_delay(attempt_index, exc)
+            if status_code == 429 and quota_kind:
+                pause_sheets_quota(quota_kind, delay)
+            get_sheets_rate_limiter()["stats"]["retries"] += 1
+            time.sleep(delay)
+
+
+@st.cache_resource
+def get_sheets_request_executor():
+    return ThreadPoolExecutor(
+        max_workers=SHEETS_MAX_CONCURRENT_REQUESTS,
+        thread_name_prefix="sheets-request",
+    )
 
-    raise last_error
+
+def submit_google_request(request):
+    return get_sheets_request_executor().submit(execute_google_request_with_retry, request)
+
+
+def execute_google_requests_concurrently(requests):
+    # Batch yang saling independen (chunk batchUpdate/batchGet) dikirim paralel; token bucket
+    # tetap membatasi lajunya. Tunggu semua selesai sebelum melempar error pertama.
+    requests = list(requests)
+    if len(requests) <= 1:
+        return [execute_google_request_with_retry(request) for request in requests]
+
+    futures = [submit_google_request(request) for request in requests]
+    wait(futures)
+    return [future.result() for future in futures]
+
+
+def get_sheets_transport_status():
+    limiter = get_sheets_rate_limiter()
+    pool = get_sheets_http_pool()
+    with limiter["lock"]:
+        buckets = {
+            kind: {"tokens": round(bucket["tokens"], 2), "per_minute": round(bucket["rate"] * 60)}
+            for kind, bucket in limiter["buckets"].items()
+        }
+        stats = dict(limiter["stats"])
+    with pool["lock"]:
+        connections = {"open": pool["open"], "idle": len(pool["idle"])}
+    return {"buckets": buckets, "stats": stats, "connections": connections}
 
 
 @st.cache_data(ttl=300)
@@ -185,52 +527,719 @@ def ensure_sheet_headers(worksheet, required_columns):
     return headers
 
 
-def update_sheet_cells(worksheet, data, row_indices, columns):
+def parse_row_version(value):
+    try:
+        return max(0, int(float(normalize_cell_for_compare(value) or 0)))
+    except (TypeError, ValueError, OverflowError):
+        return 0
+
+
+def get_row_versions(latest_values):
+    return {
+        row_index: parse_row_version(value)
+        for (row_index, column), value in (latest_values or {}).items()
+        if column == ROW_VERSION_COLUMN
+    }
+
+
+def format_row_updated_at(timestamp=None):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() if timestamp is None else timestamp))
+
+
+def get_row_updated_by(updated_by, row_index):
+    if isinstance(updated_by, dict):
+        return updated_by.get(row_index, "")
+    return updated_by or ""
+
+
+def use_row_preconditions(data, row_indices, expected_values):
+    # Ganti perbandingan teks panjang dengan satu angka row_version yang terlihat di data pemanggil,
+    # dan pastikan posisi baris masih memuat row_id yang sama (baris tidak bergeser).
+    if data is None:
+        return expected_values
+    row_indices = [row_index for row_index in row_indices or [] if row_index in data.index]
+    if not row_indices:
+        return expected_values
+
+    converted = dict(expected_values or {})
+    if converted and ROW_VERSION_COLUMN in data.columns:
+        converted = {
+            column: expected_value
+            for column, expected_value in converted.items()
+            if column not in ROW_VERSION_PRECONDITION_COLUMNS
+        }
+        converted[ROW_VERSION_COLUMN] = {
+            row_index: normalize_cell_for_compare(data.at[row_index, ROW_VERSION_COLUMN])
+            for row_index in row_indices
+        }
+    if ROW_ID_COLUMN in data.columns:
+        row_ids = {
+            row_index: normalize_row_id(data.at[row_index, ROW_ID_COLUMN])
+            for row_index in row_indices
+        }
+        row_ids = {row_index: row_id for row_index, row_id in row_ids.items() if row_id}
+        if row_ids:
+            converted[ROW_ID_COLUMN] = row_ids
+    return converted or expected_values
+
+
+def assign_missing_row_ids_in_frame(data):
+    if ROW_ID_COLUMN not in data.columns:
+        data[ROW_ID_COLUMN] = ""
+    data[ROW_ID_COLUMN] = data[ROW_ID_COLUMN].map(lambda value: normalize_row_id(value) or new_row_id())
+    return data
+
+
+def stamp_row_versions_in_frame(data, row_indices, updated_by=""):
+    # Untuk jalur update penuh (conn.update): naikkan row_version langsung di DataFrame yang ditulis.
+    for column in ROW_META_COLUMNS:
+        if column not in data.columns:
+            data[column] = ""
+        data[column] = data[column].astype(object)
+    updated_at = format_row_updated_at()
+    for row_index in row_indices:
+        data.at[row_index, ROW_VERSION_COLUMN] = str(parse_row_version(data.at[row_index, ROW_VERSION_COLUMN]) + 1)
+        data.at[row_index, ROW_UPDATED_AT_COLUMN] = updated_at
+        data.at[row_index, ROW_UPDATED_BY_COLUMN] = get_row_updated_by(updated_by, row_index)
+    return data
+
+
+def stamp_written_row_meta(data, new_versions, updated_at, updated_by=""):
+    # Salin row_version/updated_at/updated_by yang baru saja ditulis ke DataFrame pemanggil, supaya
+    # precondition write berikutnya dari data yang sama tidak bentrok dengan write sendiri.
+    for column in ROW_META_COLUMNS:
+        if column not in data.columns:
+            data[column] = ""
+        data[column] = data[column].astype(object)
+    for row_index, row_version in new_versions.items():
+        if row_index not in data.index:
+            continue
+        data.at[row_index, ROW_VERSION_COLUMN] = str(row_version)
+        data.at[row_index, ROW_UPDATED_AT_COLUMN] = updated_at
+        data.at[row_index, ROW_UPDATED_BY_COLUMN] = get_row_updated_by(updated_by, row_index)
+    return data
+
+
+def write_sheet_values(
+    worksheet,
+    cell_values,
+    headers=None,
+    updated_by="",
+    row_versions=None,
+    stamp_rows=True,
+    updated_at=None,
+):
+    # Setiap baris yang ditulis ikut menaikkan row_version dan mencatat updated_at/updated_by.
+    # row_versions berisi versi yang baru saja dibaca saat cek konflik; baris yang belum ada
+    # versinya dibaca dulu dalam satu batchGet kecil.
+    if not cell_values:
+        return {}
+
+    row_indices = sorted({row_index for row_index, _ in cell_values})
+    row_versions = dict(row_versions or {})
+    missing_versions = [row_index for row_index in row_indices if row_index not in row_versions]
+    if not stamp_rows:
+        row_indices = []
+    elif missing_versions:
+        row_versions.update(
+            get_row_versions(read_sheet_cells(worksheet, missing_versions, [ROW_VERSION_COLUMN]))
+        )
+
+    cell_values = dict(cell_values)
+    new_versions = {}
+    updated_at = updated_at or format_row_updated_at()
+    for row_index in row_indices:
+        new_versions[row_index] = row_versions.get(row_index, 0) + 1
+        cell_values[(row_index, ROW_VERSION_COLUMN)] = str(new_versions[row_index])
+        cell_values[(row_index, ROW_UPDATED_AT_COLUMN)] = updated_at
+        cell_values[(row_index, ROW_UPDATED_BY_COLUMN)] = get_row_updated_by(updated_by, row_index)
+
+    columns = list(dict.fromkeys(column for _, column in cell_values))
+    if headers is None or any(column not in headers for column in columns):
+        headers = ensure_sheet_headers(worksheet, columns)
+    header_positions = {header: index + 1 for index, header in enumerate(headers)}
+    sent_values = {}
+
+    for (row_index, column), value in cell_values.items():
+        if column not in header_positions:
+            raise ValueError(f"Kolom {column} tidak ditemukan di header Google Sheet.")
+        sent_values[(row_index, column)] = normalize_cell_for_sheet(value)
+
+    value_ranges = build_value_ranges(worksheet, sent_values, header_positions)
+    service = get_sheets_values_service()
+    spreadsheet_id = get_spreadsheet_id()
+    execute_google_requests_concurrently(
+        lambda start=start: service.batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={
+                "valueInputOption": "USER_ENTERED",
+                "data": value_ranges[start:start + MAX_VALUE_RANGES_PER_BATCH],
+            },
+        )
+        for start in range(0, len(value_ranges), MAX_VALUE_RANGES_PER_BATCH)
+    )
+    apply_cells_to_snapshot(worksheet, sent_values)
+    return new_versions
+
+
+def update_sheet_cells(worksheet, data, row_indices, columns, updated_by="", row_versions=None, updated_at=None):
     row_indices = [] if row_indices is None else list(row_indices)
     columns = [] if columns is None else list(columns)
     if not row_indices or not columns:
         return
 
-    headers = ensure_sheet_headers(worksheet, list(data.columns))
-    header_positions = {header: index + 1 for index, header in enumerate(headers)}
-    value_ranges = []
-
+    headers = ensure_sheet_headers(worksheet, list(dict.fromkeys(list(data.columns) + ROW_META_COLUMNS)))
+    cell_values = {}
     for row_index in row_indices:
         if row_index not in data.index:
             raise ValueError(f"Baris {row_index + 1} tidak ditemukan saat update per-cell.")
-        sheet_row = row_index + 2
         for column in columns:
-            if column not in header_positions:
-                raise ValueError(f"Kolom {column} tidak ditemukan di header Google Sheet.")
-            col_letter = column_index_to_letter(header_positions[column])
-            value_ranges.append(
-                {
-                    "range": f"{quote_worksheet_name(worksheet)}!{col_letter}{sheet_row}",
-                    "values": [[normalize_cell_for_sheet(data.at[row_index, column])]],
+            cell_values[(row_index, column)] = data.at[row_index, column]
+
+    return write_sheet_values(worksheet, cell_values, headers, updated_by, row_versions, updated_at=updated_at)
+
+
+def build_block_range(worksheet, first_column_position, last_column_position, first_row_index, last_row_index):
+    start = f"{column_index_to_letter(first_column_position)}{first_row_index + 2}"
+    end = f"{column_index_to_letter(last_column_position)}{last_row_index + 2}"
+    if start == end:
+        return f"{quote_worksheet_name(worksheet)}!{start}"
+    return f"{quote_worksheet_name(worksheet)}!{start}:{end}"
+
+
+def build_value_ranges(worksheet, sent_values, header_positions):
+    # Sel yang bersebelahan digabung jadi satu range persegi: kolom berurutan dalam satu baris
+    # menjadi satu run, lalu run yang sama di baris berurutan ditumpuk ke bawah.
+    rows = {}
+    for (row_index, column), value in sent_values.items():
+        rows.setdefault(row_index, {})[header_positions[column]] = value
+
+    blocks = []
+    open_blocks = {}
+    for row_index in sorted(rows):
+        row_values = rows[row_index]
+        positions = sorted(row_values)
+        runs = []
+        for position in positions:
+            if runs and runs[-1][1] == position - 1:
+                runs[-1][1] = position
+            else:
+                runs.append([position, position])
+
+        next_open_blocks = {}
+        for first_position, last_position in runs:
+            run_values = [row_values[position] for position in range(first_position, last_position + 1)]
+            block = open_blocks.get((first_position, last_position))
+            if block is None or block["last_row_index"] != row_index - 1:
+                block = {
+                    "first_position": first_position,
+                    "last_position": last_position,
+                    "first_row_index": row_index,
+                    "last_row_index": row_index,
+                    "values": [],
                 }
-            )
+                blocks.append(block)
+            block["last_row_index"] = row_index
+            block["values"].append(run_values)
+            next_open_blocks[(first_position, last_position)] = block
+        open_blocks = next_open_blocks
+
+    return [
+        {
+            "range": build_block_range(
+                worksheet,
+                block["first_position"],
+                block["last_position"],
+                block["first_row_index"],
+                block["last_row_index"],
+            ),
+            "values": block["values"],
+        }
+        for block in blocks
+    ]
 
+
+def read_sheet_cells(worksheet, row_indices, columns):
+    headers = list(get_sheet_headers(worksheet))
+    header_positions = {header: index + 1 for index, header in enumerate(headers)}
+    cells = {}
+    cell_keys = {}
+
+    for row_index in row_indices:
+        for column in columns:
+            if column not in header_positions:
+                # Kolom belum ada di header berarti semua cell-nya masih kosong.
+                cells[(row_index, column)] = ""
+                continue
+            cell_keys[(row_index, column)] = (row_index, column)
+
+    if not cell_keys:
+        return cells
+
+    # Cell yang bersebelahan dibaca sebagai satu range persegi; "values" tiap block berisi key cell-nya.
+    blocks = build_value_ranges(worksheet, cell_keys, header_positions)
     service = get_sheets_values_service()
     spreadsheet_id = get_spreadsheet_id()
-    for start in range(0, len(value_ranges), MAX_VALUE_RANGES_PER_BATCH):
-        execute_google_request_with_retry(
-            lambda start=start: service.batchUpdate(
-                spreadsheetId=spreadsheet_id,
-                body={
-                    "valueInputOption": "USER_ENTERED",
-                    "data": value_ranges[start:start + MAX_VALUE_RANGES_PER_BATCH],
-                },
-            )
+    starts = range(0, len(blocks), MAX_READ_RANGES_PER_BATCH)
+    results = execute_google_requests_concurrently(
+        lambda start=start: service.batchGet(
+            spreadsheetId=spreadsheet_id,
+            ranges=[block["range"] for block in blocks[start:start + MAX_READ_RANGES_PER_BATCH]],
+        )
+        for start in starts
+    )
+    for start, result in zip(starts, results):
+        value_ranges = result.get("valueRanges", [])
+        for offset, block in enumerate(blocks[start:start + MAX_READ_RANGES_PER_BATCH]):
+            values = value_ranges[offset].get("values", []) if offset < len(value_ranges) else []
+            # Sheets memotong baris dan cell kosong di akhir range.
+            for row_offset, row_keys in enumerate(block["values"]):
+                row_values = values[row_offset] if row_offset < len(values) else []
+                for column_offset, key in enumerate(row_keys):
+                    cells[key] = row_values[column_offset] if column_offset < len(row_values) else ""
+
+    return cells
+
+
+def get_allowed_values(expected_value, row_index):
+    if isinstance(expected_value, dict):
+        expected_value = expected_value.get(row_index, "")
+    if not isinstance(expected_value, (list, tuple, set)):
+        expected_value = [expected_value]
+    return {normalize_cell_for_compare(value) for value in expected_value}
+
+
+def find_sheet_conflicts(worksheet, row_indices, expected_values):
+    row_indices = [] if row_indices is None else list(row_indices)
+    if not row_indices or not expected_values:
+        return [], {}
+
+    # row_version selalu ikut dibaca agar write berikutnya bisa langsung menaikkan versinya.
+    check_columns = list(dict.fromkeys(list(expected_values) + [ROW_VERSION_COLUMN]))
+    latest_values = read_sheet_cells(worksheet, row_indices, check_columns)
+    conflicts = []
+    for row_index in row_indices:
+        for column, expected_value in expected_values.items():
+            if isinstance(expected_value, dict) and row_index not in expected_value:
+                continue
+            latest_value = normalize_cell_for_compare(latest_values.get((row_index, column), ""))
+            if latest_value not in get_allowed_values(expected_value, row_index):
+                conflicts.append(row_index)
+                break
+    if conflicts:
+        # Snapshot jelas sudah tertinggal dari Google Sheet; paksa refresh penuh berikutnya.
+        invalidate_sheet_snapshot(worksheet)
+    return conflicts, latest_values
+
+
+def format_conflict_message(row_indices):
+    rows = ", ".join(str(row_index + 1) for row_index in row_indices)
+    return f"Baris {rows} sudah berubah di Google Sheet. Muat ulang halaman sebelum menyimpan."
+
+
+def refresh_row_index(worksheet):
+    # Cek murah: hanya satu kolom row_id yang dibaca, bukan seluruh sheet.
+    row_ids = read_sheet_columns(worksheet, [ROW_ID_COLUMN])
+    return publish_row_index(worksheet, row_ids[ROW_ID_COLUMN] if not row_ids.empty else [])
+
+
+def resolve_row_positions(worksheet, data, row_indices, refresh=False):
+    if data is None or ROW_ID_COLUMN not in data.columns:
+        return {row_index: row_index for row_index in row_indices}
+
+    row_ids = {
+        row_index: data.at[row_index, ROW_ID_COLUMN]
+        for row_index in row_indices
+        if row_index in data.index
+    }
+    return resolve_row_id_positions(worksheet, row_ids, row_indices, refresh)
+
+
+def resolve_row_id_positions(worksheet, row_ids, row_indices, refresh=False):
+    # Posisi baris ditentukan lewat row_id; baris tanpa ID (atau ID yang sudah hilang) tetap
+    # memakai posisi lama dan akan tertahan oleh precondition row_id saat cek konflik.
+    row_ids = {row_index: normalize_row_id(row_id) for row_index, row_id in row_ids.items()}
+    known_ids = [row_id for row_id in row_ids.values() if row_id]
+    positions, unknown_ids = lookup_row_positions(worksheet, known_ids)
+    if known_ids and (refresh or unknown_ids):
+        refresh_row_index(worksheet)
+        positions, _ = lookup_row_positions(worksheet, known_ids)
+
+    resolved = {}
+    for row_index in row_indices:
+        position = positions.get(row_ids.get(row_index, ""))
+        resolved[row_index] = row_index if position is None else position
+    return resolved
+
+
+def find_colliding_rows(row_positions):
+    rows_by_position = {}
+    for row_index, position in row_positions.items():
+        rows_by_position.setdefault(position, []).append(row_index)
+    return sorted(
+        row_index
+        for row_indices in rows_by_position.values()
+        if len(row_indices) > 1
+        for row_index in row_indices
+    )
+
+
+def remap_expected_rows(expected_values, row_positions):
+    if not expected_values:
+        return expected_values
+    return {
+        column: (
+            {row_positions.get(row_index, row_index): value for row_index, value in expected_value.items()}
+            if isinstance(expected_value, dict)
+            else expected_value
+        )
+        for column, expected_value in expected_values.items()
+    }
+
+
+def has_moved_rows(conflicts, latest_values, expected_values):
+    expected_ids = (expected_values or {}).get(ROW_ID_COLUMN) or {}
+    return any(
+        row_index in expected_ids
+        and normalize_row_id(latest_values.get((row_index, ROW_ID_COLUMN), ""))
+        not in get_allowed_values(expected_ids, row_index)
+        for row_index in conflicts
+    )
+
+
+def get_moved_rows_lock(positions):
+    # Pemanggil sudah memegang stripe untuk posisi lama; posisi baru perlu dikunci juga. Stripe itu
+    # bisa berada di bawah stripe yang sudah dipegang, jadi hanya dicoba tanpa menunggu (menunggu di
+    # luar urutan terurut bisa deadlock). Bila tetap gagal, timeout dilempar supaya pemanggil melepas
+    # semua stripe dan mengulang dari awal.
+    if not positions:
+        return nullcontext()
+    from sheet_lock import SheetLockTimeoutError, get_sheet_row_lock
+
+    lock = get_sheet_row_lock(positions, "pindah baris")
+    for _ in range(MOVED_ROWS_LOCK_ATTEMPTS):
+        try:
+            lock.acquire(timeout=0)
+        except SheetLockTimeoutError:
+            time.sleep(MOVED_ROWS_LOCK_RETRY_SECONDS)
+            continue
+        held = ExitStack()
+        held.callback(lock.release)
+        return held
+    raise SheetLockTimeoutError(
+        "Baris yang disimpan sudah bergeser dan posisi barunya sedang dipakai proses lain. Coba simpan lagi."
+    )
+
+
+def update_sheet_cells_if_unchanged(
+    worksheet,
+    data,
+    row_indices,
+    columns,
+    expected_values=None,
+    updated_by="",
+    merge_conflicts=False,
+):
+    # Baris dialamatkan lewat index row_id -> posisi. Jika cek konflik menemukan row_id yang tidak
+    # cocok (baris diarsip/diurutkan ulang), index dibaca ulang sekali lalu write diarahkan ke posisi baru.
+    # merge_conflicts=True: baris yang bentrok digabung three-way (expected_values = nilai dasar)
+    # dan hanya cell yang diubah kedua pihak dengan nilai berbeda yang ditolak.
+    # Versi baris yang baru ditulis ikut disalin ke data (lihat stamp_written_row_meta).
+    row_indices = [] if row_indices is None else list(row_indices)
+    updated_at = format_row_updated_at()
+    for attempt in range(2):
+        row_positions = resolve_row_positions(worksheet, data, row_indices, refresh=attempt > 0)
+        moved_positions = [position for row_index, position in row_positions.items() if row_index != position]
+        positioned_rows = [row_positions[row_index] for row_index in row_indices]
+        colliding_rows = find_colliding_rows(row_positions)
+        if colliding_rows:
+            # Dua baris yang disimpan menunjuk ke posisi yang sama (mis. baris tanpa row_id dan baris
+            # yang bergeser ke posisinya); tulis ke salah satunya bisa menimpa baris lain.
+            raise SheetConflictError(format_conflict_message(colliding_rows), colliding_rows)
+        # Frame baru yang hanya berisi baris yang disimpan: me-rename sebagian index frame penuh
+        # bisa menghasilkan label ganda dan .at lalu mengembalikan Series.
+        positioned_data = data.loc[row_indices].set_axis(positioned_rows) if moved_positions else data
+        base_values = remap_expected_rows(expected_values, row_positions)
+        positioned_expected = use_row_preconditions(positioned_data, positioned_rows, base_values)
+
+        with get_moved_rows_lock(moved_positions):
+            row_versions = None
+            conflicts = []
+            if positioned_expected:
+                conflicts, latest_values = find_sheet_conflicts(worksheet, positioned_rows, positioned_expected)
+                if conflicts and attempt == 0 and has_moved_rows(conflicts, latest_values, positioned_expected):
+                    continue
+                original_rows = {position: row_index for row_index, position in row_positions.items()}
+                if conflicts and not merge_conflicts:
+                    conflicts = [original_rows.get(position, position) for position in conflicts]
+                    raise SheetConflictError(format_conflict_message(conflicts), conflicts, latest_values)
+                row_versions = get_row_versions(latest_values)
+
+            if conflicts:
+                merge_base = dict(base_values or {})
+                if ROW_ID_COLUMN in positioned_expected:
+                    merge_base[ROW_ID_COLUMN] = positioned_expected[ROW_ID_COLUMN]
+                new_versions = write_merged_sheet_cells(
+                    worksheet,
+                    positioned_data,
+                    positioned_rows,
+                    columns,
+                    conflicts,
+                    row_versions,
+                    merge_base,
+                    original_rows,
+                    updated_by,
+                    updated_at,
+                )
+            else:
+                new_versions = update_sheet_cells(
+                    worksheet, positioned_data, positioned_rows, columns, updated_by, row_versions, updated_at
+                )
+        if moved_positions:
+            # Snapshot masih memakai posisi lama; paksa download ulang.
+            record_row_remaps(worksheet, len(moved_positions))
+            invalidate_sheet_snapshot(worksheet)
+        stamp_written_row_meta(
+            data,
+            {
+                row_index: new_versions[position]
+                for row_index, position in row_positions.items()
+                if position in (new_versions or {})
+            },
+            updated_at,
+            updated_by,
+        )
+        return new_versions
+
+
+def write_merged_sheet_cells(
+    worksheet,
+    data,
+    row_indices,
+    columns,
+    conflicts,
+    row_versions,
+    base_values,
+    original_rows,
+    updated_by="",
+    updated_at=None,
+):
+    # Dipanggil dengan lock baris dipegang. Baris tanpa konflik ditulis apa adanya; baris yang bentrok
+    # hanya ditulis bila merge tidak menemukan cell yang diubah kedua pihak.
+    from sheet_merge import SheetMergeConflictError, format_merge_conflict_message, merge_conflicted_rows
+
+    headers = ensure_sheet_headers(worksheet, list(dict.fromkeys(list(data.columns) + ROW_META_COLUMNS)))
+    merged_values, merged_latest, cell_conflicts = merge_conflicted_rows(
+        worksheet,
+        conflicts,
+        {(row_index, column): data.at[row_index, column] for row_index in conflicts for column in columns},
+        base_values,
+    )
+    if cell_conflicts:
+        cell_conflicts = {
+            original_rows.get(row_index, row_index): row_conflicts
+            for row_index, row_conflicts in cell_conflicts.items()
+        }
+        raise SheetMergeConflictError(
+            format_merge_conflict_message(cell_conflicts),
+            list(cell_conflicts),
+            merged_latest,
+            cell_conflicts,
+        )
+
+    cell_values = {
+        (row_index, column): data.at[row_index, column]
+        for row_index in row_indices
+        if row_index not in conflicts
+        for column in columns
+    }
+    cell_values.update(merged_values)
+    row_versions = dict(row_versions or {})
+    row_versions.update(get_row_versions(merged_latest))
+    return write_sheet_values(worksheet, cell_values, headers, updated_by, row_versions, updated_at=updated_at)
+
+
+def read_sheet_dataframe(worksheet):
+    headers = [normalize_cell_for_compare(header) for header in get_sheet_headers(worksheet)]
+    headers = [header for header in headers if header]
+    if not headers:
+        return pd.DataFrame()
+
+    service = get_sheets_values_service()
+    spreadsheet_id = get_spreadsheet_id()
+    end_column = column_index_to_letter(len(headers))
+    result = execute_google_request_with_retry(
+        lambda: service.get(
+            spreadsheetId=spreadsheet_id,
+            range=f"{quote_worksheet_name(worksheet)}!A:{end_column}",
+        )
+    )
+    values = result.get("values", [])
+    if not values:
+        return pd.DataFrame()
+
+    rows = [
+        row + [""] * (len(headers) - len(row))
+        for row in values[1:]
+    ]
+    return pd.DataFrame(rows, columns=headers)
+
+
+def read_sheet_columns(worksheet, columns):
+    headers = [normalize_cell_for_compare(header) for header in get_sheet_headers(worksheet)]
+    header_positions = {header: index + 1 for index, header in enumerate(headers) if header}
+    # Kolom yang tidak ada di header tidak ikut dikembalikan, sama seperti conn.read.
+    found_columns = [column for column in dict.fromkeys(columns) if column in header_positions]
+    if not found_columns:
+        return pd.DataFrame()
+
+    ranges = []
+    for column in found_columns:
+        column_letter = column_index_to_letter(header_positions[column])
+        ranges.append(f"{quote_worksheet_name(worksheet)}!{column_letter}2:{column_letter}")
+
+    service = get_sheets_values_service()
+    spreadsheet_id = get_spreadsheet_id()
+    column_values = []
+    starts = range(0, len(ranges), MAX_READ_RANGES_PER_BATCH)
+    results = execute_google_requests_concurrently(
+        lambda start=start: service.batchGet(
+            spreadsheetId=spreadsheet_id,
+            ranges=ranges[start:start + MAX_READ_RANGES_PER_BATCH],
+            majorDimension="COLUMNS",
         )
+        for start in starts
+    )
+    for start, result in zip(starts, results):
+        value_ranges = result.get("valueRanges", [])
+        for offset in range(len(ranges[start:start + MAX_READ_RANGES_PER_BATCH])):
+            values = value_ranges[offset].get("values", []) if offset < len(value_ranges) else []
+            column_values.append(values[0] if values else [])
+
+    # Sheets memotong cell kosong di akhir kolom; samakan panjang semua kolom.
+    row_count = max((len(values) for values in column_values), default=0)
+    return pd.DataFrame(
+        {
+            column: values + [""] * (row_count - len(values))
+            for column, values in zip(found_columns, column_values)
+        },
+        index=pd.RangeIndex(row_count),
+    )
+
+
+def get_drive_change_token(worksheet):
+    # modifiedTime berlaku untuk seluruh spreadsheet, termasuk edit manual di UI Google Sheets.
+    files = get_drive_files_service()
+    spreadsheet_id = get_spreadsheet_id()
+    result = execute_google_request_with_retry(
+        lambda: files.get(fileId=spreadsheet_id, fields="modifiedTime", supportsAllDrives=True)
+    )
+    return result.get("modifiedTime")
+
+
+def get_row_version_change_token(worksheet):
+    # Satu kolom angka kecil, bukan seluruh sheet: melihat write aplikasi dari semua replika,
+    # tetapi tidak melihat edit manual di UI Google Sheets (row_version tidak ikut naik).
+    versions = read_sheet_columns(worksheet, [ROW_VERSION_COLUMN])
+    if versions.empty:
+        return None
+    return len(versions), hash(tuple(versions[ROW_VERSION_COLUMN].map(parse_row_version)))
+
+
+CHANGE_TOKEN_PROBES = {
+    "drive": get_drive_change_token,
+    "local": get_local_change_token,
+    "row_version": get_row_version_change_token,
+}
+
+
+def get_change_probe_name():
+    # "drive" butuh scope Drive di service account, jadi hanya dipakai bila diminta eksplisit.
+    default_probe = "local" if is_sheets_emulator_enabled() else "row_version"
+    return str(get_gsheets_option("change_probe", default_probe)).strip().lower()
+
+
+def get_change_token_probe(worksheet):
+    probe_name = get_change_probe_name()
+    probe = CHANGE_TOKEN_PROBES.get(probe_name)
+    if probe is None or not has_service_account():
+        return None
+    if probe_name == "local" and not is_sheets_emulator_enabled():
+        # Counter lokal hanya melihat write proses ini; edit manual dan replika lain tidak terlihat.
+        return None
+    return lambda: probe(worksheet)
+
+
+def load_worksheet_snapshot(worksheet, fallback_reader=None, columns=None):
+    # Dengan service account semua halaman membaca lewat Sheets API agar snapshot yang dibagi
+    # selalu punya format yang sama; tanpa itu pakai reader bawaan halaman (conn.read).
+    if is_local_primary_enabled():
+        from sheet_local_store import load_local_worksheet
+
+        return load_local_worksheet(worksheet, columns)
+    if fallback_reader is None or has_service_account():
+        if columns:
+            reader = lambda: read_sheet_columns(worksheet, columns)
+        else:
+            reader = lambda: read_sheet_dataframe(worksheet)
+    else:
+        reader = lambda: project_snapshot_columns(fallback_reader(), columns)
+    df = load_sheet_snapshot(
+        worksheet,
+        reader,
+        columns=columns,
+        probe=get_change_token_probe(worksheet),
+    )
+    if df is not None and (not columns or ROW_ID_COLUMN in columns):
+        # Jalur baca tidak pernah menulis: baris tanpa row_id hanya dilaporkan (disimpan lewat posisi)
+        # dan diisi lewat aksi admin ensure_row_ids.
+        record_missing_row_ids(worksheet, len(find_missing_row_ids(df)))
+    return df
+
+
+def find_missing_row_ids(df):
+    if df is None or df.empty:
+        return []
+    if ROW_ID_COLUMN not in df.columns:
+        return [int(row_index) for row_index in df.index]
+    return [int(row_index) for row_index in df.index[normalize_column(df[ROW_ID_COLUMN]) == ""]]
+
+
+def ensure_row_ids(worksheet, df):
+    # Aksi admin: backfill row_id untuk baris lama atau baris yang ditambah manual di Google Sheet.
+    # Ini bukan perubahan isi baris, jadi row_version tidak dinaikkan.
+    missing_rows = find_missing_row_ids(df)
+    if not missing_rows:
+        return df
+
+    from sheet_lock import get_sheet_row_lock
+
+    with ROW_ID_BACKFILL_LOCK, get_sheet_row_lock(missing_rows, "isi row_id"):
+        conflicts, _ = find_sheet_conflicts(worksheet, missing_rows, {ROW_ID_COLUMN: ""})
+        cell_values = {
+            (row_index, ROW_ID_COLUMN): new_row_id()
+            for row_index in missing_rows
+            if row_index not in conflicts
+        }
+        write_sheet_values(worksheet, cell_values, stamp_rows=False)
+
+    df = df.copy()
+    if ROW_ID_COLUMN not in df.columns:
+        df[ROW_ID_COLUMN] = ""
+    df[ROW_ID_COLUMN] = df[ROW_ID_COLUMN].astype(object)
+    for (row_index, _), row_id in cell_values.items():
+        df.at[row_index, ROW_ID_COLUMN] = row_id
+    record_missing_row_ids(worksheet, len(find_missing_row_ids(df)))
+    return df
 
 
 def is_missing_service_account_error(error):
     return "Service account Google Sheets tidak ditemukan" in str(error)
 
 
-def update_sheet_cells_with_full_update_fallback(conn, worksheet, data, row_indices, columns):
+def update_sheet_cells_with_full_update_fallback(conn, worksheet, data, row_indices, columns, updated_by=""):
     try:
-        update_sheet_cells(worksheet, data, row_indices, columns)
+        update_sheet_cells(worksheet, data, row_indices, columns, updated_by)
         return "row"
     except RuntimeError as exc:
         if not is_missing_service_account_error(exc):
@@ -240,14 +1249,19 @@ def update_sheet_cells_with_full_update_fallback(conn, worksheet, data, row_indi
             "Aplikasi memakai fallback update penuh sementara; tambahkan "
             "[connections.gsheets.gcp_service_account] agar update aman per-row aktif."
         )
+        stamp_row_versions_in_frame(data, row_indices, updated_by)
+        assign_missing_row_ids_in_frame(data)
         conn.update(worksheet=worksheet, data=data)
+        replace_sheet_snapshot(worksheet, data)
         return "full"
 
 
-def append_sheet_rows(worksheet, data):
+def append_sheet_rows(worksheet, data, updated_by=""):
     if data is None or data.empty:
         return
 
+    data = stamp_row_versions_in_frame(data.copy(), list(data.index), updated_by)
+    data = assign_missing_row_ids_in_frame(data)
     headers = ensure_sheet_headers(worksheet, list(data.columns))
     rows = []
     for _, row in data.iterrows():
@@ -255,7 +1269,7 @@ def append_sheet_rows(worksheet, data):
 
     service = get_sheets_values_service()
     spreadsheet_id = get_spreadsheet_id()
-    execute_google_request_with_retry(
+    result = execute_google_request_with_retry(
         lambda: service.append(
             spreadsheetId=spreadsheet_id,
             range=f"{quote_worksheet_name(worksheet)}!A1",
@@ -264,3 +1278,14 @@ def append_sheet_rows(worksheet, data):
             body={"values": rows},
         )
     )
+    append_rows_to_snapshot(
+        worksheet,
+        pd.DataFrame(rows, columns=headers),
+        get_appended_start_row_index(result),
+    )
+
+
+def get_appended_start_row_index(append_result):
+    updated_range = ((append_result or {}).get("updates") or {}).get("updatedRange", "")
+    match = re.search(r"![A-Z]+(\d+)", updated_range)
+    return int(match.group(1)) - 2 if match else None
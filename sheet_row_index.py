@@ -0,0 +1,111 @@
+import threading
+import time
+import uuid
+
+import streamlit as st
+
+
+ROW_ID_COLUMN = "row_id"
+ROW_ID_PREFIX = "R-"
+
+
+@st.cache_resource
+def get_row_index_store():
+    # Peta row_id -> posisi baris per worksheet, dipakai bersama semua session di proses ini.
+    return {"lock": threading.Lock(), "entries": {}}
+
+
+def new_row_id():
+    # Prefix huruf supaya USER_ENTERED tidak membaca ID heksadesimal sebagai angka (mis. "12e4").
+    return f"{ROW_ID_PREFIX}{uuid.uuid4().hex[:12]}"
+
+
+def normalize_row_id(value):
+    if value is None:
+        return ""
+    text = str(value).strip()
+    return "" if text.lower() in {"nan", "none", "<na>"} else text
+
+
+def get_row_index_entry(worksheet):
+    store = get_row_index_store()
+    with store["lock"]:
+        entry = store["entries"].get(worksheet)
+        if entry is None:
+            entry = {
+                "positions": None,
+                "loaded_at": 0.0,
+                "refreshes": 0,
+                "remapped_rows": 0,
+                "duplicates": 0,
+                "missing": 0,
+            }
+            store["entries"][worksheet] = entry
+        return entry
+
+
+def publish_row_index(worksheet, row_ids):
+    # row_ids: urutan row_id sesuai posisi baris data (posisi 0 = baris sheet ke-2).
+    positions = {}
+    duplicates = 0
+    for position, row_id in enumerate(row_ids):
+        row_id = normalize_row_id(row_id)
+        if not row_id:
+            continue
+        if row_id in positions:
+            # ID ganda (mis. baris hasil copy-paste manual) tidak bisa dipakai untuk alamat.
+            positions[row_id] = None
+            duplicates += 1
+            continue
+        positions[row_id] = position
+
+    entry = get_row_index_entry(worksheet)
+    store = get_row_index_store()
+    with store["lock"]:
+        entry["positions"] = positions
+        entry["loaded_at"] = time.time()
+        entry["refreshes"] += 1
+        entry["duplicates"] = duplicates
+    return positions
+
+
+def lookup_row_positions(worksheet, row_ids):
+    # Posisi dari index cache (None untuk ID ganda) plus daftar ID yang belum dikenal index.
+    entry = get_row_index_entry(worksheet)
+    store = get_row_index_store()
+    with store["lock"]:
+        positions = entry["positions"]
+        if positions is None:
+            return {}, list(row_ids)
+        return (
+            {row_id: positions[row_id] for row_id in row_ids if row_id in positions},
+            [row_id for row_id in row_ids if row_id not in positions],
+        )
+
+
+def record_row_remaps(worksheet, count):
+    entry = get_row_index_entry(worksheet)
+    store = get_row_index_store()
+    with store["lock"]:
+        entry["remapped_rows"] += count
+
+
+def record_missing_row_ids(worksheet, count):
+    entry = get_row_index_entry(worksheet)
+    store = get_row_index_store()
+    with store["lock"]:
+        entry["missing"] = count
+
+
+def get_row_index_status(worksheet):
+    entry = get_row_index_entry(worksheet)
+    store = get_row_index_store()
+    with store["lock"]:
+        return {
+            "rows": len(entry["positions"] or {}),
+            "loaded_at": entry["loaded_at"],
+            "refreshes": entry["refreshes"],
+            "remapped_rows": entry["remapped_rows"],
+            "duplicates": entry["duplicates"],
+            "missing": entry["missing"],
+        }
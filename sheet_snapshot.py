@@ -0,0 +1,380 @@
+import logging
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+
+
+SNAPSHOT_TTL_SECONDS = 20
+SNAPSHOT_MAX_PATCH_LOG = 500
+SNAPSHOT_PROBE_RETRY_SECONDS = 300
+# Probe bisa buta terhadap sebagian perubahan (mis. edit manual untuk "row_version"); download penuh
+# minimal sekali per interval ini walaupun token tidak bergerak.
+SNAPSHOT_PROBE_MAX_AGE_SECONDS = 300
+
+logger = logging.getLogger(__name__)
+
+
+@st.cache_resource
+def get_snapshot_store():
+    # Satu store per proses server, dipakai bersama oleh semua session dan halaman.
+    return {"lock": threading.Lock(), "entries": {}, "change_counters": {}}
+
+
+def get_snapshot_key(worksheet, columns=None):
+    return worksheet, tuple(columns) if columns else None
+
+
+def get_snapshot_entry(worksheet, columns=None):
+    key = get_snapshot_key(worksheet, columns)
+    store = get_snapshot_store()
+    with store["lock"]:
+        entry = store["entries"].get(key)
+        if entry is None:
+            entry = {
+                "worksheet": worksheet,
+                "columns": key[1],
+                "load_lock": threading.Lock(),
+                "df": None,
+                "version": 0,
+                "dirty_version": 0,
+                "loaded_at": 0.0,
+                "downloaded_at": 0.0,
+                "stale": True,
+                "patched_at": 0.0,
+                "patch_log": [],
+                "refreshing": False,
+                "refresh_started_at": 0.0,
+                "last_refresh_seconds": None,
+                "last_refresh_error": None,
+                "change_token": None,
+                "probe_hits": 0,
+                "probe_disabled_until": 0.0,
+                "last_probe_seconds": None,
+            }
+            store["entries"][key] = entry
+        return entry
+
+
+def get_worksheet_entries(worksheet):
+    # Semua proyeksi kolom dari worksheet yang sama ikut menerima write/invalidate.
+    store = get_snapshot_store()
+    with store["lock"]:
+        return [entry for entry in store["entries"].values() if entry["worksheet"] == worksheet]
+
+
+def project_snapshot_columns(df, columns):
+    if df is None or columns is None:
+        return df
+    return df[[column for column in columns if column in df.columns]]
+
+
+def project_cell_values(cell_values, columns):
+    if columns is None:
+        return cell_values
+    return {key: value for key, value in cell_values.items() if key[1] in columns}
+
+
+def is_snapshot_fresh(entry, ttl):
+    return (
+        entry["df"] is not None
+        and not entry["stale"]
+        and time.time() - entry["loaded_at"] < ttl
+    )
+
+
+def mark_snapshot_dirty(entry):
+    entry["version"] += 1
+    entry["dirty_version"] = entry["version"]
+    entry["stale"] = True
+    return entry["version"]
+
+
+def patch_cells(df, cell_values):
+    if any(row_index not in df.index for row_index, _ in cell_values):
+        return None
+
+    patched_df = df.copy()
+    for column in dict.fromkeys(column for _, column in cell_values):
+        as_writable_column(patched_df, column)
+    for (row_index, column), value in cell_values.items():
+        patched_df.at[row_index, column] = value
+    return patched_df
+
+
+def publish_sheet_snapshot(worksheet, df, base_version=None, columns=None):
+    entry = get_snapshot_entry(worksheet, columns)
+    store = get_snapshot_store()
+    with store["lock"]:
+        stale = False
+        if base_version is not None:
+            # Write yang terjadi selama download berjalan ditimpakan ulang ke hasil download; perubahan
+            # yang tidak bisa diulang (append/invalidate) membuat snapshot tetap stale.
+            stale = entry["dirty_version"] > base_version
+            for patch_version, cell_values in entry["patch_log"]:
+                if patch_version <= base_version:
+                    continue
+                patched_df = patch_cells(df, cell_values)
+                if patched_df is None:
+                    stale = True
+                    continue
+                df = patched_df
+        entry["df"] = df
+        entry["version"] += 1
+        entry["loaded_at"] = time.time()
+        entry["stale"] = stale
+        entry["patch_log"] = []
+        return entry["version"]
+
+
+def bump_local_change_counter(worksheet):
+    store = get_snapshot_store()
+    with store["lock"]:
+        store["change_counters"][worksheet] = store["change_counters"].get(worksheet, 0) + 1
+
+
+def get_local_change_token(worksheet):
+    # Stand-in lokal untuk probe perubahan: hanya melihat write dari proses ini, jadi cocok untuk
+    # emulator atau deployment satu server yang semua write-nya lewat aplikasi.
+    store = get_snapshot_store()
+    with store["lock"]:
+        return store["change_counters"].get(worksheet, 0)
+
+
+def read_change_token(entry, probe):
+    if probe is None or time.time() < entry["probe_disabled_until"]:
+        return None
+
+    started_at = time.time()
+    try:
+        return probe()
+    except Exception:
+        logger.exception("Probe perubahan worksheet %s gagal; memakai download penuh.", entry["worksheet"])
+        entry["probe_disabled_until"] = time.time() + SNAPSHOT_PROBE_RETRY_SECONDS
+        return None
+    finally:
+        entry["last_probe_seconds"] = time.time() - started_at
+
+
+def refresh_sheet_snapshot(worksheet, reader, columns=None, probe=None, observed_version=None):
+    # observed_version: versi snapshot yang dilihat pemanggil sebelum menunggu load_lock.
+    entry = get_snapshot_entry(worksheet, columns)
+    with entry["load_lock"]:
+        if (
+            observed_version is not None
+            and entry["version"] > observed_version
+            and entry["df"] is not None
+            and not entry["stale"]
+        ):
+            # Single-flight: session lain sudah men-download selama kita menunggu lock.
+            return entry["df"]
+
+        base_version = entry["version"]
+        change_token = read_change_token(entry, probe)
+        if (
+            change_token is not None
+            and change_token == entry["change_token"]
+            and entry["df"] is not None
+            and not entry["stale"]
+            and time.time() - entry["downloaded_at"] < SNAPSHOT_PROBE_MAX_AGE_SECONDS
+        ):
+            # Token tidak bergerak: snapshot masih sama dengan Google Sheet, cukup perpanjang umurnya.
+            entry["loaded_at"] = time.time()
+            entry["probe_hits"] += 1
+            return entry["df"]
+
+        started_at = time.time()
+        try:
+            df = reader()
+        except Exception as exc:
+            entry["last_refresh_error"] = exc
+            raise
+        finally:
+            entry["last_refresh_seconds"] = time.time() - started_at
+
+        entry["last_refresh_error"] = None
+        if df is None or df.empty:
+            return df
+        publish_sheet_snapshot(worksheet, df, base_version, columns)
+        entry["downloaded_at"] = time.time()
+        # Token dibaca sebelum download, jadi perubahan selama download tetap terdeteksi di probe berikutnya.
+        entry["change_token"] = change_token
+        return df
+
+
+def run_background_refresh(worksheet, reader, columns=None, probe=None):
+    entry = get_snapshot_entry(worksheet, columns)
+    try:
+        refresh_sheet_snapshot(worksheet, reader, columns, probe)
+    except Exception:
+        logger.exception("Gagal refresh snapshot worksheet %s di background.", worksheet)
+    finally:
+        entry["refreshing"] = False
+
+
+def start_background_refresh(worksheet, reader, columns=None, probe=None):
+    entry = get_snapshot_entry(worksheet, columns)
+    store = get_snapshot_store()
+    with store["lock"]:
+        # Single-flight: hanya satu refresh per worksheet yang boleh berjalan.
+        if entry["refreshing"]:
+            return False
+        entry["refreshing"] = True
+        entry["refresh_started_at"] = time.time()
+
+    threading.Thread(
+        target=run_background_refresh,
+        args=(worksheet, reader, columns, probe),
+        name=f"sheet-snapshot-refresh-{worksheet}",
+        daemon=True,
+    ).start()
+    return True
+
+
+def load_sheet_snapshot(worksheet, reader, ttl=SNAPSHOT_TTL_SECONDS, columns=None, probe=None):
+    entry = get_snapshot_entry(worksheet, columns)
+    observed_version = entry["version"]
+    if is_snapshot_fresh(entry, ttl):
+        return entry["df"].copy()
+
+    df = entry["df"]
+    if df is not None and not entry["stale"]:
+        # Stale-while-revalidate hanya untuk TTL yang habis: sajikan snapshot terakhir, refresh di background.
+        start_background_refresh(worksheet, reader, columns, probe)
+        return df.copy()
+
+    # Belum ada snapshot atau sudah di-invalidate (konflik, "Muat ulang"): jangan sajikan data lama.
+    # Tunggu refresh yang sedang berjalan; jika hasilnya sudah segar pakai itu, jika belum download sendiri.
+    df = refresh_sheet_snapshot(worksheet, reader, columns, probe, observed_version)
+    return df if df is None else df.copy()
+
+
+def replace_sheet_snapshot(worksheet, df):
+    bump_local_change_counter(worksheet)
+    get_snapshot_entry(worksheet)
+    for entry in get_worksheet_entries(worksheet):
+        projected_df = project_snapshot_columns(df, entry["columns"])
+        publish_sheet_snapshot(worksheet, projected_df.copy(), columns=entry["columns"])
+
+
+def as_writable_column(df, column):
+    if column not in df.columns:
+        df[column] = ""
+    elif not (pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column])):
+        df[column] = df[column].astype(object)
+
+
+def apply_cells_to_snapshot(worksheet, cell_values):
+    # Read-your-writes: nilai yang baru saja kita kirim ditimpakan ke snapshot agar rerun berikutnya
+    # tidak perlu download ulang seluruh sheet hanya untuk melihat tulisan sendiri.
+    bump_local_change_counter(worksheet)
+    store = get_snapshot_store()
+    for entry in get_worksheet_entries(worksheet):
+        projected_values = project_cell_values(cell_values, entry["columns"])
+        if not projected_values:
+            continue
+        with store["lock"]:
+            if entry["df"] is None:
+                mark_snapshot_dirty(entry)
+                continue
+
+            patched_df = patch_cells(entry["df"], projected_values)
+            if patched_df is None:
+                mark_snapshot_dirty(entry)
+                continue
+
+            entry["df"] = patched_df
+            entry["version"] += 1
+            entry["patched_at"] = time.time()
+            entry["patch_log"].append((entry["version"], dict(projected_values)))
+            if len(entry["patch_log"]) > SNAPSHOT_MAX_PATCH_LOG:
+                entry["patch_log"] = entry["patch_log"][-SNAPSHOT_MAX_PATCH_LOG:]
+                entry["dirty_version"] = entry["version"]
+
+
+def append_rows_to_snapshot(worksheet, rows, start_row_index=None):
+    bump_local_change_counter(worksheet)
+    store = get_snapshot_store()
+    for entry in get_worksheet_entries(worksheet):
+        projected_rows = project_snapshot_columns(rows, entry["columns"])
+        with store["lock"]:
+            df = entry["df"]
+            # Append hanya aman ditimpakan jika baris baru tepat menyambung snapshot yang masih segar.
+            if df is None or entry["stale"] or (start_row_index is not None and start_row_index != len(df)):
+                mark_snapshot_dirty(entry)
+                continue
+
+            appended_df = pd.concat([df, projected_rows], ignore_index=True, sort=False)
+            for column in projected_rows.columns.difference(df.columns):
+                appended_df[column] = appended_df[column].fillna("")
+            for column in df.columns.difference(projected_rows.columns):
+                appended_df[column] = appended_df[column].fillna("")
+
+            entry["df"] = appended_df
+            entry["version"] += 1
+            # Download yang sedang berjalan mungkin belum memuat baris baru ini.
+            entry["dirty_version"] = entry["version"]
+            entry["patched_at"] = time.time()
+
+
+def invalidate_sheet_snapshot(worksheet):
+    bump_local_change_counter(worksheet)
+    store = get_snapshot_store()
+    for entry in get_worksheet_entries(worksheet):
+        with store["lock"]:
+            mark_snapshot_dirty(entry)
+
+
+def get_sheet_snapshot_version(worksheet, columns=None):
+    return get_snapshot_entry(worksheet, columns)["version"]
+
+
+def get_last_sheet_snapshot(worksheet, columns=None):
+    entry = get_snapshot_entry(worksheet, columns)
+    if entry["df"] is None:
+        return None, None
+    return entry["df"].copy(), entry["loaded_at"]
+
+
+def get_sheet_snapshot_frame(worksheet, columns=None):
+    # Tanpa copy: DataFrame snapshot tidak pernah diubah di tempat (patch membuat salinan baru),
+    # jadi pembaca yang hanya membaca (mis. index query) aman memakainya langsung.
+    entry = get_snapshot_entry(worksheet, columns)
+    store = get_snapshot_store()
+    with store["lock"]:
+        return entry["df"], entry["version"], list(entry["patch_log"])
+
+
+def get_sheet_snapshot_status(worksheet, columns=None):
+    entry = get_snapshot_entry(worksheet, columns)
+    now = time.time()
+    return {
+        "version": entry["version"],
+        "age_seconds": now - entry["loaded_at"] if entry["loaded_at"] else None,
+        "stale": entry["stale"],
+        "refreshing": entry["refreshing"],
+        "refresh_running_seconds": now - entry["refresh_started_at"] if entry["refreshing"] else None,
+        "last_refresh_seconds": entry["last_refresh_seconds"],
+        "last_refresh_error": entry["last_refresh_error"],
+        "patched_at": entry["patched_at"],
+        "probe_hits": entry["probe_hits"],
+        "last_probe_seconds": entry["last_probe_seconds"],
+    }
+
+
+def describe_sheet_snapshot_freshness(worksheet, columns=None):
+    status = get_sheet_snapshot_status(worksheet, columns)
+    if status["age_seconds"] is None:
+        return "Data belum dimuat."
+
+    parts = [f"Data dimuat {status['age_seconds']:.0f} detik lalu"]
+    if status["last_refresh_seconds"] is not None:
+        parts.append(f"download terakhir {status['last_refresh_seconds']:.1f} detik")
+    if status["probe_hits"]:
+        parts.append(f"{status['probe_hits']}x tanpa download karena sheet tidak berubah")
+    if status["refreshing"]:
+        parts.append("sedang diperbarui")
+    if status["last_refresh_error"] is not None:
+        parts.append(f"refresh terakhir gagal: {status['last_refresh_error']}")
+    return " · ".join(parts) + "."
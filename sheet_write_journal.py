@@ -0,0 +1,658 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+
+import streamlit as st
+
+from sheet_lock import get_sheet_row_lock
+from sheet_range_update import (
+    ROW_VERSION_COLUMN,
+    ROW_VERSION_PRECONDITION_COLUMNS,
+    find_colliding_rows,
+    find_sheet_conflicts,
+    get_allowed_values,
+    get_gsheets_option,
+    get_row_versions,
+    has_moved_rows,
+    has_service_account,
+    is_local_primary_enabled,
+    normalize_cell_for_compare,
+    normalize_cell_for_sheet,
+    resolve_row_id_positions,
+    use_row_preconditions,
+    write_sheet_values,
+)
+from sheet_merge import format_merge_conflict_message, merge_conflicted_rows
+from sheet_row_index import ROW_ID_COLUMN, record_row_remaps
+from sheet_snapshot import invalidate_sheet_snapshot
+
+
+JOURNAL_PATH = Path("outputs") / "sheet_write_journal.sqlite3"
+JOURNAL_FLUSH_INTERVAL_SECONDS = 5
+JOURNAL_FLUSHED_RETENTION_SECONDS = 120
+JOURNAL_STATUS_PENDING = "pending"
+JOURNAL_STATUS_FLUSHED = "flushed"
+JOURNAL_STATUS_CONFLICT = "conflict"
+JOURNAL_FLUSH_LOCK = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal_rows (
+    worksheet TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    expected_values TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT NOT NULL DEFAULT '',
+    updated_at REAL NOT NULL,
+    base_values TEXT NOT NULL DEFAULT '{}',
+    conflict_cells TEXT NOT NULL DEFAULT '[]',
+    PRIMARY KEY (worksheet, row_index)
+);
+CREATE TABLE IF NOT EXISTS journal_cells (
+    worksheet TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    column_name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    status TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    updated_by TEXT NOT NULL DEFAULT '',
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (worksheet, row_index, column_name)
+);
+"""
+# Kolom yang ditambahkan setelah journal_rows pertama kali dibuat; journal lama di disk di-migrate.
+JOURNAL_ROW_MIGRATIONS = {
+    "base_values": "TEXT NOT NULL DEFAULT '{}'",
+    "conflict_cells": "TEXT NOT NULL DEFAULT '[]'",
+}
+
+
+def get_journal_path():
+    return Path(get_gsheets_option("write_behind_journal", str(JOURNAL_PATH)))
+
+
+def get_flush_interval_seconds():
+    try:
+        return max(1.0, float(get_gsheets_option("write_behind_interval_seconds", JOURNAL_FLUSH_INTERVAL_SECONDS)))
+    except (TypeError, ValueError):
+        return JOURNAL_FLUSH_INTERVAL_SECONDS
+
+
+def is_write_behind_enabled():
+    # Mode local primary selalu menulis lewat journal; journal adalah antrian replikasinya.
+    return is_local_primary_enabled() or (bool(get_gsheets_option("write_behind", False)) and has_service_account())
+
+
+def connect_journal():
+    path = get_journal_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=FULL")
+    connection.executescript(JOURNAL_SCHEMA)
+    existing_columns = {row[1] for row in connection.execute("PRAGMA table_info(journal_rows)")}
+    for column, definition in JOURNAL_ROW_MIGRATIONS.items():
+        if column not in existing_columns:
+            connection.execute(f"ALTER TABLE journal_rows ADD COLUMN {column} {definition}")
+    return connection
+
+
+def expand_expected_values(expected_values, row_index):
+    row_expected = {}
+    for column, expected_value in (expected_values or {}).items():
+        if isinstance(expected_value, dict) and row_index not in expected_value:
+            continue
+        row_expected[column] = sorted(get_allowed_values(expected_value, row_index))
+    return row_expected
+
+
+def enqueue_cell_updates(worksheet, data, row_indices, columns, expected_values=None, updated_by=""):
+    row_indices = [] if row_indices is None else list(row_indices)
+    columns = [] if columns is None else list(columns)
+    if not row_indices or not columns:
+        return
+
+    with closing(connect_journal()) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            insert_journal_cells(connection, worksheet, data, row_indices, columns, expected_values, updated_by)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+
+def insert_journal_cells(connection, worksheet, data, row_indices, columns, expected_values=None, updated_by=""):
+    # Dipanggil di dalam transaksi pemanggil (BEGIN IMMEDIATE sudah dijalankan).
+    base_values = expected_values
+    expected_values = use_row_preconditions(data, row_indices, expected_values)
+    now = time.time()
+    revision = time.time_ns()
+    for row_index in row_indices:
+        if row_index not in data.index:
+            raise ValueError(f"Baris {row_index + 1} tidak ditemukan saat mencatat perubahan.")
+
+        row_expected = expand_expected_values(expected_values, row_index)
+        row_base = expand_expected_values(base_values, row_index)
+        existing = connection.execute(
+            "SELECT expected_values, status, base_values FROM journal_rows WHERE worksheet = ? AND row_index = ?",
+            (worksheet, row_index),
+        ).fetchone()
+        if existing:
+            # Nilai dasar untuk three-way merge: nilai saat edit pertama, atau nilai yang
+            # terakhir berhasil kita tulis bila baris ini sudah pernah di-flush.
+            stored_base = json.loads(existing[2])
+            for column, allowed_values in row_base.items():
+                stored_base.setdefault(column, allowed_values)
+            row_base = stored_base
+        status = JOURNAL_STATUS_PENDING
+        if existing and existing[1] in {JOURNAL_STATUS_PENDING, JOURNAL_STATUS_CONFLICT}:
+            # Pertahankan nilai dasar dari edit pertama; tampilan pemanggil sudah memuat
+            # nilai pending sendiri sehingga tidak bisa dipakai sebagai precondition.
+            merged_expected = json.loads(existing[0])
+            for column, allowed_values in row_expected.items():
+                merged_expected.setdefault(column, allowed_values)
+            row_expected = merged_expected
+            status = existing[1]
+        elif existing and ROW_VERSION_COLUMN in row_expected:
+            # Versi yang terakhir kita tulis lebih baru dari snapshot yang mungkin belum segar.
+            stored_expected = json.loads(existing[0])
+            if ROW_VERSION_COLUMN in stored_expected:
+                row_expected[ROW_VERSION_COLUMN] = stored_expected[ROW_VERSION_COLUMN]
+
+        connection.execute(
+            """
+            INSERT INTO journal_rows (
+                worksheet, row_index, expected_values, status, attempts, last_error, updated_at, base_values
+            )
+            VALUES (?, ?, ?, ?, 0, '', ?, ?)
+            ON CONFLICT (worksheet, row_index) DO UPDATE SET
+                expected_values = excluded.expected_values,
+                status = excluded.status,
+                updated_at = excluded.updated_at,
+                base_values = excluded.base_values
+            """,
+            (worksheet, row_index, json.dumps(row_expected), status, now, json.dumps(row_base)),
+        )
+        for column in columns:
+            connection.execute(
+                """
+                INSERT INTO journal_cells (worksheet, row_index, column_name, value, status, revision, updated_by, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (worksheet, row_index, column_name) DO UPDATE SET
+                    value = excluded.value,
+                    status = excluded.status,
+                    revision = excluded.revision,
+                    updated_by = excluded.updated_by,
+                    updated_at = excluded.updated_at
+                """,
+                (
+                    worksheet,
+                    row_index,
+                    column,
+                    normalize_cell_for_sheet(data.at[row_index, column]),
+                    JOURNAL_STATUS_PENDING,
+                    revision,
+                    updated_by,
+                    now,
+                ),
+            )
+
+
+def load_pending_journal(connection, worksheet):
+    pending_rows = {}
+    base_rows = {}
+    for row_index, expected_json, base_json in connection.execute(
+        "SELECT row_index, expected_values, base_values FROM journal_rows WHERE worksheet = ? AND status = ?",
+        (worksheet, JOURNAL_STATUS_PENDING),
+    ):
+        pending_rows[row_index] = json.loads(expected_json)
+        # Journal lama belum punya base_values; precondition-nya dipakai sebagai nilai dasar.
+        base_rows[row_index] = json.loads(base_json) or dict(pending_rows[row_index])
+    pending_cells = {}
+    updated_by = {}
+    for row_index, column, value, revision, cell_updated_by in connection.execute(
+        """
+        SELECT row_index, column_name, value, revision, updated_by
+        FROM journal_cells WHERE worksheet = ? AND status = ?
+        ORDER BY updated_at
+        """,
+        (worksheet, JOURNAL_STATUS_PENDING),
+    ):
+        if row_index in pending_rows:
+            pending_cells[(row_index, column)] = (value, revision)
+            updated_by[row_index] = cell_updated_by
+    return pending_rows, base_rows, pending_cells, updated_by
+
+
+def unposition_cells(cell_values, original_rows):
+    return {
+        (original_rows.get(position, position), column): value
+        for (position, column), value in cell_values.items()
+    }
+
+
+def group_by_column(rows):
+    grouped = {}
+    for row_index, row_values in rows.items():
+        for column, allowed_values in row_values.items():
+            grouped.setdefault(column, {})[row_index] = allowed_values
+    return grouped
+
+
+def flush_sheet_journal(worksheet):
+    result = {"written": [], "conflicts": [], "merged": [], "error": None}
+    # Flush dalam satu proses diserialkan agar baris pending yang sama tidak terkirim dua kali;
+    # terhadap writer lain cukup lock stripe baris yang ada di journal.
+    with JOURNAL_FLUSH_LOCK, closing(connect_journal()) as connection:
+        pending_rows, base_rows, pending_cells, updated_by = load_pending_journal(connection, worksheet)
+        if not pending_rows:
+            prune_flushed_cells(connection)
+            return result
+
+        row_indices = sorted(pending_rows)
+        row_ids = {
+            row_index: (pending_rows[row_index].get(ROW_ID_COLUMN) or [""])[0]
+            for row_index in row_indices
+        }
+
+        try:
+            for attempt in range(2):
+                # Journal dicatat per posisi saat edit; posisi terkini dicari lewat row_id saat flush
+                # supaya baris yang sudah diarsip/diurutkan ulang tetap ditulis ke baris yang benar.
+                row_positions = resolve_row_id_positions(worksheet, row_ids, row_indices, refresh=attempt > 0)
+                colliding_rows = find_colliding_rows(row_positions)
+                positions = {
+                    row_index: position
+                    for row_index, position in row_positions.items()
+                    if row_index not in colliding_rows
+                }
+                original_rows = {position: row_index for row_index, position in positions.items()}
+                expected_values = group_by_column(
+                    {position: pending_rows[row_index] for row_index, position in positions.items()}
+                )
+                lock_rows = sorted(set(positions) | set(positions.values()))
+                with get_sheet_row_lock(lock_rows, "flush journal"):
+                    conflicts, latest_values = find_sheet_conflicts(
+                        worksheet, sorted(original_rows), expected_values
+                    )
+                    if conflicts and attempt == 0 and has_moved_rows(conflicts, latest_values, expected_values):
+                        continue
+                    # Baris yang bentrok digabung three-way terhadap nilai dasarnya; hanya cell yang
+                    # diubah kedua pihak dengan nilai berbeda yang menahan baris. row_id ikut dicek
+                    # agar merge tidak pernah menulis ke baris lain.
+                    merge_base = group_by_column(
+                        {position: base_rows[original_rows[position]] for position in conflicts}
+                    )
+                    if ROW_ID_COLUMN in expected_values:
+                        merge_base[ROW_ID_COLUMN] = expected_values[ROW_ID_COLUMN]
+                    merged_values, merged_latest, cell_conflicts = merge_conflicted_rows(
+                        worksheet,
+                        conflicts,
+                        {
+                            (positions[row_index], column): value
+                            for (row_index, column), (value, _) in pending_cells.items()
+                            if positions.get(row_index) in conflicts
+                        },
+                        merge_base,
+                    )
+                    cell_values = {
+                        (positions[row_index], column): value
+                        for (row_index, column), (value, _) in pending_cells.items()
+                        if row_index in positions and positions[row_index] not in conflicts
+                    }
+                    cell_values.update(merged_values)
+                    row_versions = get_row_versions(latest_values)
+                    row_versions.update(get_row_versions(merged_latest))
+                    new_versions = write_sheet_values(
+                        worksheet,
+                        cell_values,
+                        updated_by={
+                            positions[row_index]: name
+                            for row_index, name in updated_by.items()
+                            if row_index in positions
+                        },
+                        row_versions=row_versions,
+                    )
+                break
+        except Exception as exc:
+            connection.execute(
+                f"""
+                UPDATE journal_rows SET attempts = attempts + 1, last_error = ?
+                WHERE worksheet = ? AND status = ? AND row_index IN ({','.join('?' * len(row_indices))})
+                """,
+                (str(exc), worksheet, JOURNAL_STATUS_PENDING, *row_indices),
+            )
+            result["error"] = exc
+            return result
+
+        # Hasil per posisi dikembalikan ke kunci journal (posisi saat edit dicatat).
+        conflicts = [original_rows[position] for position in conflicts]
+        cell_conflicts = {original_rows[position]: items for position, items in cell_conflicts.items()}
+        cell_values = unposition_cells(cell_values, original_rows)
+        merged_latest = unposition_cells(merged_latest, original_rows)
+        row_versions = {original_rows.get(position, position): value for position, value in row_versions.items()}
+        new_versions = {original_rows.get(position, position): value for position, value in new_versions.items()}
+        written_rows = [row_index for row_index in positions if row_index not in cell_conflicts]
+        moved_rows = [row_index for row_index in written_rows if positions[row_index] != row_index]
+
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        for (row_index, column), (value, revision) in pending_cells.items():
+            if row_index not in written_rows:
+                continue
+            # Cell yang dimenangkan versi orang lain saat merge dicatat dengan nilai mereka,
+            # supaya overlay tampilan tidak menimpa nilai terbaru dengan nilai lama kita.
+            value = cell_values.get((row_index, column), merged_latest.get((row_index, column), value))
+            value = normalize_cell_for_sheet(value)
+            connection.execute(
+                """
+                UPDATE journal_cells SET status = ?, value = ?, updated_at = ?
+                WHERE worksheet = ? AND row_index = ? AND column_name = ? AND revision = ?
+                """,
+                (JOURNAL_STATUS_FLUSHED, value, now, worksheet, row_index, column, revision),
+            )
+            base_rows[row_index][column] = [normalize_cell_for_compare(value)]
+            # Nilai yang baru ditulis menjadi precondition untuk edit berikutnya di baris ini;
+            # baris yang sudah memakai row_version cukup menyimpan versi barunya.
+            if ROW_VERSION_COLUMN in pending_rows[row_index]:
+                row_version = new_versions.get(row_index, row_versions.get(row_index, 0))
+                pending_rows[row_index][ROW_VERSION_COLUMN] = [str(row_version)]
+                if column in ROW_VERSION_PRECONDITION_COLUMNS:
+                    continue
+            pending_rows[row_index][column] = [normalize_cell_for_compare(value)]
+
+        for row_index in written_rows:
+            still_pending = connection.execute(
+                "SELECT 1 FROM journal_cells WHERE worksheet = ? AND row_index = ? AND status = ? LIMIT 1",
+                (worksheet, row_index, JOURNAL_STATUS_PENDING),
+            ).fetchone()
+            connection.execute(
+                """
+                UPDATE journal_rows
+                SET status = ?, expected_values = ?, base_values = ?, conflict_cells = '[]',
+                    attempts = 0, last_error = '', updated_at = ?
+                WHERE worksheet = ? AND row_index = ?
+                """,
+                (
+                    JOURNAL_STATUS_PENDING if still_pending else JOURNAL_STATUS_FLUSHED,
+                    json.dumps(pending_rows[row_index]),
+                    json.dumps(base_rows[row_index]),
+                    now,
+                    worksheet,
+                    row_index,
+                ),
+            )
+
+        for row_index, row_conflicts in cell_conflicts.items():
+            connection.execute(
+                """
+                UPDATE journal_rows SET status = ?, last_error = ?, conflict_cells = ?, updated_at = ?
+                WHERE worksheet = ? AND row_index = ?
+                """,
+                (
+                    JOURNAL_STATUS_CONFLICT,
+                    format_merge_conflict_message({row_index: row_conflicts}),
+                    json.dumps(row_conflicts),
+                    now,
+                    worksheet,
+                    row_index,
+                ),
+            )
+        if moved_rows:
+            # Overlay journal memakai posisi lama; nilai yang sudah terkirim untuk baris yang bergeser
+            # dibuang agar tidak ditimpakan ke baris lain yang sekarang menempati posisi itu.
+            placeholders = ",".join("?" * len(moved_rows))
+            connection.execute(
+                f"""
+                DELETE FROM journal_cells
+                WHERE worksheet = ? AND status = ? AND row_index IN ({placeholders})
+                """,
+                (worksheet, JOURNAL_STATUS_FLUSHED, *moved_rows),
+            )
+            connection.execute(
+                f"""
+                DELETE FROM journal_rows
+                WHERE worksheet = ? AND status = ? AND row_index IN ({placeholders})
+                """,
+                (worksheet, JOURNAL_STATUS_FLUSHED, *moved_rows),
+            )
+        if colliding_rows:
+            # Dua baris journal menunjuk ke posisi yang sama; tunggu index row_id segar di flush berikutnya.
+            connection.execute(
+                f"""
+                UPDATE journal_rows SET attempts = attempts + 1, last_error = ?
+                WHERE worksheet = ? AND status = ? AND row_index IN ({','.join('?' * len(colliding_rows))})
+                """,
+                (
+                    "Posisi baris bentrok dengan baris lain di journal.",
+                    worksheet,
+                    JOURNAL_STATUS_PENDING,
+                    *colliding_rows,
+                ),
+            )
+        connection.execute("COMMIT")
+        prune_flushed_cells(connection)
+
+    if moved_rows:
+        # Snapshot masih memakai posisi lama; paksa download ulang.
+        record_row_remaps(worksheet, len(moved_rows))
+        invalidate_sheet_snapshot(worksheet)
+    result["written"] = written_rows
+    result["conflicts"] = list(cell_conflicts)
+    result["merged"] = [row_index for row_index in conflicts if row_index in written_rows]
+    return result
+
+
+def prune_flushed_cells(connection):
+    cutoff = time.time() - JOURNAL_FLUSHED_RETENTION_SECONDS
+    connection.execute(
+        "DELETE FROM journal_cells WHERE status = ? AND updated_at < ?",
+        (JOURNAL_STATUS_FLUSHED, cutoff),
+    )
+    connection.execute(
+        """
+        DELETE FROM journal_rows
+        WHERE status = ? AND updated_at < ?
+        AND NOT EXISTS (
+            SELECT 1 FROM journal_cells
+            WHERE journal_cells.worksheet = journal_rows.worksheet
+            AND journal_cells.row_index = journal_rows.row_index
+        )
+        """,
+        (JOURNAL_STATUS_FLUSHED, cutoff),
+    )
+
+
+def list_pending_worksheets():
+    with closing(connect_journal()) as connection:
+        return [
+            worksheet
+            for (worksheet,) in connection.execute(
+                "SELECT DISTINCT worksheet FROM journal_rows WHERE status = ?",
+                (JOURNAL_STATUS_PENDING,),
+            )
+        ]
+
+
+def get_journal_cells(worksheet):
+    # Nilai pending dan yang baru saja ditulis, untuk ditimpakan ke data tampilan sampai cache sheet segar.
+    with closing(connect_journal()) as connection:
+        return select_journal_cells(connection, worksheet)
+
+
+def select_journal_cells(connection, worksheet):
+    return {
+        (row_index, column): value
+        for row_index, column, value in connection.execute(
+            """
+            SELECT journal_cells.row_index, journal_cells.column_name, journal_cells.value
+            FROM journal_cells
+            JOIN journal_rows
+            ON journal_rows.worksheet = journal_cells.worksheet
+            AND journal_rows.row_index = journal_cells.row_index
+            WHERE journal_cells.worksheet = ? AND journal_rows.status != ?
+            """,
+            (worksheet, JOURNAL_STATUS_CONFLICT),
+        )
+    }
+
+
+def select_journal_cells_since(connection, worksheet, updated_after):
+    # (row_index, column, value, updated_at) untuk cell yang berubah setelah updated_after.
+    return connection.execute(
+        """
+        SELECT journal_cells.row_index, journal_cells.column_name, journal_cells.value, journal_cells.updated_at
+        FROM journal_cells
+        JOIN journal_rows
+        ON journal_rows.worksheet = journal_cells.worksheet
+        AND journal_rows.row_index = journal_cells.row_index
+        WHERE journal_cells.worksheet = ? AND journal_rows.status != ? AND journal_cells.updated_at > ?
+        """,
+        (worksheet, JOURNAL_STATUS_CONFLICT, updated_after),
+    ).fetchall()
+
+
+def apply_journal_overlay(df, worksheet, cell_values=None):
+    if df is None or df.empty:
+        return df
+
+    if cell_values is None:
+        cell_values = get_journal_cells(worksheet)
+    for (row_index, column), value in cell_values.items():
+        if row_index not in df.index:
+            continue
+        if column not in df.columns:
+            df[column] = ""
+        df.at[row_index, column] = value
+    return df
+
+
+def get_journal_conflicts(worksheet, updated_by=None):
+    query = """
+        SELECT DISTINCT journal_rows.row_index, journal_rows.last_error, journal_rows.conflict_cells
+        FROM journal_rows
+        JOIN journal_cells
+        ON journal_cells.worksheet = journal_rows.worksheet
+        AND journal_cells.row_index = journal_rows.row_index
+        WHERE journal_rows.worksheet = ? AND journal_rows.status = ?
+    """
+    params = [worksheet, JOURNAL_STATUS_CONFLICT]
+    if updated_by is not None:
+        query += " AND journal_cells.updated_by = ?"
+        params.append(updated_by)
+    with closing(connect_journal()) as connection:
+        return [
+            {"row_index": row_index, "last_error": last_error, "cells": json.loads(conflict_cells)}
+            for row_index, last_error, conflict_cells in connection.execute(
+                query + " ORDER BY journal_rows.row_index", params
+            )
+        ]
+
+
+def keep_journal_changes(worksheet, row_indices):
+    # "Pakai versi saya": nilai di Google Sheet untuk cell yang bentrok dijadikan nilai dasar baru,
+    # sehingga flush berikutnya menimpa cell itu dengan nilai kita; kolom lain tetap digabung biasa.
+    row_indices = list(row_indices)
+    if not row_indices:
+        return
+
+    with closing(connect_journal()) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        for row_index in row_indices:
+            existing = connection.execute(
+                """
+                SELECT expected_values, base_values, conflict_cells FROM journal_rows
+                WHERE worksheet = ? AND row_index = ? AND status = ?
+                """,
+                (worksheet, row_index, JOURNAL_STATUS_CONFLICT),
+            ).fetchone()
+            if not existing:
+                continue
+            row_conflicts = json.loads(existing[2])
+            if any(conflict["column"] == ROW_ID_COLUMN for conflict in row_conflicts):
+                # Posisi baris sudah ditempati baris lain; menimpa di sini berarti salah baris.
+                continue
+            row_base = json.loads(existing[1]) or json.loads(existing[0])
+            for conflict in row_conflicts:
+                row_base[conflict["column"]] = [conflict["theirs"]]
+            connection.execute(
+                """
+                UPDATE journal_rows
+                SET status = ?, base_values = ?, conflict_cells = '[]', attempts = 0, last_error = '', updated_at = ?
+                WHERE worksheet = ? AND row_index = ?
+                """,
+                (JOURNAL_STATUS_PENDING, json.dumps(row_base), time.time(), worksheet, row_index),
+            )
+        connection.execute("COMMIT")
+
+
+def discard_journal_rows(worksheet, row_indices):
+    row_indices = list(row_indices)
+    if not row_indices:
+        return
+
+    placeholders = ",".join("?" * len(row_indices))
+    with closing(connect_journal()) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute(
+            f"DELETE FROM journal_cells WHERE worksheet = ? AND row_index IN ({placeholders})",
+            (worksheet, *row_indices),
+        )
+        connection.execute(
+            f"DELETE FROM journal_rows WHERE worksheet = ? AND row_index IN ({placeholders})",
+            (worksheet, *row_indices),
+        )
+        connection.execute("COMMIT")
+
+
+def get_journal_summary(worksheet):
+    with closing(connect_journal()) as connection:
+        pending_cells, oldest_pending_at = connection.execute(
+            """
+            SELECT COUNT(*), MIN(journal_cells.updated_at)
+            FROM journal_cells
+            JOIN journal_rows
+            ON journal_rows.worksheet = journal_cells.worksheet
+            AND journal_rows.row_index = journal_cells.row_index
+            WHERE journal_cells.worksheet = ? AND journal_cells.status = ? AND journal_rows.status = ?
+            """,
+            (worksheet, JOURNAL_STATUS_PENDING, JOURNAL_STATUS_PENDING),
+        ).fetchone()
+        conflict_rows = connection.execute(
+            "SELECT COUNT(*) FROM journal_rows WHERE worksheet = ? AND status = ?",
+            (worksheet, JOURNAL_STATUS_CONFLICT),
+        ).fetchone()[0]
+        last_error = connection.execute(
+            "SELECT last_error FROM journal_rows WHERE worksheet = ? AND status = ? AND last_error != '' LIMIT 1",
+            (worksheet, JOURNAL_STATUS_PENDING),
+        ).fetchone()
+    return {
+        "pending_cells": pending_cells,
+        "oldest_pending_age": time.time() - oldest_pending_at if oldest_pending_at else 0,
+        "conflict_rows": conflict_rows,
+        "last_error": last_error[0] if last_error else "",
+    }
+
+
+def run_journal_flusher():
+    while True:
+        time.sleep(get_flush_interval_seconds())
+        try:
+            for worksheet in list_pending_worksheets():
+                flush_sheet_journal(worksheet)
+        except Exception:
+            logger.exception("Gagal mengirim journal perubahan ke Google Sheet.")
+
+
+@st.cache_resource
+def start_journal_flusher():
+    thread = threading.Thread(target=run_journal_flusher, name="sheet-journal-flusher", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,516 @@
+import csv
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+import pandas as pd
+import streamlit as st
+
+from sheet_range_update import (
+    as_plain_dict,
+    column_index_to_letter,
+    get_gsheets_option,
+    quote_worksheet_name,
+)
+
+
+EMULATOR_DEFAULT_WORKSHEET = "Sheet1"
+EMULATOR_DEFAULT_CONFIG = {
+    "enabled": False,
+    "data_dir": "",
+    "latency_ms": 0.0,
+    "latency_ms_per_kb": 0.0,
+    "read_requests_per_minute": 0,
+    "write_requests_per_minute": 0,
+    "error_rate": 0.0,
+    "error_status_codes": [429, 500, 503],
+    "retry_after_seconds": 1,
+    "seed": 0,
+}
+EMULATOR_QUOTA_WINDOW_SECONDS = 60
+SHEETS_API_URI = "https://sheets.googleapis.com/v4/spreadsheets"
+DRIVE_API_URI = "https://www.googleapis.com/drive/v3/files"
+
+
+class EmulatedHttpError(RuntimeError):
+    # Bentuknya mengikuti googleapiclient HttpError: status di resp.status, header di resp.get().
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(f"<EmulatedHttpError {status}: {message}>")
+        self.resp = SimpleNamespace(
+            status=status,
+            get=lambda key, default=None: retry_after if key == "retry-after" and retry_after else default,
+        )
+
+
+def get_emulator_config():
+    config = dict(EMULATOR_DEFAULT_CONFIG)
+    config.update(as_plain_dict(get_gsheets_option("emulator")))
+    return config
+
+
+def is_sheets_emulator_enabled():
+    return bool(get_emulator_config().get("enabled"))
+
+
+@st.cache_resource
+def get_sheets_emulator():
+    # Satu spreadsheet palsu per proses server; semua session dan halaman berbagi isinya.
+    config = get_emulator_config()
+    return {
+        "lock": threading.Lock(),
+        "config": config,
+        "random": random.Random(config["seed"]),
+        "sheets": {},
+        "revision": 0,
+        "modified_at": datetime.now(timezone.utc),
+        "quota_windows": {"read": deque(), "write": deque()},
+        "stats": {
+            "requests": 0,
+            "reads": 0,
+            "writes": 0,
+            "request_bytes": 0,
+            "response_bytes": 0,
+            "latency_seconds": 0.0,
+            "quota_errors": 0,
+            "injected_errors": 0,
+        },
+    }
+
+
+def configure_sheets_emulator(**overrides):
+    # Dipakai benchmark untuk mengubah latency/quota/error tanpa menyentuh secrets.
+    emulator = get_sheets_emulator()
+    with emulator["lock"]:
+        emulator["config"].update(overrides)
+        if "seed" in overrides:
+            emulator["random"] = random.Random(overrides["seed"])
+        for window in emulator["quota_windows"].values():
+            window.clear()
+
+
+def reset_sheets_emulator():
+    emulator = get_sheets_emulator()
+    with emulator["lock"]:
+        emulator["sheets"].clear()
+        emulator["random"] = random.Random(emulator["config"]["seed"])
+        for window in emulator["quota_windows"].values():
+            window.clear()
+        for key in emulator["stats"]:
+            emulator["stats"][key] = 0
+        touch_emulated_spreadsheet(emulator)
+
+
+def get_sheets_emulator_status():
+    emulator = get_sheets_emulator()
+    with emulator["lock"]:
+        return {
+            "revision": emulator["revision"],
+            "worksheets": {name: len(grid) for name, grid in emulator["sheets"].items()},
+            "stats": dict(emulator["stats"]),
+        }
+
+
+def touch_emulated_spreadsheet(emulator):
+    emulator["revision"] += 1
+    emulator["modified_at"] = datetime.now(timezone.utc)
+
+
+def load_seed_grid(config, worksheet):
+    data_dir = str(config.get("data_dir") or "").strip()
+    if not data_dir:
+        return []
+    seed_path = Path(data_dir) / f"{worksheet}.csv"
+    if not seed_path.exists():
+        return []
+    with open(seed_path, newline="", encoding="utf-8") as seed_file:
+        return [list(row) for row in csv.reader(seed_file)]
+
+
+def get_emulated_grid(emulator, worksheet):
+    grid = emulator["sheets"].get(worksheet)
+    if grid is None:
+        grid = load_seed_grid(emulator["config"], worksheet)
+        emulator["sheets"][worksheet] = grid
+    return grid
+
+
+def load_emulated_worksheet(worksheet, data):
+    rows = [[str(column) for column in data.columns]]
+    for values in data.fillna("").astype(str).itertuples(index=False, name=None):
+        rows.append(list(values))
+    emulator = get_sheets_emulator()
+    with emulator["lock"]:
+        emulator["sheets"][worksheet] = rows
+        touch_emulated_spreadsheet(emulator)
+
+
+def letter_to_column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index
+
+
+def split_worksheet_name(range_name):
+    # Kebalikan dari quote_worksheet_name: 'Nama ''Sheet'''!A1 -> ("Nama 'Sheet'", "A1").
+    range_name = str(range_name)
+    if range_name.startswith("'"):
+        index = 1
+        name = ""
+        while index < len(range_name):
+            char = range_name[index]
+            if char == "'":
+                if range_name[index + 1:index + 2] == "'":
+                    name += "'"
+                    index += 2
+                    continue
+                rest = range_name[index + 1:]
+                return name, rest[1:] if rest.startswith("!") else rest
+            name += char
+            index += 1
+        raise EmulatedHttpError(400, f"Unable to parse range: {range_name}")
+
+    if "!" in range_name:
+        name, cells = range_name.split("!", 1)
+        return name, cells
+    if re.fullmatch(r"[A-Z]*\d*(:[A-Z]*\d*)?", range_name) and range_name:
+        return EMULATOR_DEFAULT_WORKSHEET, range_name
+    return range_name, ""
+
+
+def parse_cell_reference(reference, range_name):
+    match = re.fullmatch(r"([A-Z]*)(\d*)", reference.strip().upper())
+    if match is None:
+        raise EmulatedHttpError(400, f"Unable to parse range: {range_name}")
+    column = letter_to_column_index(match.group(1)) if match.group(1) else None
+    row = int(match.group(2)) if match.group(2) else None
+    return row, column
+
+
+def parse_a1_range(range_name):
+    # Hasil: (worksheet, baris_awal, kolom_awal, baris_akhir, kolom_akhir), 1-based inklusif;
+    # None berarti sampai ujung data.
+    worksheet, cells = split_worksheet_name(range_name)
+    if not cells:
+        return worksheet, 1, 1, None, None
+
+    start, _, end = cells.partition(":")
+    start_row, start_column = parse_cell_reference(start, range_name)
+    if not end:
+        if start_row is None or start_column is None:
+            raise EmulatedHttpError(400, f"Unable to parse range: {range_name}")
+        return worksheet, start_row, start_column, start_row, start_column
+
+    end_row, end_column = parse_cell_reference(end, range_name)
+    return worksheet, start_row or 1, start_column or 1, end_row, end_column
+
+
+def format_a1_range(worksheet, start_row, start_column, end_row, end_column):
+    start = f"{column_index_to_letter(start_column)}{start_row}"
+    end = f"{column_index_to_letter(end_column)}{end_row}"
+    if start == end:
+        return f"{quote_worksheet_name(worksheet)}!{start}"
+    return f"{quote_worksheet_name(worksheet)}!{start}:{end}"
+
+
+def trim_values(values):
+    # Sheets API tidak mengembalikan cell kosong di ujung baris maupun baris kosong di akhir.
+    trimmed = []
+    for row in values:
+        while row and row[-1] == "":
+            row = row[:-1]
+        trimmed.append(row)
+    while trimmed and not trimmed[-1]:
+        trimmed.pop()
+    return trimmed
+
+
+def read_emulated_range(emulator, range_name, major_dimension="ROWS"):
+    worksheet, start_row, start_column, end_row, end_column = parse_a1_range(range_name)
+    grid = get_emulated_grid(emulator, worksheet)
+    last_row = len(grid) if end_row is None else end_row
+    last_column = max((len(row) for row in grid), default=0) if end_column is None else end_column
+
+    values = []
+    for row_number in range(start_row, last_row + 1):
+        row = grid[row_number - 1] if row_number <= len(grid) else []
+        values.append([
+            row[column_number - 1] if column_number <= len(row) else ""
+            for column_number in range(start_column, last_column + 1)
+        ])
+
+    if str(major_dimension).upper() == "COLUMNS":
+        values = [list(column) for column in zip(*values)] if values else []
+    result = {
+        "range": format_a1_range(
+            worksheet,
+            start_row,
+            start_column,
+            max(last_row, start_row),
+            max(last_column, start_column),
+        ),
+        "majorDimension": str(major_dimension).upper(),
+    }
+    values = trim_values(values)
+    if values:
+        result["values"] = values
+    return result
+
+
+def write_emulated_values(emulator, worksheet, start_row, start_column, values):
+    grid = get_emulated_grid(emulator, worksheet)
+    updated_cells = 0
+    updated_columns = 0
+    for row_offset, row_values in enumerate(values):
+        row_number = start_row + row_offset
+        while len(grid) < row_number:
+            grid.append([])
+        row = grid[row_number - 1]
+        for column_offset, value in enumerate(row_values):
+            column_number = start_column + column_offset
+            while len(row) < column_number:
+                row.append("")
+            row[column_number - 1] = "" if value is None else str(value)
+        updated_cells += len(row_values)
+        updated_columns = max(updated_columns, len(row_values))
+
+    touch_emulated_spreadsheet(emulator)
+    return {
+        "updatedRange": format_a1_range(
+            worksheet,
+            start_row,
+            start_column,
+            start_row + max(len(values), 1) - 1,
+            start_column + max(updated_columns, 1) - 1,
+        ),
+        "updatedRows": len(values),
+        "updatedColumns": updated_columns,
+        "updatedCells": updated_cells,
+    }
+
+
+def update_emulated_range(emulator, range_name, values):
+    worksheet, start_row, start_column, _, _ = parse_a1_range(range_name)
+    return write_emulated_values(emulator, worksheet, start_row, start_column, values)
+
+
+def append_emulated_rows(emulator, range_name, values):
+    worksheet, _, start_column, _, _ = parse_a1_range(range_name)
+    grid = get_emulated_grid(emulator, worksheet)
+    last_row = len(trim_values([list(row) for row in grid]))
+    result = write_emulated_values(emulator, worksheet, last_row + 1, start_column, values)
+    return {
+        "tableRange": format_a1_range(worksheet, 1, start_column, max(last_row, 1), start_column),
+        "updates": result,
+    }
+
+
+def clear_emulated_worksheet(emulator, worksheet):
+    emulator["sheets"][worksheet] = []
+    touch_emulated_spreadsheet(emulator)
+
+
+def check_emulated_quota(emulator, quota_kind):
+    limit = int(emulator["config"].get(f"{quota_kind}_requests_per_minute") or 0)
+    if limit <= 0:
+        return
+
+    now = time.monotonic()
+    window = emulator["quota_windows"][quota_kind]
+    while window and now - window[0] >= EMULATOR_QUOTA_WINDOW_SECONDS:
+        window.popleft()
+    if len(window) >= limit:
+        emulator["stats"]["quota_errors"] += 1
+        retry_after = max(1, round(EMULATOR_QUOTA_WINDOW_SECONDS - (now - window[0])))
+        raise EmulatedHttpError(429, "Quota exceeded (emulator)", retry_after=str(retry_after))
+    window.append(now)
+
+
+def inject_emulated_error(emulator):
+    config = emulator["config"]
+    error_rate = float(config.get("error_rate") or 0)
+    if error_rate <= 0 or emulator["random"].random() >= error_rate:
+        return
+
+    emulator["stats"]["injected_errors"] += 1
+    status = int(emulator["random"].choice(list(config.get("error_status_codes") or [500])))
+    retry_after = str(config.get("retry_after_seconds") or 1) if status == 429 else None
+    raise EmulatedHttpError(status, "Injected error (emulator)", retry_after=retry_after)
+
+
+def get_payload_size(payload):
+    return len(json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")) if payload else 0
+
+
+def execute_emulated_call(quota_kind, operation, body=None):
+    emulator = get_sheets_emulator()
+    with emulator["lock"]:
+        emulator["stats"]["requests"] += 1
+        if quota_kind:
+            emulator["stats"][f"{quota_kind}s"] += 1
+            check_emulated_quota(emulator, quota_kind)
+        inject_emulated_error(emulator)
+        result = operation(emulator)
+        request_bytes = get_payload_size(body)
+        response_bytes = get_payload_size(result)
+        config = emulator["config"]
+        latency = (
+            float(config.get("latency_ms") or 0)
+            + float(config.get("latency_ms_per_kb") or 0) * (request_bytes + response_bytes) / 1024
+        ) / 1000
+        emulator["stats"]["request_bytes"] += request_bytes
+        emulator["stats"]["response_bytes"] += response_bytes
+        emulator["stats"]["latency_seconds"] += latency
+
+    # Latency disimulasikan di luar lock agar request paralel tetap bisa saling tumpang tindih.
+    if latency > 0:
+        time.sleep(latency)
+    return result
+
+
+def build_emulated_request(method, method_id, uri, quota_kind, operation, body=None):
+    # Tanpa atribut http, transport mengeksekusi request ini langsung tanpa pool koneksi.
+    # methodId sama dengan request googleapiclient agar rate limiter menggolongkannya sama.
+    return SimpleNamespace(
+        method=method,
+        methodId=method_id,
+        uri=uri,
+        execute=lambda: execute_emulated_call(quota_kind, operation, body),
+    )
+
+
+@st.cache_resource
+def get_emulated_values_service():
+    def get(spreadsheetId, range, majorDimension="ROWS", **kwargs):
+        return build_emulated_request(
+            "GET",
+            "sheets.spreadsheets.values.get",
+            f"{SHEETS_API_URI}/{spreadsheetId}/values/{range}",
+            "read",
+            lambda emulator: read_emulated_range(emulator, range, majorDimension),
+        )
+
+    def batchGet(spreadsheetId, ranges, majorDimension="ROWS", **kwargs):
+        return build_emulated_request(
+            "GET",
+            "sheets.spreadsheets.values.batchGet",
+            f"{SHEETS_API_URI}/{spreadsheetId}/values:batchGet",
+            "read",
+            lambda emulator: {
+                "spreadsheetId": spreadsheetId,
+                "valueRanges": [
+                    read_emulated_range(emulator, range_name, majorDimension)
+                    for range_name in ranges
+                ],
+            },
+            {"ranges": list(ranges)},
+        )
+
+    def update(spreadsheetId, range, body, valueInputOption="RAW", **kwargs):
+        return build_emulated_request(
+            "PUT",
+            "sheets.spreadsheets.values.update",
+            f"{SHEETS_API_URI}/{spreadsheetId}/values/{range}",
+            "write",
+            lambda emulator: {
+                "spreadsheetId": spreadsheetId,
+                **update_emulated_range(emulator, range, body.get("values", [])),
+            },
+            body,
+        )
+
+    def batchUpdate(spreadsheetId, body, **kwargs):
+        def run(emulator):
+            responses = [
+                update_emulated_range(emulator, value_range["range"], value_range.get("values", []))
+                for value_range in body.get("data", [])
+            ]
+            return {
+                "spreadsheetId": spreadsheetId,
+                "totalUpdatedCells": sum(response["updatedCells"] for response in responses),
+                "responses": responses,
+            }
+
+        return build_emulated_request(
+            "POST",
+            "sheets.spreadsheets.values.batchUpdate",
+            f"{SHEETS_API_URI}/{spreadsheetId}/values:batchUpdate",
+            "write",
+            run,
+            body,
+        )
+
+    def append(spreadsheetId, range, body, valueInputOption="RAW", insertDataOption="INSERT_ROWS", **kwargs):
+        return build_emulated_request(
+            "POST",
+            "sheets.spreadsheets.values.append",
+            f"{SHEETS_API_URI}/{spreadsheetId}/values/{range}:append",
+            "write",
+            lambda emulator: {
+                "spreadsheetId": spreadsheetId,
+                **append_emulated_rows(emulator, range, body.get("values", [])),
+            },
+            body,
+        )
+
+    return SimpleNamespace(get=get, batchGet=batchGet, update=update, batchUpdate=batchUpdate, append=append)
+
+
+@st.cache_resource
+def get_emulated_files_service():
+    # Pengganti Drive files.get(fields="modifiedTime") untuk probe perubahan.
+    def get(fileId, fields=None, **kwargs):
+        return build_emulated_request(
+            "GET",
+            "drive.files.get",
+            f"{DRIVE_API_URI}/{fileId}",
+            None,
+            lambda emulator: {
+                "modifiedTime": f"{emulator['modified_at'].isoformat()}#{emulator['revision']}",
+            },
+        )
+
+    return SimpleNamespace(get=get)
+
+
+def read_emulated_worksheet(worksheet=None, ttl=None, **kwargs):
+    worksheet = worksheet or EMULATOR_DEFAULT_WORKSHEET
+    result = execute_emulated_call(
+        "read",
+        lambda emulator: read_emulated_range(emulator, quote_worksheet_name(worksheet)),
+    )
+    values = result.get("values", [])
+    if not values:
+        return pd.DataFrame()
+
+    headers = values[0]
+    rows = [
+        (row + [""] * (len(headers) - len(row)))[:len(headers)]
+        for row in values[1:]
+    ]
+    return pd.DataFrame(rows, columns=headers)
+
+
+def update_emulated_worksheet(worksheet=None, data=None, **kwargs):
+    worksheet = worksheet or EMULATOR_DEFAULT_WORKSHEET
+    values = [[str(column) for column in data.columns]]
+    values.extend(list(row) for row in data.fillna("").astype(str).itertuples(index=False, name=None))
+
+    def run(emulator):
+        clear_emulated_worksheet(emulator, worksheet)
+        return write_emulated_values(emulator, worksheet, 1, 1, values)
+
+    execute_emulated_call("write", run, {"values": values})
+    return data
+
+
+@st.cache_resource
+def get_emulated_connection():
+    # Cukup read/update seperti yang dipakai halaman dari GSheetsConnection.
+    return SimpleNamespace(read=read_emulated_worksheet, update=update_emulated_worksheet)
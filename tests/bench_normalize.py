@@ -0,0 +1,75 @@
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sheet_normalize import prepare_sheet_frame  # noqa: E402
+
+
+# Microbenchmark normalisasi sheet: python tests/bench_normalize.py
+# (kesamaan hasil dengan normalize_cell dicek di tests/test_normalize.py).
+BENCHMARK_ROW_COUNTS = [10_000, 100_000]
+
+
+def normalize_cell(value):
+    # Implementasi per cell lama, hanya dipakai sebagai pembanding di benchmark.
+    if pd.isna(value):
+        return ""
+
+    text = str(value).strip()
+    if text.lower() in {"nan", "none", "<na>"}:
+        return ""
+    return text
+
+
+def make_benchmark_frame(row_count):
+    columns = ["instruction_ats", "input", "output_ats", "validator", "status"]
+    samples = ["", " Kategori 3 ", None, "nan", "Pasien datang dengan nyeri dada sejak 2 jam", "Done", "None", 42.0]
+    return pd.DataFrame({
+        column: [samples[(row_index + offset) % len(samples)] for row_index in range(row_count)]
+        for offset, column in enumerate(columns)
+    })
+
+
+def benchmark_normalization(row_counts=BENCHMARK_ROW_COUNTS, repeat=3):
+    # Microbenchmark: map normalize_cell per cell (cara lama) vs normalisasi per kolom vs hit memo
+    # (salinan frame yang sudah dinormalisasi). Mengembalikan waktu terbaik dalam detik.
+    results = []
+    for row_count in row_counts:
+        df = make_benchmark_frame(row_count)
+        columns = list(df.columns)
+
+        def run_per_cell():
+            prepared_df = df.copy()
+            for column in columns:
+                prepared_df[column] = prepared_df[column].map(normalize_cell)
+            return prepared_df
+
+        def run_per_column():
+            return prepare_sheet_frame(df, columns)
+
+        prepared_df = run_per_column()
+        timings = {}
+        for name, func in [("per_cell", run_per_cell), ("per_column", run_per_column), ("memo_hit", prepared_df.copy)]:
+            best = None
+            for _ in range(repeat):
+                started_at = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - started_at
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+        results.append({"rows": row_count, **timings})
+    return results
+
+
+if __name__ == "__main__":
+    for result in benchmark_normalization():
+        print(
+            f"{result['rows']:>7} baris: per cell {result['per_cell'] * 1000:8.1f} ms · "
+            f"per kolom {result['per_column'] * 1000:7.1f} ms "
+            f"({result['per_cell'] / result['per_column']:.1f}x) · "
+            f"memo {result['memo_hit'] * 1000:6.1f} ms"
+        )
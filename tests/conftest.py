@@ -0,0 +1,39 @@
+import csv
+import sys
+from pathlib import Path
+
+import pytest
+import streamlit as st
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import sheet_range_update  # noqa: E402
+
+
+@pytest.fixture
+def sheets_config(tmp_path, monkeypatch):
+    # Secrets untuk emulator Google Sheets di tmp_path; test boleh menambah opsi ke dict ini.
+    config = {
+        "spreadsheet": "emu",
+        "change_probe": "local",
+        "emulator": {"enabled": True, "data_dir": str(tmp_path)},
+        "write_behind_journal": str(tmp_path / "sheet_write_journal.sqlite3"),
+    }
+    monkeypatch.setattr(sheet_range_update, "get_gsheets_secret_config", lambda: config)
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    yield config
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+
+@pytest.fixture
+def seed_sheet(tmp_path, sheets_config):
+    # Tulis isi awal worksheet emulator sebagai CSV; dibaca emulator saat worksheet pertama kali diakses.
+    def write(columns, rows, worksheet="Sheet1"):
+        with open(tmp_path / f"{worksheet}.csv", "w", newline="", encoding="utf-8") as seed_file:
+            writer = csv.writer(seed_file)
+            writer.writerow(columns)
+            writer.writerows(rows)
+
+    return write
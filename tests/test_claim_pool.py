@@ -0,0 +1,114 @@
+import threading
+import time
+
+import pytest
+
+from claim_leases import format_claim_timestamp, sweep_expired_claims
+from claim_pool import claim_rows_grouped, get_claim_pool_status, sync_claim_pool
+from sheet_range_update import read_sheet_dataframe, write_sheet_values
+from sheets_emulator import get_sheets_emulator_status
+
+
+CLAIM_COLUMNS = [
+    "input", "instruction_ats", "output_ats", "validator", "status", "claimed_at",
+    "row_version", "updated_at", "updated_by",
+]
+CLAIM_EXPECTED_VALUES = {"instruction_ats": "", "output_ats": "", "validator": "", "status": ""}
+ROW_COUNT = 30
+
+
+@pytest.fixture
+def task_sheet(seed_sheet):
+    seed_sheet(CLAIM_COLUMNS, [
+        [f"keluhan {row_index}", "", "", "", "", "", "0", "", ""]
+        for row_index in range(ROW_COUNT)
+    ])
+
+
+def claim(claimer, batch_size, loaded_at=1.0):
+    return claim_rows_grouped(
+        "Sheet1",
+        "labeling",
+        loaded_at,
+        lambda: range(ROW_COUNT),
+        batch_size,
+        {"validator": claimer},
+        CLAIM_EXPECTED_VALUES,
+        updated_by=claimer,
+    )
+
+
+def test_concurrent_claims_are_grouped_without_double_assignment(task_sheet):
+    claimers = [f"validator{number}" for number in range(6)]
+    barrier = threading.Barrier(len(claimers))
+    results = {}
+
+    def run(claimer):
+        barrier.wait()
+        results[claimer] = claim(claimer, 4)
+
+    threads = [threading.Thread(target=run, args=(claimer,)) for claimer in claimers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    claimed_rows = [row_index for claimed, _, _ in results.values() for row_index in claimed]
+    assert all(len(claimed) == 4 and not unverified for claimed, _, unverified in results.values())
+    assert len(claimed_rows) == len(set(claimed_rows)) == 24
+
+    df = read_sheet_dataframe("Sheet1")
+    for claimer, (claimed, _, _) in results.items():
+        assert df.loc[claimed, "validator"].tolist() == [claimer] * 4
+    assert (df["validator"] != "").sum() == 24
+
+    status = get_claim_pool_status("Sheet1", "labeling")
+    assert status["grouped_requests"] == len(claimers)
+    assert status["groups"] < len(claimers)
+    assert status["claimed"] == 24
+    assert status["available"] == ROW_COUNT - 24
+    # Satu batchUpdate per grup, bukan per permintaan klaim.
+    assert get_sheets_emulator_status()["stats"]["writes"] == status["groups"]
+
+
+def test_row_claimed_elsewhere_is_skipped(task_sheet):
+    sync_claim_pool("Sheet1", "labeling", 1.0, lambda: range(ROW_COUNT))
+    # Replika lain mengambil baris 0 setelah antrian dibangun.
+    write_sheet_values("Sheet1", {(0, "validator"): "replika lain"})
+
+    claimed, conflicts, unverified = claim("budi", 2)
+    assert claimed == [1, 2]
+    assert conflicts == [0]
+    assert unverified == []
+    assert read_sheet_dataframe("Sheet1").at[0, "validator"] == "replika lain"
+    assert get_claim_pool_status("Sheet1", "labeling")["conflicts"] == 1
+
+    claimed, conflicts, _ = claim("budi", 1)
+    assert claimed == [3]
+    assert conflicts == []
+
+
+def test_expired_claims_are_released_and_requeued(seed_sheet, sheets_config):
+    sheets_config["claim_lease_minutes"] = 1
+    now = time.time()
+    seed_sheet(CLAIM_COLUMNS, [
+        ["keluhan 0", "", "", "budi", "", format_claim_timestamp(now - 3600), "1", "", ""],
+        ["keluhan 1", "", "", "budi", "", format_claim_timestamp(now), "1", "", ""],
+        ["keluhan 2", "", "", "budi", "", "", "1", "", ""],
+        ["keluhan 3", "Kategori 2", "", "budi", "Done", format_claim_timestamp(now - 3600), "3", "", ""],
+        ["keluhan 4", "", "", "", "", "", "0", "", ""],
+    ])
+    sync_claim_pool("Sheet1", "labeling", 1.0, lambda: [])
+
+    result = sweep_expired_claims()
+    assert result == {"released": [0], "stamped": [2], "conflicts": 0}
+
+    df = read_sheet_dataframe("Sheet1")
+    assert df.loc[0, ["validator", "claimed_at", "row_version"]].tolist() == ["", "", "2"]
+    assert df.at[1, "validator"] == "budi"
+    assert float(df.at[2, "claimed_at"]) >= int(now)
+    assert df.loc[3, ["validator", "row_version"]].tolist() == ["budi", "3"]
+    # Baris yang dilepas langsung bisa diklaim lagi tanpa menunggu snapshot di-download ulang.
+    assert get_claim_pool_status("Sheet1", "labeling")["available"] == 1
+
+    assert sweep_expired_claims() == {"released": [], "stamped": [], "conflicts": 0}
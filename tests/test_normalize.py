@@ -0,0 +1,32 @@
+import pandas as pd
+
+from bench_normalize import make_benchmark_frame, normalize_cell
+from sheet_normalize import normalize_column, prepare_sheet_frame
+
+
+def test_normalize_column_matches_normalize_cell():
+    df = make_benchmark_frame(64)
+    df["angka"] = [1.5, None, float("nan"), 0] * 16
+    df["na"] = pd.array(["<NA>", None, " NONE ", "x"] * 16, dtype="string")
+    for column in df.columns:
+        assert normalize_column(df[column]).tolist() == df[column].map(normalize_cell).tolist()
+
+
+def test_prepare_sheet_frame_legacy_columns():
+    df = pd.DataFrame({
+        "input": [" keluhan "],
+        "instruksi_ats": ["Kategori 2"],
+        "nama_validator": ["budi"],
+        "catatan": [None],
+    })
+    columns = ["instruction_ats", "input", "validator"]
+
+    renamed_df = prepare_sheet_frame(df, columns)
+    assert list(renamed_df.columns) == columns + ["catatan"]
+    assert renamed_df.loc[0, columns].tolist() == ["Kategori 2", "keluhan", "budi"]
+
+    # User Labeling dan Admin Monitoring membuang kolom lama tanpa memakai isinya.
+    dropped_df = prepare_sheet_frame(df, columns, rename_legacy=False)
+    assert list(dropped_df.columns) == columns + ["catatan"]
+    assert dropped_df.loc[0, columns].tolist() == ["", "keluhan", ""]
+    assert df.columns.tolist() == ["input", "instruksi_ats", "nama_validator", "catatan"]
@@ -0,0 +1,138 @@
+import pytest
+
+from sheet_merge import SheetMergeConflictError, merge_row_cells
+from sheet_range_update import (
+    ROW_VERSION_COLUMN,
+    SheetConflictError,
+    load_worksheet_snapshot,
+    read_sheet_dataframe,
+    update_sheet_cells_if_unchanged,
+)
+from sheet_row_index import ROW_ID_COLUMN, get_row_index_status
+from sheets_emulator import get_sheets_emulator_status, load_emulated_worksheet
+
+
+SHEET_COLUMNS = [
+    "instruction_ats", "input", "output_ats", "validator", "status",
+    ROW_VERSION_COLUMN, "updated_at", "updated_by", ROW_ID_COLUMN,
+]
+SNAPSHOT_COLUMNS = ["instruction_ats", "input", "output_ats", "validator", "status", ROW_VERSION_COLUMN, ROW_ID_COLUMN]
+SAVE_COLUMNS = ["instruction_ats", "output_ats", "validator", "status"]
+
+
+@pytest.fixture
+def versioned_sheet(seed_sheet):
+    seed_sheet(SHEET_COLUMNS, [
+        ["", f"keluhan {row_id}", "", "budi", "", "0", "", "", f"R-{row_id}"]
+        for row_id in "abcd"
+    ])
+    return load_worksheet_snapshot("Sheet1", columns=SNAPSHOT_COLUMNS)
+
+
+def save_rows(df, row_indices, changes, updated_by="budi", merge_conflicts=False):
+    # Seperti save di halaman labeling: nilai yang terlihat saat mulai mengedit menjadi precondition.
+    row_df = df.loc[row_indices].copy()
+    expected_values = {
+        column: {row_index: row_df.at[row_index, column] for row_index in row_indices}
+        for column in SAVE_COLUMNS
+    }
+    for column, value in changes.items():
+        row_df.loc[row_indices, column] = value
+    update_sheet_cells_if_unchanged(
+        "Sheet1", row_df, row_indices, SAVE_COLUMNS, expected_values, updated_by, merge_conflicts
+    )
+    return row_df
+
+
+def archive_first_row():
+    # Admin mengarsip baris pertama: semua baris di bawahnya naik satu posisi.
+    df = read_sheet_dataframe("Sheet1")
+    load_emulated_worksheet("Sheet1", df.iloc[1:].reset_index(drop=True))
+
+
+def test_stale_row_version_is_rejected(versioned_sheet):
+    saved_df = save_rows(versioned_sheet, [0], {"instruction_ats": "Kategori 2"}, "ani")
+    assert saved_df.at[0, ROW_VERSION_COLUMN] == "1"
+
+    with pytest.raises(SheetConflictError) as error:
+        save_rows(versioned_sheet, [0], {"instruction_ats": "Kategori 3"})
+    assert error.value.row_indices == [0]
+
+    df = read_sheet_dataframe("Sheet1")
+    assert df.loc[0, ["instruction_ats", ROW_VERSION_COLUMN, "updated_by"]].tolist() == ["Kategori 2", "1", "ani"]
+    # Baris lain tidak ikut ditolak karena versinya tidak berubah.
+    assert save_rows(versioned_sheet, [1], {"status": "Pending"}).at[1, ROW_VERSION_COLUMN] == "1"
+
+
+def test_conflicting_save_merges_disjoint_cells(versioned_sheet):
+    save_rows(versioned_sheet, [0], {"instruction_ats": "Kategori 2"}, "ani")
+
+    merged_df = save_rows(versioned_sheet, [0], {"output_ats": "Pemeriksaan EKG"}, merge_conflicts=True)
+    assert merged_df.at[0, ROW_VERSION_COLUMN] == "2"
+    df = read_sheet_dataframe("Sheet1")
+    assert df.loc[0, ["instruction_ats", "output_ats", ROW_VERSION_COLUMN]].tolist() == [
+        "Kategori 2", "Pemeriksaan EKG", "2"
+    ]
+
+    with pytest.raises(SheetMergeConflictError) as error:
+        save_rows(versioned_sheet, [0], {"instruction_ats": "Kategori 4"}, merge_conflicts=True)
+    assert [conflict["column"] for conflict in error.value.cell_conflicts[0]] == ["instruction_ats"]
+    assert error.value.cell_conflicts[0][0]["theirs"] == "Kategori 2"
+    assert read_sheet_dataframe("Sheet1").at[0, "instruction_ats"] == "Kategori 2"
+
+
+@pytest.mark.parametrize(
+    ("mine", "theirs", "column", "merged", "conflict"),
+    [
+        # Hanya kita yang mengubah cell: nilai kita ditulis.
+        ("Kategori 3", "", "instruction_ats", {"instruction_ats": "Kategori 3"}, False),
+        # Hanya orang lain yang mengubah cell: nilai mereka dipertahankan.
+        ("", "Kategori 2", "instruction_ats", {}, False),
+        # Keduanya mengubah ke nilai yang sama: tidak perlu ditulis ulang.
+        ("Kategori 2", "Kategori 2", "instruction_ats", {}, False),
+        # Keduanya mengubah ke nilai berbeda: bentrok.
+        ("Kategori 3", "Kategori 2", "instruction_ats", {}, True),
+        # Kolom kepemilikan yang diubah orang lain selalu bentrok walau nilai kita tetap.
+        ("budi", "ani", "validator", {}, True),
+    ],
+)
+def test_merge_row_cells_outcomes(mine, theirs, column, merged, conflict):
+    base_value = "budi" if column == "validator" else ""
+    merged_values, cell_conflicts = merge_row_cells(0, {column: mine}, {column: base_value}, {column: theirs})
+    assert merged_values == merged
+    assert [cell_conflict["column"] for cell_conflict in cell_conflicts] == ([column] if conflict else [])
+
+
+def test_merge_row_cells_rejects_changed_precondition_column():
+    merged_values, cell_conflicts = merge_row_cells(
+        0,
+        {"output_ats": "Pemeriksaan EKG"},
+        {"output_ats": "", ROW_ID_COLUMN: {0: "R-a"}},
+        {"output_ats": "", ROW_ID_COLUMN: "R-b"},
+    )
+    assert merged_values == {"output_ats": "Pemeriksaan EKG"}
+    assert cell_conflicts == [{"column": ROW_ID_COLUMN, "base": ["R-a"], "mine": None, "theirs": "R-b"}]
+
+
+def test_save_follows_row_id_after_rows_move(versioned_sheet):
+    archive_first_row()
+
+    saved_df = save_rows(versioned_sheet, [1], {"instruction_ats": "Kategori 2"})
+    df = read_sheet_dataframe("Sheet1")
+    assert df.loc[0, [ROW_ID_COLUMN, "instruction_ats", ROW_VERSION_COLUMN]].tolist() == ["R-b", "Kategori 2", "1"]
+    assert df.loc[1, "instruction_ats"] == ""
+    assert saved_df.at[1, ROW_VERSION_COLUMN] == "1"
+    assert get_row_index_status("Sheet1")["remapped_rows"] == 1
+
+
+def test_rows_resolving_to_same_position_are_rejected(versioned_sheet):
+    archive_first_row()
+    # Baris 2 belum punya row_id sehingga tetap di posisi 2, sedangkan R-d baru saja bergeser ke posisi 2.
+    versioned_sheet.at[2, ROW_ID_COLUMN] = ""
+    writes_before = get_sheets_emulator_status()["stats"]["writes"]
+
+    with pytest.raises(SheetConflictError) as error:
+        save_rows(versioned_sheet, [2, 3], {"status": "Pending"})
+    assert error.value.row_indices == [2, 3]
+    assert get_sheets_emulator_status()["stats"]["writes"] == writes_before
+    assert read_sheet_dataframe("Sheet1")["status"].tolist() == ["", "", ""]
@@ -0,0 +1,75 @@
+import sys
+from pathlib import Path
+
+import pytest
+import streamlit as st
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import sheet_range_update  # noqa: E402
+from sheet_range_update import (  # noqa: E402
+    ROW_UPDATED_AT_COLUMN,
+    ROW_UPDATED_BY_COLUMN,
+    ROW_VERSION_COLUMN,
+    load_worksheet_snapshot,
+    update_sheet_cells_if_unchanged,
+)
+from sheet_snapshot import get_sheet_snapshot_status  # noqa: E402
+
+
+SNAPSHOT_COLUMNS = ["instruction_ats", "input", "output_ats", "validator", "status", ROW_VERSION_COLUMN]
+SAVE_COLUMNS = ["instruction_ats", "output_ats", "validator", "status"]
+
+
+@pytest.fixture
+def emulated_sheet(tmp_path, monkeypatch):
+    rows = ["instruction_ats,input,output_ats,validator,status,row_version"]
+    rows += [f",keluhan {row_index},,budi,,0" for row_index in range(3)]
+    (tmp_path / "Sheet1.csv").write_text("\n".join(rows) + "\n", encoding="utf-8")
+    config = {
+        "spreadsheet": "emu",
+        "change_probe": "local",
+        "emulator": {"enabled": True, "data_dir": str(tmp_path)},
+    }
+    monkeypatch.setattr(sheet_range_update, "get_gsheets_secret_config", lambda: config)
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+    conflicts = []
+    find_sheet_conflicts = sheet_range_update.find_sheet_conflicts
+
+    def record_conflicts(worksheet, row_indices, expected_values):
+        found, latest_values = find_sheet_conflicts(worksheet, row_indices, expected_values)
+        conflicts.extend(found)
+        return found, latest_values
+
+    monkeypatch.setattr(sheet_range_update, "find_sheet_conflicts", record_conflicts)
+    return conflicts
+
+
+def save_row(row_df, instruction_value):
+    # Sama seperti save_task_row: nilai lama di row_df menjadi precondition, lalu row_df diperbarui.
+    expected_values = {column: row_df.at[0, column] for column in SAVE_COLUMNS}
+    pending_df = row_df.copy()
+    pending_df.at[0, "instruction_ats"] = instruction_value
+    pending_df.at[0, "status"] = "Pending"
+    update_sheet_cells_if_unchanged(
+        "Sheet1", pending_df, [0], SAVE_COLUMNS, expected_values, "budi", merge_conflicts=True
+    )
+    return pending_df
+
+
+def test_saving_same_row_twice_does_not_conflict(emulated_sheet):
+    df = load_worksheet_snapshot("Sheet1", columns=SNAPSHOT_COLUMNS)
+    row_df = df.loc[[0]].copy()
+
+    row_df = save_row(row_df, "Kategori 2")
+    assert row_df.at[0, ROW_VERSION_COLUMN] == "1"
+    assert row_df.at[0, ROW_UPDATED_BY_COLUMN] == "budi"
+    assert row_df.at[0, ROW_UPDATED_AT_COLUMN]
+
+    row_df = save_row(row_df, "Kategori 3")
+    assert emulated_sheet == []
+    assert row_df.at[0, ROW_VERSION_COLUMN] == "2"
+    assert not get_sheet_snapshot_status("Sheet1", SNAPSHOT_COLUMNS)["stale"]
+    assert load_worksheet_snapshot("Sheet1", columns=SNAPSHOT_COLUMNS).at[0, "instruction_ats"] == "Kategori 3"
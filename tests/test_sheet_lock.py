@@ -0,0 +1,101 @@
+import threading
+import time
+from contextlib import closing
+
+import pytest
+
+from sheet_lock import (
+    SHEET_LOCK_BACKEND_HANDLERS,
+    SHEET_LOCK_BACKENDS,
+    SHEET_LOCK_METRICS,
+    SheetLockTimeoutError,
+    build_owner_info,
+    connect_lock_database,
+    get_lock_path,
+    get_row_stripe_names,
+    get_sheet_lock_status,
+    get_sheet_row_lock,
+    try_acquire_sqlite_lease,
+)
+
+
+@pytest.fixture(params=SHEET_LOCK_BACKENDS)
+def lock_backend(request, tmp_path, sheets_config):
+    sheets_config["lock_backend"] = request.param
+    sheets_config["lock_path"] = str(tmp_path / "locks" / "sheet_write.lock")
+    sheets_config["lock_stripes"] = 4
+    return request.param
+
+
+def acquire_in_thread(lock_set, timeout):
+    # Thread lain = pemilik lain di proses yang sama; lock per thread tidak reentrant antar thread.
+    outcome = {}
+
+    def run():
+        started_at = time.monotonic()
+        try:
+            lock_set.acquire(timeout=timeout)
+        except SheetLockTimeoutError as exc:
+            outcome["error"] = exc
+        else:
+            outcome["acquired"] = True
+            lock_set.release()
+        outcome["waited"] = time.monotonic() - started_at
+
+    thread = threading.Thread(target=run, name="penunggu")
+    thread.start()
+    thread.join(10)
+    return outcome
+
+
+def test_rows_map_to_fixed_stripes(lock_backend):
+    assert get_row_stripe_names([1, 5, 2]) == ["stripe-001", "stripe-001", "stripe-002"]
+
+
+def test_lock_is_held_until_released(lock_backend):
+    with get_sheet_row_lock([1], "simpan"):
+        assert get_sheet_lock_status()["held_by_this_process"] == ["stripe-001"]
+        if lock_backend in SHEET_LOCK_BACKEND_HANDLERS:
+            read_owner = SHEET_LOCK_BACKEND_HANDLERS[lock_backend][2]
+            assert read_owner(get_lock_path(lock_backend), "stripe-001")["operation"] == "simpan"
+    assert get_sheet_lock_status()["held_by_this_process"] == []
+    if lock_backend in SHEET_LOCK_BACKEND_HANDLERS:
+        assert read_owner(get_lock_path(lock_backend), "stripe-001") is None
+
+
+def test_waiter_times_out_then_acquires_after_release(lock_backend):
+    with get_sheet_row_lock([5], "simpan"):
+        outcome = acquire_in_thread(get_sheet_row_lock([1], "coba simpan"), timeout=0.2)
+        # Baris lain di stripe berbeda tidak ikut tertahan.
+        assert acquire_in_thread(get_sheet_row_lock([2], "coba simpan"), timeout=0.2)["waited"] < 0.2
+    assert "acquired" not in outcome
+    assert outcome["waited"] >= 0.2
+    assert outcome["error"].owner_info["operation"] == "simpan"
+    assert get_sheet_lock_status()["operations"]["coba simpan"]["timeouts"] >= 1
+    assert acquire_in_thread(get_sheet_row_lock([1], "coba simpan"), timeout=0.2)["acquired"]
+
+
+@pytest.mark.parametrize("lock_backend", ["file", "sqlite"], indirect=True)
+def test_other_process_is_blocked_by_backend_lock(lock_backend):
+    acquire, release, _ = SHEET_LOCK_BACKEND_HANDLERS[lock_backend]
+    path = get_lock_path(lock_backend)
+    other_owner = dict(build_owner_info("replika lain"), owner="replika-lain")
+    with get_sheet_row_lock([3], "simpan"):
+        assert acquire(path, "stripe-003", other_owner, time.monotonic() + 0.2, 60) is None
+
+    handle = acquire(path, "stripe-003", other_owner, time.monotonic() + 0.2, 60)
+    assert handle is not None
+    release(handle)
+
+
+@pytest.mark.parametrize("lock_backend", ["sqlite"], indirect=True)
+def test_expired_sqlite_lease_is_taken_over(lock_backend):
+    path = get_lock_path(lock_backend)
+    other_owner = dict(build_owner_info("replika mati"), owner="replika-mati")
+    with closing(connect_lock_database(path)) as connection:
+        assert try_acquire_sqlite_lease(connection, "stripe-000", other_owner, 0)
+    takeovers = SHEET_LOCK_METRICS["lease_takeovers"]
+
+    with get_sheet_row_lock([0], "simpan"):
+        assert get_sheet_lock_status()["held_by_this_process"] == ["stripe-000"]
+    assert SHEET_LOCK_METRICS["lease_takeovers"] == takeovers + 1
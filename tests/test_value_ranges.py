@@ -0,0 +1,68 @@
+import pytest
+
+from sheet_range_update import build_value_ranges, read_sheet_cells, read_sheet_dataframe, write_sheet_values
+from sheets_emulator import EmulatedHttpError, get_sheets_emulator_status, parse_a1_range
+
+
+HEADER_POSITIONS = {"a": 1, "b": 2, "c": 3, "e": 5}
+
+
+def test_adjacent_cells_are_coalesced_into_rectangles():
+    sent_values = {
+        (0, "a"): "a0", (0, "b"): "b0", (0, "e"): "e0",
+        (1, "a"): "a1", (1, "b"): "b1",
+        (3, "a"): "a3",
+    }
+    value_ranges = build_value_ranges("Sheet1", sent_values, HEADER_POSITIONS)
+    assert value_ranges == [
+        {"range": "'Sheet1'!A2:B3", "values": [["a0", "b0"], ["a1", "b1"]]},
+        {"range": "'Sheet1'!E2", "values": [["e0"]]},
+        {"range": "'Sheet1'!A5", "values": [["a3"]]},
+    ]
+
+
+def test_rows_with_different_runs_are_not_stacked():
+    sent_values = {(0, "a"): "a0", (0, "b"): "b0", (1, "a"): "a1", (1, "b"): "b1", (1, "c"): "c1"}
+    value_ranges = build_value_ranges("It's", sent_values, HEADER_POSITIONS)
+    assert [value_range["range"] for value_range in value_ranges] == ["'It''s'!A2:B2", "'It''s'!A3:C3"]
+
+
+@pytest.mark.parametrize(
+    ("range_name", "expected"),
+    [
+        ("A1", ("Sheet1", 1, 1, 1, 1)),
+        ("'Sheet1'!B2:D4", ("Sheet1", 2, 2, 4, 4)),
+        ("'It''s'!B2:C", ("It's", 2, 2, None, 3)),
+        ("'S'!1:1", ("S", 1, 1, 1, None)),
+        ("Data!C:C", ("Data", 1, 3, None, 3)),
+        ("'Sheet1'", ("Sheet1", 1, 1, None, None)),
+        ("AA10", ("Sheet1", 10, 27, 10, 27)),
+    ],
+)
+def test_parse_a1_range(range_name, expected):
+    assert parse_a1_range(range_name) == expected
+
+
+@pytest.mark.parametrize("range_name", ["'Sheet1'!B", "'Tidak tertutup!A1", "'Sheet1'!A1:B$2"])
+def test_parse_a1_range_rejects_invalid_ranges(range_name):
+    with pytest.raises(EmulatedHttpError):
+        parse_a1_range(range_name)
+
+
+def test_coalesced_cells_round_trip_through_emulator(seed_sheet):
+    seed_sheet(["a", "b", "c", "d", "e"], [["", "", "", "", ""] for _ in range(4)])
+    cell_values = {
+        (row_index, column): f"{column}{row_index}"
+        for row_index in range(3)
+        for column in ["a", "b", "c"]
+    }
+    write_sheet_values("Sheet1", cell_values, stamp_rows=False)
+
+    requests_before = get_sheets_emulator_status()["stats"]["requests"]
+    latest_values = read_sheet_cells("Sheet1", range(4), ["a", "b", "c", "e"])
+    # Header sudah di-cache oleh write; semua range hasil penggabungan dibaca dalam satu batchGet.
+    assert get_sheets_emulator_status()["stats"]["requests"] - requests_before == 1
+    assert latest_values[(2, "c")] == "c2"
+    assert latest_values[(3, "a")] == ""
+    assert latest_values[(0, "e")] == ""
+    assert read_sheet_dataframe("Sheet1").loc[1, ["a", "b", "c", "d"]].tolist() == ["a1", "b1", "c1", ""]
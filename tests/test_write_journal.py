@@ -0,0 +1,93 @@
+import pytest
+import streamlit as st
+
+from sheet_range_update import ROW_VERSION_COLUMN, load_worksheet_snapshot, read_sheet_dataframe
+from sheet_row_index import ROW_ID_COLUMN
+from sheet_write_journal import (
+    enqueue_cell_updates,
+    flush_sheet_journal,
+    get_journal_cells,
+    get_journal_summary,
+    is_write_behind_enabled,
+)
+from sheets_emulator import get_sheets_emulator_status, load_emulated_worksheet
+
+
+SHEET_COLUMNS = [
+    "instruction_ats", "input", "output_ats", "validator", "status",
+    ROW_VERSION_COLUMN, "updated_at", "updated_by", ROW_ID_COLUMN,
+]
+SNAPSHOT_COLUMNS = ["instruction_ats", "input", "output_ats", "validator", "status", ROW_VERSION_COLUMN, ROW_ID_COLUMN]
+SAVE_COLUMNS = ["instruction_ats", "output_ats", "validator", "status"]
+
+
+@pytest.fixture
+def journaled_sheet(seed_sheet, sheets_config):
+    sheets_config["write_behind"] = True
+    seed_sheet(SHEET_COLUMNS, [
+        ["", f"keluhan {row_id}", "", "budi", "", "0", "", "", f"R-{row_id}"]
+        for row_id in "abc"
+    ])
+    return load_worksheet_snapshot("Sheet1", columns=SNAPSHOT_COLUMNS)
+
+
+def enqueue_edit(df, row_index, changes):
+    # Seperti autosave di halaman labeling: precondition diambil dari nilai yang terlihat sebelum diedit.
+    expected_values = {column: {row_index: df.at[row_index, column]} for column in SAVE_COLUMNS}
+    row_df = df.loc[[row_index]].copy()
+    for column, value in changes.items():
+        row_df.at[row_index, column] = value
+    enqueue_cell_updates("Sheet1", row_df, [row_index], list(changes), expected_values, "budi")
+
+
+def test_edits_to_same_cell_are_coalesced(journaled_sheet):
+    assert is_write_behind_enabled()
+    enqueue_edit(journaled_sheet, 0, {"instruction_ats": "Kategori 2"})
+    enqueue_edit(journaled_sheet, 0, {"instruction_ats": "Kategori 3", "status": "Pending"})
+    enqueue_edit(journaled_sheet, 1, {"output_ats": "Pemeriksaan EKG"})
+
+    assert get_journal_summary("Sheet1")["pending_cells"] == 3
+    assert get_journal_cells("Sheet1") == {
+        (0, "instruction_ats"): "Kategori 3",
+        (0, "status"): "Pending",
+        (1, "output_ats"): "Pemeriksaan EKG",
+    }
+
+    writes_before = get_sheets_emulator_status()["stats"]["writes"]
+    result = flush_sheet_journal("Sheet1")
+    assert sorted(result["written"]) == [0, 1]
+    assert result["conflicts"] == []
+    # Semua cell yang tertunda dikirim dalam satu batchUpdate.
+    assert get_sheets_emulator_status()["stats"]["writes"] - writes_before == 1
+
+    df = read_sheet_dataframe("Sheet1")
+    assert df.loc[0, ["instruction_ats", "status", ROW_VERSION_COLUMN]].tolist() == ["Kategori 3", "Pending", "1"]
+    assert df.loc[1, ["output_ats", ROW_VERSION_COLUMN]].tolist() == ["Pemeriksaan EKG", "1"]
+    assert get_journal_summary("Sheet1")["pending_cells"] == 0
+
+
+def test_pending_journal_is_replayed_after_restart(journaled_sheet):
+    enqueue_edit(journaled_sheet, 2, {"status": "Pending"})
+
+    # Restart proses: semua state in-memory hilang (termasuk isi emulator, yang dibaca ulang dari seed
+    # seperti Google Sheet yang belum pernah menerima write), journal di disk tetap ada.
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    assert get_journal_summary("Sheet1")["pending_cells"] == 1
+
+    result = flush_sheet_journal("Sheet1")
+    assert result["written"] == [2]
+    assert read_sheet_dataframe("Sheet1").loc[2, ["status", ROW_VERSION_COLUMN]].tolist() == ["Pending", "1"]
+    assert flush_sheet_journal("Sheet1")["written"] == []
+
+
+def test_flush_follows_row_id_after_rows_move(journaled_sheet):
+    enqueue_edit(journaled_sheet, 1, {"instruction_ats": "Kategori 2"})
+    df = read_sheet_dataframe("Sheet1")
+    load_emulated_worksheet("Sheet1", df.iloc[1:].reset_index(drop=True))
+
+    result = flush_sheet_journal("Sheet1")
+    assert result["written"] == [1]
+    df = read_sheet_dataframe("Sheet1")
+    assert df.loc[0, [ROW_ID_COLUMN, "instruction_ats"]].tolist() == ["R-b", "Kategori 2"]
+    assert df.loc[1, "instruction_ats"] == ""